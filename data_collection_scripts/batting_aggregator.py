@@ -0,0 +1,52 @@
+import pandas as pd
+'''
+Season level team batting aggregation for the Retrosheet event parsers. Instead of filtering every game's events
+five or six times to count plate appearances, at bats, hits, walks, etc., every (GAME_ID, BAT_HOME_ID) pair of a
+season is aggregated in a single groupby pass over the event columns. Used by event_parser.py and
+event_parser_ADV.py when batting_mode = 'season'.
+'''
+
+BATTING_KEYS = ['GAME_ID', 'BAT_HOME_ID']
+
+BATTING_COLS = ['PA', 'AB', 'H', '1B', '2B', '3B', 'HR', 'TB', 'BB', 'IBB', 'HBP', 'R']
+
+def aggregate_batting(season_df):
+    '''
+    Aggregate team batting statistics for every game and team of a season in one groupby pass
+        Args:
+            - season_df [pandas.DataFrame]: DataFrame of all season events (Retrosheet event file columns)
+        Returns:
+            - [pandas.DataFrame]: one row per (GAME_ID, BAT_HOME_ID), columns BATTING_COLS. BB counts
+                unintentional walks only (EVENT_CD 14), IBB intentional walks (EVENT_CD 15)
+    '''
+    event_cd = season_df.EVENT_CD.to_numpy()
+    h_fl = season_df.H_FL.to_numpy()
+    indicators = pd.DataFrame({'GAME_ID' : season_df.GAME_ID.to_numpy(),
+                               'BAT_HOME_ID' : season_df.BAT_HOME_ID.to_numpy(),
+                               'PA' : season_df.GAME_PA_CT.to_numpy(),
+                               'AB' : (season_df.AB_FL.to_numpy() == 'T').astype('int64'),
+                               'H' : (h_fl != 0).astype('int64'),
+                               '1B' : (event_cd == 20).astype('int64'),
+                               '2B' : (event_cd == 21).astype('int64'),
+                               '3B' : (event_cd == 22).astype('int64'),
+                               'HR' : (event_cd == 23).astype('int64'),
+                               'TB' : h_fl.astype('int64'),
+                               'BB' : (event_cd == 14).astype('int64'),
+                               'IBB' : (event_cd == 15).astype('int64'),
+                               'HBP' : (event_cd == 16).astype('int64'),
+                               'R' : season_df.EVENT_RUNS_CT.to_numpy().astype('int64')})
+    aggregations = {col : (col, 'sum') for col in BATTING_COLS}
+    aggregations['PA'] = ('PA', 'max')
+    batting = indicators.groupby(BATTING_KEYS, sort = False, observed = True).agg(**aggregations)
+    batting['PA'] = batting['PA'] + 1
+    return(batting[BATTING_COLS])
+
+def batting_lookup(season_df):
+    '''
+    Aggregate season batting and index the result for per game lookups
+        Args:
+            - season_df [pandas.DataFrame]: DataFrame of all season events
+        Returns:
+            - [dict]: {(GAME_ID, BAT_HOME_ID) : {stat : value}} for every game and team in the season
+    '''
+    return(aggregate_batting(season_df).to_dict('index'))
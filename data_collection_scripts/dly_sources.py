@@ -0,0 +1,216 @@
+import json
+import os
+import threading
+from ftplib import FTP, error_perm
+"""
+Sources of NOAA GHCN .dly station files for noaa_weather_collection.WeatherCollector, and a local cache of the raw
+files. A source reports a signature of each remote file (size and modification time) and fetches its contents, so a
+collector can keep the files it already downloaded and only transfer stations whose signature changed. FtpSource keeps
+one FTP connection per worker thread, LocalSource reads a directory of .dly files (a mirror, or a stand-in for tests).
+"""
+
+FTP_SERVER = 'ftp.ncdc.noaa.gov'
+FTP_PATH = 'pub/data/ghcn/daily/all/'
+CACHE_DIR = 'data/dly_cache/'
+
+class FtpSource():
+    """
+    .dly files on an FTP server, one connection per thread using the source
+    """
+    def __init__(self, ftp_server = FTP_SERVER, ftp_path = FTP_PATH):
+        """
+        Initialize FTP source
+            Args:
+                - ftp_server (str): URL for NOAA FTP server
+                - ftp_path (str): Path to directory containing .dly files for all stations in NOAA GHCN
+            Returns:
+                - None
+        """
+        self.ftp_server = ftp_server
+        self.ftp_path = ftp_path
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+
+    def connection(self):
+        """
+        FTP connection of the calling thread, logged in and in the GHCN directory, opened on first use
+        """
+        ftp = getattr(self.local, 'ftp', None)
+        if ftp is None:
+            ftp = FTP(self.ftp_server)
+            ftp.login()
+            ftp.cwd(self.ftp_path)
+            ftp.voidcmd('TYPE I')
+            self.local.ftp = ftp
+            with self.lock:
+                self.connections.append(ftp)
+        return(ftp)
+
+    def reset(self):
+        """
+        Drop the calling thread's connection after an error, the next request opens a new one
+        """
+        ftp = getattr(self.local, 'ftp', None)
+        self.local.ftp = None
+        if ftp is not None:
+            with self.lock:
+                self.connections.remove(ftp)
+            ftp.close()
+
+    def signature(self, station):
+        """
+        Size and modification time of a station's remote .dly file
+            Args:
+                - station (str): station ID
+            Returns:
+                - list: [size, modification time], time is None if the server does not support MDTM
+        """
+        ftp = self.connection()
+        file_name = station + '.dly'
+        size = ftp.size(file_name)
+        try:
+            modified = ftp.voidcmd('MDTM ' + file_name).split()[-1]
+        except error_perm:
+            modified = None
+        return([size, modified])
+
+    def fetch(self, station):
+        """
+        Download a station's .dly file
+            Args:
+                - station (str): station ID
+            Returns:
+                - bytes: contents of the file
+        """
+        chunks = []
+        self.connection().retrbinary('RETR ' + station + '.dly', chunks.append)
+        return(b''.join(chunks))
+
+    def close(self):
+        """
+        Close every connection opened by the source
+        """
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for ftp in connections:
+            try:
+                ftp.quit()
+            except Exception:
+                ftp.close()
+        self.local = threading.local()
+
+class LocalSource():
+    """
+    .dly files in a local directory
+    """
+    def __init__(self, directory):
+        """
+        Initialize local source
+            Args:
+                - directory (str): directory containing {station}.dly files
+            Returns:
+                - None
+        """
+        self.directory = directory
+
+    def signature(self, station):
+        stat = os.stat(os.path.join(self.directory, station + '.dly'))
+        return([stat.st_size, stat.st_mtime_ns])
+
+    def fetch(self, station):
+        with open(os.path.join(self.directory, station + '.dly'), 'rb') as f:
+            return(f.read())
+
+    def reset(self):
+        return
+
+    def close(self):
+        return
+
+class DlyCache():
+    """
+    Raw .dly files saved locally with the signature of the remote file they were downloaded from
+    """
+    def __init__(self, cache_dir = CACHE_DIR):
+        """
+        Initialize cache, signatures are kept in {cache_dir}/signatures.json
+            Args:
+                - cache_dir (str): directory of the cached files
+            Returns:
+                - None
+        """
+        self.cache_dir = cache_dir
+        self.index_file = os.path.join(cache_dir, 'signatures.json')
+        self.lock = threading.Lock()
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.signatures = {}
+        if os.path.exists(self.index_file):
+            with open(self.index_file, 'r') as f:
+                self.signatures = json.load(f)
+
+    def path(self, station):
+        return(os.path.join(self.cache_dir, station + '.dly'))
+
+    def get(self, station, signature):
+        """
+        Cached contents of a station's file if it was downloaded with the same signature
+            Args:
+                - station (str): station ID
+                - signature (list): current signature of the remote file
+            Returns:
+                - bytes: contents of the file, None if the station is not cached or changed
+        """
+        with self.lock:
+            cached = self.signatures.get(station)
+        if cached != signature or not os.path.exists(self.path(station)):
+            return(None)
+        with open(self.path(station), 'rb') as f:
+            return(f.read())
+
+    def put(self, station, signature, content):
+        """
+        Save a downloaded file under a temporary name and rename it, then record its signature
+            Args:
+                - station (str): station ID
+                - signature (list): signature of the remote file
+                - content (bytes): contents of the file
+            Returns:
+                - None
+        """
+        temp_file = self.path(station) + '.tmp'
+        with open(temp_file, 'wb') as f:
+            f.write(content)
+        os.replace(temp_file, self.path(station))
+        with self.lock:
+            self.signatures[station] = signature
+
+    def save(self):
+        """
+        Write the signatures of every cached file
+        """
+        with self.lock:
+            signatures = dict(self.signatures)
+        temp_file = self.index_file + '.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump(signatures, f)
+        os.replace(temp_file, self.index_file)
+
+    def load(self, source, station):
+        """
+        Contents of a station's file, from the cache if unchanged at the source, downloaded otherwise
+            Args:
+                - source (FtpSource or LocalSource): source of the file
+                - station (str): station ID
+            Returns:
+                - bytes: contents of the file
+                - bool: True if the file was downloaded
+        """
+        signature = source.signature(station)
+        content = self.get(station, signature)
+        if content is not None:
+            return(content, False)
+        content = source.fetch(station)
+        self.put(station, signature, content)
+        return(content, True)
@@ -1,41 +1,57 @@
 import glob
-import pandas as pd 
+import pandas as pd
+'''
+Doubleheader flags shared by the data pipelines. Frames with several games per team and date cannot be merged on
+(date, team) alone, so the second game of a doubleheader is flagged is_doubleheader and the third game of a
+tripleheader is_tripleheader (the second game of a tripleheader is flagged is_doubleheader). Frames without game ids
+are flagged by the position of each game within its (team, date) group, Retrosheet game ids carry the game number.
+'''
 
-starter_frames = []
-starter_files = glob.glob('./aggregated_event_files/starter_stats_*.csv')
-for file in starter_files:
-    df = pd.read_csv(file)
-    df['date'] = pd.to_datetime(df['date'], format = '%Y-%m-%d')
-    df['year'] = pd.DatetimeIndex(df.date).year
-    df = df.sort_values(by = ['date']).reset_index(drop = True)
-    
-    df = df.assign(is_doubleheader = 0, is_tripleheader = 0)
-    game_counts = df.groupby('team_code').date.value_counts()
+TEAM_DATE_KEYS = ['team_code', 'date']
 
-    double_headers = game_counts[game_counts == 2]
-    triple_headers = game_counts[game_counts > 2]
+def flag_doubleheaders(df, keys = TEAM_DATE_KEYS):
+    '''
+    Flag doubleheaders and tripleheaders of every team in a single pass, games are numbered in frame order within
+    each (team, date) group. Dates with more than three games are not flagged.
+        Args:
+            - df [pandas.DataFrame]: one row per team and game, sorted so games of the same date are in order
+            - keys [list]: columns identifying a team and date
+        Returns:
+            - [pandas.DataFrame]: df with integer is_doubleheader and is_tripleheader columns
+    '''
+    grouped = df.groupby(keys, sort = False)
+    game_number = grouped.cumcount()
+    n_games = grouped[keys[0]].transform('size')
+    return(df.assign(is_doubleheader = ((game_number == 1) & (n_games <= 3)).astype('int64'),
+                     is_tripleheader = ((game_number == 2) & (n_games == 3)).astype('int64')))
 
-    all_double_headers = []
-    for j in double_headers.index:
-        all_double_headers.append(j)
+def game_number_flags(game_id):
+    '''
+    Doubleheader flags of a single game from the game number digit of its Retrosheet game id
+        Args:
+            - game_id [str]: Retrosheet game id, e.g. 'NYA201907042'
+        Returns:
+            - [int]: is_doubleheader, 1 for the second game of the day
+            - [int]: is_tripleheader, 1 for the third game of the day
+    '''
+    return(int(game_id[11] == '2'), int(game_id[11] == '3'))
 
-    all_triple_headers = []
-    for k in triple_headers.index:
-        all_triple_headers.append(k)
+def flag_starters(starter_files):
+    '''
+    Read every season of starting pitcher statistics and flag doubleheaders
+        Args:
+            - starter_files [list]: locations of starter_stats_{year}.csv files (event_parser.py)
+        Returns:
+            - [list]: one DataFrame per season
+    '''
+    starter_frames = []
+    for file in starter_files:
+        df = pd.read_csv(file)
+        df['date'] = pd.to_datetime(df['date'], format = '%Y-%m-%d')
+        df['year'] = pd.DatetimeIndex(df.date).year
+        df = df.sort_values(by = ['date']).reset_index(drop = True)
+        starter_frames.append(flag_doubleheaders(df))
+    return(starter_frames)
 
-    for index in all_double_headers:
-        game_indices = df[(df.team_code == index[0]) & (df.date == index[1])].index
-        if len(game_indices) > 1:
-            df.at[game_indices[1], 'is_doubleheader'] = 1
-        else:
-            print(index)
-
-    for index_ in all_triple_headers:
-        game_indices_ = df[(df.team_code == index_[0]) & (df.date == index_[1])].index
-        if len(game_indices_) == 3:
-            df.at[game_indices_[1], 'is_doubleheader'] = 1
-            df.at[game_indices_[2], 'is_tripleheader'] = 1
-        else:
-            print(index_)
-    starter_frames.append(df)
-    
\ No newline at end of file
+if __name__ == '__main__':
+    starter_frames = flag_starters(glob.glob('./aggregated_event_files/starter_stats_*.csv'))
@@ -0,0 +1,155 @@
+import hashlib
+import glob
+import os
+import pandas as pd
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+'''
+Columnar, typed loader for the Chadwick-parsed Retrosheet event files (all*.csv). The event files have ~160 columns
+but the parsers only use the columns listed in EVENT_DTYPES, so only those are read, with an explicit dtype map
+(categoricals for ids, int8/int16 for flags and counts) instead of letting pandas infer dtypes over every column.
+Each parsed season is cached as Parquet (or Feather) keyed on the source file's size and modification time (or its
+content hash), so later runs skip CSV parsing entirely. Caching requires pyarrow, without it seasons are read from
+the .csv every time.
+'''
+
+'''
+Columns used by event_parser.py and event_parser_ADV.py, and the dtype each one is read as
+'''
+EVENT_DTYPES = {'GAME_ID' : 'category',
+                'AWAY_TEAM_ID' : 'category',
+                'INN_CT' : 'int8',
+                'BAT_HOME_ID' : 'int8',
+                'OUTS_CT' : 'int8',
+                'RESP_PIT_ID' : 'category',
+                'EVENT_TX' : 'object',
+                'EVENT_CD' : 'int8',
+                'AB_FL' : 'category',
+                'H_FL' : 'int8',
+                'EVENT_OUTS_CT' : 'int8',
+                'EVENT_RUNS_CT' : 'int8',
+                'RUN1_RESP_PIT_ID' : 'category',
+                'RUN2_RESP_PIT_ID' : 'category',
+                'RUN3_RESP_PIT_ID' : 'category',
+                'GAME_PA_CT' : 'int16',
+                'RESP_PIT_START_FL' : 'category'}
+
+CACHE_FORMATS = ('parquet', 'feather')
+
+def load_season(file_name, header, cache_dir = None, cache_format = 'parquet', dtypes = EVENT_DTYPES,
+                hash_contents = False):
+    '''
+    Load the parser columns of one season event file, from the cache when it is current
+        Args:
+            - file_name [str]: location of Chadwick-parsed season .csv (no header row)
+            - header [list]: column names of the event file, in file order (all_event_header.json)
+            - cache_dir [str]: directory for cached seasons, None to always read the .csv
+            - cache_format [str]: 'parquet' or 'feather'
+            - dtypes [dict]: {column : dtype} of the columns to read
+            - hash_contents [bool]: key the cache on a hash of the file contents instead of size and mtime
+        Returns:
+            - [pandas.DataFrame]: season events, columns in file order
+    '''
+    if cache_format not in CACHE_FORMATS:
+        raise ValueError('Unknown cache format: {}'.format(cache_format))
+    if cache_dir is None or pyarrow is None:
+        return(read_season(file_name, header, dtypes))
+    cache_file = cache_path(file_name, cache_dir, cache_format, dtypes, hash_contents)
+    if os.path.exists(cache_file):
+        if cache_format == 'parquet':
+            return(pd.read_parquet(cache_file))
+        return(pd.read_feather(cache_file))
+    season_df = read_season(file_name, header, dtypes)
+    write_cache(season_df, cache_file, cache_format)
+    return(season_df)
+
+def read_season(file_name, header, dtypes = EVENT_DTYPES):
+    '''
+    Read the parser columns of one season event file from .csv
+        Args:
+            - file_name [str]: location of Chadwick-parsed season .csv (no header row)
+            - header [list]: column names of the event file, in file order
+            - dtypes [dict]: {column : dtype} of the columns to read
+        Returns:
+            - [pandas.DataFrame]: season events
+    '''
+    missing = [col for col in dtypes if col not in header]
+    if len(missing) != 0:
+        raise KeyError('Columns missing from event header: {}'.format(missing))
+    return(pd.read_csv(file_name, header = None, names = header, usecols = list(dtypes), dtype = dtypes))
+
+def cache_key(file_name, dtypes = EVENT_DTYPES, hash_contents = False):
+    '''
+    Key identifying one version of a season file and the columns read from it
+        Args:
+            - file_name [str]: location of season .csv
+            - dtypes [dict]: {column : dtype} of the columns read
+            - hash_contents [bool]: hash the file contents instead of its size and mtime
+        Returns:
+            - [str]: hex digest
+    '''
+    key = hashlib.sha1()
+    if hash_contents:
+        key.update(file_digest(file_name).encode())
+    else:
+        stat = os.stat(file_name)
+        key.update('{}-{}'.format(stat.st_size, stat.st_mtime_ns).encode())
+    key.update(repr(sorted(dtypes.items())).encode())
+    return(key.hexdigest())
+
+def file_digest(file_name, chunk_size = 1 << 20):
+    '''
+    SHA-1 of a file's contents, read in chunks
+        Args:
+            - file_name [str]: location of file
+            - chunk_size [int]: bytes read at a time
+        Returns:
+            - [str]: hex digest
+    '''
+    digest = hashlib.sha1()
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return(digest.hexdigest())
+
+def cache_path(file_name, cache_dir, cache_format = 'parquet', dtypes = EVENT_DTYPES, hash_contents = False):
+    '''
+    Location of the cached copy of a season file
+        Args:
+            - file_name [str]: location of season .csv
+            - cache_dir [str]: directory for cached seasons
+            - cache_format [str]: 'parquet' or 'feather'
+            - dtypes [dict]: {column : dtype} of the columns read
+            - hash_contents [bool]: key the cache on the file contents
+        Returns:
+            - [str]: '{cache_dir}/{season file name}.{key}.{cache_format}'
+    '''
+    stem = os.path.splitext(os.path.basename(file_name))[0]
+    key = cache_key(file_name, dtypes, hash_contents)[0:16]
+    return(os.path.join(cache_dir, '{}.{}.{}'.format(stem, key, cache_format)))
+
+def write_cache(season_df, cache_file, cache_format = 'parquet'):
+    '''
+    Write a season to the cache, replacing older cached versions of the same season file. The file is written
+    under a temporary name and renamed, so an interrupted run never leaves a partial cache entry.
+        Args:
+            - season_df [pandas.DataFrame]: season events
+            - cache_file [str]: location generated by cache_path()
+            - cache_format [str]: 'parquet' or 'feather'
+        Returns:
+            None
+    '''
+    cache_dir = os.path.dirname(cache_file)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    stem = os.path.basename(cache_file).split('.')[0]
+    for stale in glob.glob(os.path.join(cache_dir, '{}.*.{}'.format(stem, cache_format))):
+        os.remove(stale)
+    temp_file = cache_file + '.tmp'
+    if cache_format == 'parquet':
+        season_df.to_parquet(temp_file, index = False)
+    else:
+        season_df.reset_index(drop = True).to_feather(temp_file)
+    os.replace(temp_file, cache_file)
@@ -1,10 +1,16 @@
 import json
 import re
+import numpy as np
 import pandas as pd 
 import datetime
 import sys
 import glob
 import os
+import inspect
+from batting_aggregator import batting_lookup
+from runner_advance import charge_lookup
+from event_loader import load_season
+from season_manifest import SeasonManifest, parser_version
 ''' 
 RetrosheetEventFileParser is an object designed to parse Retrosheet play-by-play files into game level statistics. Each observation in the play-by-play
 files represents a single play from a baseball game: a hit, stolen base, out, wild pitch, etc. There are over 13 million of these event observations,
@@ -53,40 +59,74 @@ Specify location of Retrosheet event files csvs (parsed from .EVN to .csv by Cha
 '''
 PATH = './parsed/'
 
+'''
+Specify location of typed season caches written by event_loader (None to always read the .csv files)
+'''
+CACHE_DIR = './parsed/cache/'
+
 '''
 Specify output directory of 
 '''
 EXPORT_DIR = './aggregated_event_files/'
 
+'''
+Source files that determine the parsed output, a change to any of them re-parses every season
+'''
+PARSER_SOURCES = [os.path.abspath(__file__)] + [inspect.getsourcefile(func) for func in (batting_lookup, charge_lookup, load_season)]
+
 class RetrosheetEventFileParser():
     '''
     Parent class to parse 13 million Retrosheet event observations into game level observations for analysis
     '''
-    def __init__(self, input_dir = PATH, export_dir = EXPORT_DIR, header = ALL_HEADER):
+    def __init__(self, input_dir = PATH, export_dir = EXPORT_DIR, header = ALL_HEADER, engine = 'grouped',
+                batting_mode = 'season', earned_run_mode = 'season', cache_dir = CACHE_DIR, incremental = True):
         '''
         Initialize parser class
             Args:
                 - input_dir [str]: directory where Chadwick-parsed Retrosheet EVN .csvs are located
                 - export_dir [str]: directory to write parsed output files to
                 - header [list]: list of column names for Retrosheet Event files, scraped from Retrosheet.org
+                - engine [str]: season engine used to split each season into games
+                    'grouped' : split the season once by GAME_ID offsets (GroupedSeasonRecreator)
+                    'mask' : filter the season with a boolean mask per game (SeasonRecreator)
+                - batting_mode [str]: how team batting statistics are collected
+                    'season' : aggregate every game of the season in one groupby pass (batting_aggregator.py)
+                    'game' : filter each game's events per statistic (GameRecreator.get_batting)
+                - earned_run_mode [str]: how runs are charged to starters and bullpens
+                    'season' : parse every EVENT_TX of the season once and charge runs in bulk (runner_advance.py)
+                    'game' : parse run events game by game (GameRecreator.get_pitching)
+                - cache_dir [str]: directory for typed season caches (event_loader.py), None to disable caching
+                - incremental [bool]: skip seasons whose event file and parser code are unchanged since they were last
+                    parsed (season_manifest.py), False to re-parse every season
         '''
         self.input_dir = input_dir
         self.export_dir = export_dir
         self.header = header
+        self.engine = engine
+        self.batting_mode = batting_mode
+        self.earned_run_mode = earned_run_mode
+        self.cache_dir = cache_dir
+        self.incremental = incremental
 
     def parse_events(self):
         '''
         Create output directory, generate list of season event files in input directory, iterate through
-        seasons and write outpute to files via child class SeasonRecreator
+        seasons and write outpute to files via child class SeasonRecreator. Seasons recorded in the export 
+        directory's manifest as parsed from the same event file by the same parser code are skipped.
             Args:
                 None
             Returns:
                 None
         '''
         self.make_dir(self.export_dir)
+        manifest = SeasonManifest(self.export_dir, parser_version(PARSER_SOURCES))
         event_files = self.get_files(self.input_dir)
         for file in event_files:
-            season = SeasonRecreator(file)
+            if self.incremental and manifest.is_current(file):
+                print('Skipping {}, unchanged since last parsed'.format(file))
+                continue
+            fingerprint = manifest.fingerprint(file)
+            season = self.make_season(file)
             try:
                 season.create_season_record()
             except (KeyboardInterrupt, SystemExit):
@@ -94,7 +134,9 @@ class RetrosheetEventFileParser():
             except:
                 print('Files could not be written for {}, {}, {}'.format(file, sys.exc_info()[0], sys.exc_info()[1]))
                 continue
+            manifest.record(file, fingerprint, season.outputs)
             print('Files successfully parsed and written for {}'.format(file))
+        manifest.save()
 
     @staticmethod
     def make_dir(export_dir):
@@ -109,6 +151,25 @@ class RetrosheetEventFileParser():
             os.makedirs(export_dir)
         print('Output Directory {} created'.format(export_dir))
 
+    def make_season(self, file_name):
+        ''' 
+        Create season object for the engine and modes provided in __init__ - called in parse_events()
+            Args:
+                - file_name [str]: location of season .csv file
+            Returns:
+                - [SeasonRecreator]: season object
+        '''
+        options = {'export_dir' : self.export_dir,
+                   'batting_mode' : self.batting_mode,
+                   'earned_run_mode' : self.earned_run_mode,
+                   'cache_dir' : self.cache_dir}
+        if self.engine == 'grouped':
+            return(GroupedSeasonRecreator(file_name, **options))
+        elif self.engine == 'mask':
+            return(SeasonRecreator(file_name, **options))
+        else:
+            raise ValueError('Unknown season engine: {}'.format(self.engine))
+
     @staticmethod
     def get_files(input_dir):
         ''' 
@@ -124,18 +185,32 @@ class SeasonRecreator(RetrosheetEventFileParser):
     ''' 
     Child class, recreate individual seasons from all*.csv files
     '''
-    def __init__(self, file_name):
+    def __init__(self, file_name, export_dir = EXPORT_DIR, batting_mode = 'season', earned_run_mode = 'season', 
+                cache_dir = None):
         ''' 
         Initialize season class
             Args:
                 - file_name [str]: location of .csv file (generated by Parent class method .get_files())
+                - export_dir [str]: directory to write the season's output files to
+                - batting_mode [str]: 'season' to aggregate team batting for the whole season at once, 
+                    'game' to collect it game by game
+                - earned_run_mode [str]: 'season' to charge runs for the whole season at once, 'game' to charge 
+                    them game by game
+                - cache_dir [str]: directory for typed season caches, None to read the .csv every time
         '''
         self.file_name = file_name
+        self.batting_mode = batting_mode
+        self.earned_run_mode = earned_run_mode
+        self.cache_dir = cache_dir
         self.base_df = None
+        self.batting = None
+        self.charges = None
         self.team_log = []
         self.starter_log = []
         self.error_log = []
-        super().__init__(self)
+        self.outputs = []
+        super().__init__(self, export_dir = export_dir, batting_mode = batting_mode, earned_run_mode = earned_run_mode, 
+                        cache_dir = cache_dir)
     
     def create_season_record(self):
         ''' 
@@ -153,6 +228,7 @@ class SeasonRecreator(RetrosheetEventFileParser):
         starter_fn = '{}starter_stats_{}.csv'.format(self.export_dir, year)
         team_frame.to_csv(team_fn, header = True, index = False)
         starter_frame.to_csv(starter_fn, header = True, index = False)
+        self.outputs = [team_fn, starter_fn]
         
     def create_season(self):
         ''' 
@@ -162,24 +238,41 @@ class SeasonRecreator(RetrosheetEventFileParser):
             Returns:
                 None
         '''
-        self.base_df = pd.read_csv(self.file_name, header = None, low_memory = False)
-        self.base_df.columns = self.header
-        all_ids = self.base_df.GAME_ID.unique()
-        for id in all_ids:
-            game = GameRecreator(self.base_df, id)
+        self.base_df = load_season(self.file_name, self.header, cache_dir = self.cache_dir)
+        if self.batting_mode == 'season':
+            self.batting = batting_lookup(self.base_df)
+        elif self.batting_mode != 'game':
+            raise ValueError('Unknown batting mode: {}'.format(self.batting_mode))
+        if self.earned_run_mode == 'season':
+            self.charges = charge_lookup(self.base_df)
+        elif self.earned_run_mode != 'game':
+            raise ValueError('Unknown earned run mode: {}'.format(self.earned_run_mode))
+        for game in self.generate_games():
             try:
                 game.create_game()
             except (KeyboardInterrupt, SystemExit):
                 raise
             except:
-                print('There was an error {} parsing {}'.format(sys.exc_info()[0], id))
-                self.error_log.append((id, sys.exc_info()[1]))
+                print('There was an error {} parsing {}'.format(sys.exc_info()[0], game.game_id))
+                self.error_log.append((game.game_id, sys.exc_info()[1]))
                 continue
             self.team_log.append(game.home_stats)
             self.team_log.append(game.away_stats)
             self.starter_log.append(game.home_starter)
             self.starter_log.append(game.away_starter)
 
+    def generate_games(self):
+        ''' 
+        Generate one GameRecreator per game, each filtering the season DataFrame by GAME_ID
+            Args:
+                None
+            Returns:
+                - [generator]: GameRecreator objects in order of first appearance
+        '''
+        all_ids = self.base_df.GAME_ID.unique()
+        for id in all_ids:
+            yield(GameRecreator(self.base_df, id, batting = self.batting, charges = self.charges))
+
     @staticmethod
     def get_year(file):
         ''' 
@@ -192,21 +285,73 @@ class SeasonRecreator(RetrosheetEventFileParser):
         year_match = '([\d]{4})'
         return(re.findall(year_match, file)[0])    
 
+class GroupedSeasonRecreator(SeasonRecreator):
+    ''' 
+    Child class, recreate individual seasons by splitting the season DataFrame once. Events are grouped by 
+    GAME_ID a single time and every game receives a positional slice of the season instead of scanning 
+    the full season with a boolean mask. Output files are identical to SeasonRecreator.
+    '''
+    def generate_games(self):
+        ''' 
+        Generate one GameRecreator per game from GAME_ID offsets
+            Args:
+                None
+            Returns:
+                - [generator]: GameRecreator objects in order of first appearance
+        '''
+        self.base_df, game_ids, offsets = self.split_games(self.base_df)
+        for k in range(len(game_ids)):
+            game_df = self.base_df.iloc[offsets[k]:offsets[k + 1]]
+            yield(GameRecreator(self.base_df, game_ids[k], game_df = game_df, batting = self.batting, 
+                                charges = self.charges))
+
+    @staticmethod
+    def split_games(base_df):
+        ''' 
+        Factory method, order season events so each game is one contiguous block and compute block offsets.
+        Chadwick writes games contiguously, so the season is only reordered (stable, event order preserved 
+        within each game) when a game's events are split across the file.
+            Args:
+                - base_df [pandas.DataFrame]: DataFrame of all season events
+            Returns:
+                - [pandas.DataFrame]: season events, contiguous by game
+                - [numpy.ndarray]: game ids in order of first appearance
+                - [numpy.ndarray]: start offset of each game, followed by the total number of events
+        '''
+        codes, game_ids = pd.factorize(base_df.GAME_ID)
+        if (codes < 0).any():
+            base_df = base_df[codes >= 0]
+            codes = codes[codes >= 0]
+        if (np.diff(codes) < 0).any():
+            order = np.argsort(codes, kind = 'stable')
+            base_df = base_df.take(order)
+            codes = codes[order]
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength = len(game_ids)))])
+        return(base_df, np.asarray(game_ids), offsets)
+
 class GameRecreator():
     ''' 
     Worker class, parses N game events in to four dictionaries: home and away team stats, home and away starter stats
     '''
-    def __init__(self, base_df, game_id):
+    def __init__(self, base_df, game_id, game_df = None, batting = None, charges = None):
         ''' 
         Initialize game class
             Args:
                 - base_df [pandas.DataFrame]: DataFrame of all season events for a given season
                 - game_id [str]: Retrosheet id for game. 
                     format: '[home_team_code]{3}[date, %Y%m%d']{8}[game_number]{1}'
+                - game_df [pandas.DataFrame]: Optional, pre-split events for this game. If None, the 
+                    game is filtered from base_df in create_game()
+                - batting [dict]: Optional, season batting lookup generated by batting_aggregator.batting_lookup(). 
+                    If None, batting statistics are collected from game_df
+                - charges [dict]: Optional, season run charges generated by runner_advance.charge_lookup(). If None, 
+                    runs are charged from game_df
         '''
         self.base_df = base_df
         self.game_id = game_id
-        self.game_df = None
+        self.game_df = game_df
+        self.batting = batting
+        self.charges = charges
         self.home_team = None
         self.away_team = None
         self.game_date = None
@@ -223,10 +368,11 @@ class GameRecreator():
             Returns:
                 None
         '''
-        self.game_df = self.base_df[self.base_df.GAME_ID == self.game_id].reset_index(drop = True)
-        self.home_team = self.game_df.GAME_ID.max()[0:3]
-        self.away_team = self.game_df.AWAY_TEAM_ID.max()
-        self.game_date = datetime.datetime.strptime(self.game_df.GAME_ID.max()[3:11], '%Y%m%d').strftime('%Y-%m-%d')
+        if self.game_df is None:
+            self.game_df = self.base_df[self.base_df.GAME_ID == self.game_id].reset_index(drop = True)
+        self.home_team = self.game_id[0:3]
+        self.away_team = self.game_df.AWAY_TEAM_ID.iloc[0]
+        self.game_date = datetime.datetime.strptime(self.game_id[3:11], '%Y%m%d').strftime('%Y-%m-%d')
         self.collect_offensive_stats()
         self.collect_pitching()
     
@@ -240,8 +386,12 @@ class GameRecreator():
         '''
         home_batting = self.initialize_batting_dict(self.game_date, self.home_team, home = True)
         away_batting = self.initialize_batting_dict(self.game_date, self.away_team)
-        self.home_stats = self.get_batting(self.game_df, home_batting, home = True)
-        self.away_stats = self.get_batting(self.game_df, away_batting)
+        if self.batting is not None and (self.game_id, 1) in self.batting and (self.game_id, 0) in self.batting:
+            self.home_stats = self.lookup_batting(self.batting[(self.game_id, 1)], home_batting)
+            self.away_stats = self.lookup_batting(self.batting[(self.game_id, 0)], away_batting)
+        else:
+            self.home_stats = self.get_batting(self.game_df, home_batting, home = True)
+            self.away_stats = self.get_batting(self.game_df, away_batting)
 
     def collect_pitching(self):
         ''' 
@@ -255,14 +405,20 @@ class GameRecreator():
         away_starter = self.initialize_pitching_dict(self.game_date, self.away_team, self.home_team, starter = True)
         home_relief = self.initialize_pitching_dict(self.game_date, self.home_team, self.away_team)
         away_relief = self.initialize_pitching_dict(self.game_date, self.away_team, self.home_team)
-        self.home_starter, h_r = self.get_pitching(self.game_df, home_starter, home_relief, home = True)
-        self.away_starter, a_r = self.get_pitching(self.game_df, away_starter, away_relief)
+        if self.charges is not None:
+            home_charges = self.charges.get((self.game_id, 0))
+            away_charges = self.charges.get((self.game_id, 1))
+        else:
+            home_charges, away_charges = None, None
+        self.home_starter, h_r = self.get_pitching(self.game_df, home_starter, home_relief, home = True, 
+                                                    charges = home_charges)
+        self.away_starter, a_r = self.get_pitching(self.game_df, away_starter, away_relief, charges = away_charges)
         self.home_stats.update(h_r)
         self.away_stats.update(a_r)
 
 
     @staticmethod
-    def get_pitching(game_df, starter_dict, relief_dict, home = False):
+    def get_pitching(game_df, starter_dict, relief_dict, home = False, charges = None):
         ''' 
         Factory method to parse game events into game pitching statistics
             Args:
@@ -270,6 +426,8 @@ class GameRecreator():
                 - starter_dict [dict]: Initialized dictionary to record starting pitcher stats
                 - relief_dict [dict]: Initalized dictionary to record relief pitcher stats
                 - home [bool]: Boolean flag to indicate home or away team
+                - charges [dict]: Optional, season run charges for this team's pitchers (runner_advance.py). 
+                    If None, run events are parsed from game_df
             Returns: 
                 - starter_dict [dict]: Dictionary of starting pitcher stats
                 - relief_dict [dict]: Dictionary of relief pitcher stats
@@ -301,6 +459,10 @@ class GameRecreator():
                 relief_events = game_df[(game_df.BAT_HOME_ID ==1) & (game_df.RESP_PIT_ID != de_facto_starter)]
         
         starter_dict['starter_code'] = starter_events.iloc[0]['RESP_PIT_ID']
+        if charges is not None and charges['starter'] != starter_dict['starter_code']:
+            charges = None
+        if charges is not None and charges['malformed']:
+            raise ValueError('Unreadable runner advance charged to {}'.format(starter_dict['starter_code']))
         #Account for complete games: No relief events
         if len(relief_events) == 0:
             starter_dict['IP'] = starter_events.iloc[-1]['INN_CT']
@@ -309,10 +471,11 @@ class GameRecreator():
             starter_dict['K'] = len(starter_events[starter_events.EVENT_CD == 3])
             starter_unearned = 0 
             starter_total_runs = starter_events.EVENT_RUNS_CT.sum()
-            starter_run_events = starter_events[starter_events.EVENT_RUNS_CT != 0]
-            for j in range(len(starter_run_events)):
-                unearned_runs = re.findall(unearned_flag, starter_run_events.iloc[j]['EVENT_TX'])
-                starter_unearned += len(unearned_runs)
+            if charges is None:
+                starter_run_events = starter_events[starter_events.EVENT_RUNS_CT != 0]
+                for j in range(len(starter_run_events)):
+                    unearned_runs = re.findall(unearned_flag, starter_run_events.iloc[j]['EVENT_TX'])
+                    starter_unearned += len(unearned_runs)
             starter_dict['ER'] = starter_total_runs
 
             for key in relief_dict.keys():
@@ -336,20 +499,25 @@ class GameRecreator():
             relief_unearned = 0
 
             starter_total_runs = starter_events.EVENT_RUNS_CT.sum()
-            starter_run_events = starter_events[starter_events.EVENT_RUNS_CT != 0]
             ''' 
             In the 160 features provided for each of the 13 million Retrosheet events, somehow EarnedRun and who the 
             EarnedRun is charged to is not among them. It is possible to find this from the given data, but it requires some 
             massaging. The remainder of this method determines how many of the scored runs were earned and who each run needs
             to be charged to. 
             '''
-            for j in range(len(starter_run_events)):
-                unearned_runs = re.findall(unearned_flag, starter_run_events.iloc[j]['EVENT_TX'])
-                starter_unearned += len(unearned_runs)
+            if charges is not None:
+                starter_unearned = charges['starter_unearned']
+                relief_unearned = charges['relief_unearned']
+                inherited_runners_scored = charges['inherited_scored']
+            else:
+                starter_run_events = starter_events[starter_events.EVENT_RUNS_CT != 0]
+                for j in range(len(starter_run_events)):
+                    unearned_runs = re.findall(unearned_flag, starter_run_events.iloc[j]['EVENT_TX'])
+                    starter_unearned += len(unearned_runs)
 
             starter_total_runs -= starter_unearned
 
-            if removed_mid_inning:
+            if removed_mid_inning and charges is None:
                 starter_resp_runners = relief_events[(relief_events.RUN1_RESP_PIT_ID == starter_dict['starter_code']) |
                                         (relief_events.RUN2_RESP_PIT_ID == starter_dict['starter_code']) |
                                         (relief_events.RUN3_RESP_PIT_ID == starter_dict['starter_code'])]
@@ -393,11 +561,11 @@ class GameRecreator():
 
             relief_total_runs = relief_events.EVENT_RUNS_CT.sum()
             relief_total_runs -= inherited_runners_scored
-            relief_run_events = relief_events[relief_events.EVENT_RUNS_CT != 0]
-
-            for j in range(len(relief_run_events)):
-                unearned_runs = re.findall(unearned_flag, relief_run_events.iloc[j]['EVENT_TX'])
-                relief_unearned += len(unearned_runs)
+            if charges is None:
+                relief_run_events = relief_events[relief_events.EVENT_RUNS_CT != 0]
+                for j in range(len(relief_run_events)):
+                    unearned_runs = re.findall(unearned_flag, relief_run_events.iloc[j]['EVENT_TX'])
+                    relief_unearned += len(unearned_runs)
             relief_total_runs -= relief_unearned
             
             relief_dict['ER_'] = relief_total_runs
@@ -429,6 +597,25 @@ class GameRecreator():
         return(data_dict)
 
 
+    @staticmethod
+    def lookup_batting(team_batting, data_dict):
+        ''' 
+        Factory method to fill team batting statistics from the season batting aggregate
+            Args:
+                - team_batting [dict]: Aggregated batting statistics for one team in one game (batting_aggregator.py)
+                - data_dict [dict]: Dictionary to record batting stats
+            Returns:
+                - [dict]: Dictionary of team batting statistics
+        '''
+        data_dict['PA'] = team_batting['PA']
+        data_dict['AB'] = team_batting['AB']
+        data_dict['H'] = team_batting['H']
+        data_dict['TB'] = team_batting['TB']
+        data_dict['BB'] = team_batting['BB'] + team_batting['IBB']
+        data_dict['HBP'] = team_batting['HBP']
+        data_dict['R'] = team_batting['R']
+        return(data_dict)
+
     @staticmethod
     def initialize_batting_dict(game_date, team_code, home = False):
         ''' 
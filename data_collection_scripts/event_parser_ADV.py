@@ -10,22 +10,32 @@ adding multiprocessing capability which was missing in version 1
 '''
 
 from dataclasses import dataclass, field
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import sys
 import os
 import json
-import pickle
 import glob
 import datetime
-import pandas as pd
 import re
+import inspect
+from batting_aggregator import BATTING_COLS, batting_lookup
+from runner_advance import charge_lookup
+from event_loader import load_season
+from season_manifest import SeasonManifest, parser_version
+from double_header import game_number_flags
+from game_sink import CsvSink, ParquetSink, JsonLinesSink, PickleSink
 
 EVENT_HEADER = r"./intermediate_data/all_event_header.json"
 
 INPUT = r"./parsed/all*.csv"
 
+CACHE_DIR = r"./parsed/cache/"
+
 OUTPUT_DIR = r"./adv_metrics/"
 
+PARSER_SOURCES = [os.path.abspath(__file__)] + [inspect.getsourcefile(func) for func in (batting_lookup, charge_lookup, load_season,
+CsvSink, game_number_flags)]
+
 @dataclass
 class EventParser():
     input_dir: str = INPUT
@@ -33,11 +43,15 @@ class EventParser():
     event_header: str = EVENT_HEADER
     n_jobs: int = None
     event_headers: list = field(default_factory = list)
-    all_games: list = field(default_factory = list)
     to_csv: bool = True
     _zip: bool = True
+    to_parquet: bool = False
     to_json: bool = False
     to_pickle: bool = False
+    batting_mode: str = "season"
+    earned_run_mode: str = "season"
+    cache_dir: str = CACHE_DIR
+    incremental: bool = True
 
     def parse_events(self):
 
@@ -45,143 +59,218 @@ class EventParser():
 
         all_files = glob.glob(self.input_dir)
 
-        for file in all_files:
-            
-            try:
-            
-                season = file.split("all")[1][0:4]
+        input_files = list(all_files)
 
-                season_df = pd.read_csv(file, low_memory = False, header = None)
+        sinks = self._sinks()
 
-                season_df.columns = self.event_headers
+        manifest = SeasonManifest(self.output_dir, parser_version(PARSER_SOURCES))
 
-                all_games = season_df.GAME_ID.unique()
+        #seasons whose event file was deleted are dropped along with their partitions
+        for removed in manifest.prune():
 
-                season_list = []
+            print("Event file {} removed, its season is no longer output".format(removed))
 
-                with ProcessPoolExecutor(max_workers = self.n_jobs) as executor:
+        if self.incremental:
 
-                    for game in all_games:
+            #a season is re-parsed if any enabled sink, such as an output format turned on since, lacks its partition
+            all_files = [file for file in all_files if not manifest.is_current(file,
+            [sink.partition_path(self.season(file)) for sink in sinks])]
 
-                        game_df = season_df[season_df.GAME_ID == game].reset_index(drop = True)
+            if len(all_files) == 0:
 
-                        season_list.append(executor.submit(self.recreate_game, game_df, game))
+                print("All seasons unchanged since last parsed")
 
-                season_list = [i.result() for i in season_list]
+        fingerprints = {file : manifest.fingerprint(file) for file in all_files}
 
-                self.all_games += season_list
+        parsed_files = []
 
-                print("All data collected for {} season".format(season))
+        with ProcessPoolExecutor(max_workers = self.n_jobs) as executor:
 
-            except (SystemExit, KeyboardInterrupt):
+            season_list = {executor.submit(self.parse_season, file, self.event_headers, self.batting_mode,
+            self.earned_run_mode, self.cache_dir) : file for file in all_files}
 
-                raise
+            #write each season as soon as it is finished, only one season of games is held at a time
+            for future in as_completed(season_list):
 
-            except:
+                file = season_list.pop(future)
 
-                print("There was a problem with {}: {}".format(season, sys.exc_info()[0]))
+                season = self.season(file)
+            
+                try:
 
-                continue
+                    season_games, errors = future.result()
 
-        if self.to_csv:
+                    for game, error in errors:
 
-            try:
+                        print("There was a problem with {}: {}".format(game, error))
 
-                final = pd.DataFrame(self.all_games)
+                    outputs = [sink.write_season(season, season_games) for sink in sinks]
 
-                if self._zip:
+                    manifest.record(file, fingerprints[file], outputs)
 
-                    final.to_csv("{}raw_game_data.csv.gz".format(self.output_dir), 
-                    index = False, compression = "gzip")
+                    manifest.save()
 
-                else:
+                    parsed_files.append(file)
 
-                    final.to_csv("{}raw_game_data.csv".format(self.output_dir),
-                    index = False)
+                    print("All data collected for {} season".format(season))
 
-                print("Data successfully written to .CSV")
+                except (SystemExit, KeyboardInterrupt):
 
-            except (SystemExit, KeyboardInterrupt):
+                    raise
 
-                raise
+                except:
 
-            except:
+                    print("There was a problem with {}: {}".format(season, sys.exc_info()[0]))
 
-                print("Encountered the following error writing file to .csv: {}".format(sys.exc_info()[0]))
+                    continue
 
-        if self.to_json:
+        manifest.save()
 
-            try:
+        #only the seasons of the current input files are combined, partitions of other event files are left out
+        current_outputs = manifest.outputs(input_files)
 
-                with open("{}raw_game_data.json".format(self.output_dir), "w+") as f:
+        for sink in sinks:
 
-                    json.dump(self.all_games, f)
+            partitions = sink.current_partitions(current_outputs)
+
+            if sink.output_file is None or (len(parsed_files) == 0 and sink.is_current(partitions)):
+
+                continue
+
+            try:
 
-                    print("Data successfully written to JSON")
+                sink.finalize(partitions)
+
+                print("Data successfully written to {}".format(sink.output_file))
 
             except (SystemExit, KeyboardInterrupt):
 
                 raise
-            
+
             except:
 
-                print("Encountered the following error writing file to .json: {}".format(sys.exc_info()[0]))
+                print("Encountered the following error writing {}: {}".format(sink.output_file, sys.exc_info()[0]))
 
-        if self.to_pickle:
+    @staticmethod
+    def season(file):
+        '''
+        Season of an event file, all{season}.csv
+            Args:
+                - file [str]: location of season .csv
+            Returns:
+                - [str]: 4 digit year
+        '''
+
+        return(os.path.basename(file).split("all")[1][0:4])
+
+    def _sinks(self):
+        '''
+        Create one output sink (game_sink.py) per requested output format
+            Args:
+                None
+            Returns:
+                - [list]: SeasonSink objects
+        '''
+
+        sinks = []
 
-            try:
+        if self.to_csv:
 
-                with open("{}raw_game_data.pk", "wb") as f:
+            sinks.append(CsvSink(self.output_dir, compress = self._zip))
 
-                    pickle.dump(self.all_games, f)
+        if self.to_parquet:
 
-                    print("Data successfully pickled")
+            sinks.append(ParquetSink(self.output_dir))
 
-            except (SystemExit, KeyboardInterrupt):
+        if self.to_json:
 
-                raise
+            sinks.append(JsonLinesSink(self.output_dir))
 
-            except:
+        if self.to_pickle:
 
-                print("Encountered the following error writing file to .pk: {}".format(sys.exc_info()[0]))
+            sinks.append(PickleSink(self.output_dir))
+
+        return(sinks)
 
-    
     def _prep(self):
 
         if not os.path.exists(self.output_dir):
 
             os.makedirs(self.output_dir)
 
+        if self.batting_mode not in ("season", "game"):
+
+            raise ValueError("Unknown batting mode: {}".format(self.batting_mode))
+
+        if self.earned_run_mode not in ("season", "game"):
+
+            raise ValueError("Unknown earned run mode: {}".format(self.earned_run_mode))
+
         with open(self.event_header, "r+") as f:
 
             self.event_headers = json.load(f)
     
     @staticmethod
-    def recreate_game(game_df, game_id):
+    def parse_season(file, event_headers, batting_mode = "season", earned_run_mode = "season", cache_dir = None):
+        '''
+        Parse every game of one season file. Runs inside a worker process: the worker reads the season 
+        from file_name itself, splits it into games in a single groupby pass and only sends back the 
+        finished game records, so no event data is pickled between processes.
+            Args:
+                - file [str]: location of Chadwick-parsed season .csv
+                - event_headers [list]: column names of the event file
+                - batting_mode [str]: "season" or "game"
+                - earned_run_mode [str]: "season" or "game"
+                - cache_dir [str]: directory for typed season caches (event_loader.py), None to read the .csv
+            Returns:
+                - [list]: one dictionary per game
+                - [list]: (game_id, error) for every game that could not be parsed
+        '''
 
-        unearned_flag = r"(\(UR\))"
-        
-        game_master = {}
+        season_df = load_season(file, event_headers, cache_dir = cache_dir)
 
-        game_master["date"] = datetime.datetime.strptime(game_id[3:11], "%Y%m%d").strftime("%Y-%m-%d")
+        batting = batting_lookup(season_df) if batting_mode == "season" else {}
 
-        game_master["home_team"] = game_id[0:3]
+        charges = charge_lookup(season_df) if earned_run_mode == "season" else {}
 
-        game_master["road_team"] = game_df.iloc[0]["AWAY_TEAM_ID"]
+        season_games = []
+
+        errors = []
+
+        for game, game_df in season_df.groupby("GAME_ID", sort = False, observed = True):
+
+            game_batting = {1 : batting.get((game, 1)), 0 : batting.get((game, 0))}
+
+            game_charges = {1 : charges.get((game, 1)), 0 : charges.get((game, 0))}
 
-        if game_id[11] == "2":
+            try:
+
+                season_games.append(EventParser.recreate_game(game_df, game, game_batting, game_charges))
+
+            except (SystemExit, KeyboardInterrupt):
 
-            game_master["is_doubleheader"] = 1
+                raise
 
-        elif game_id[11] == "3":
+            except:
 
-            game_master["is_tripleheader"] = 1
+                errors.append((game, sys.exc_info()[0]))
 
-        else:
+        return(season_games, errors)
 
-            game_master["is_doubleheader"] = 0 
+    @staticmethod
+    def recreate_game(game_df, game_id, batting = None, charges = None):
+
+        unearned_flag = r"(\(UR\))"
+        
+        game_master = {}
+
+        game_master["date"] = datetime.datetime.strptime(game_id[3:11], "%Y%m%d").strftime("%Y-%m-%d")
+
+        game_master["home_team"] = game_id[0:3]
+
+        game_master["road_team"] = game_df.iloc[0]["AWAY_TEAM_ID"]
 
-            game_master["is_tripleheader"] = 0
+        game_master["is_doubleheader"], game_master["is_tripleheader"] = game_number_flags(game_id)
 
         prefixes = ["home_", "road_"]
 
@@ -201,29 +290,39 @@ class EventParser():
 
             #BEGIN OFFENSIVE COLLECTION
 
-            game_master[prefix + "PA"] = team_events.GAME_PA_CT.max() + 1
+            team_batting = batting.get(1 if prefix == "home_" else 0) if batting else None
 
-            game_master[prefix + 'AB'] = len(team_events[team_events.AB_FL == 'T'])
+            if team_batting is not None:
 
-            game_master[prefix + 'H'] = len(team_events[team_events.H_FL != 0])
+                for stat in BATTING_COLS:
 
-            game_master[prefix + "1B"] = len(team_events[team_events.EVENT_CD == 20])
+                    game_master[prefix + stat] = team_batting[stat]
 
-            game_master[prefix + "2B"] = len(team_events[team_events.EVENT_CD == 21])
+            else:
+
+                game_master[prefix + "PA"] = team_events.GAME_PA_CT.max() + 1
+
+                game_master[prefix + 'AB'] = len(team_events[team_events.AB_FL == 'T'])
+
+                game_master[prefix + 'H'] = len(team_events[team_events.H_FL != 0])
+
+                game_master[prefix + "1B"] = len(team_events[team_events.EVENT_CD == 20])
+
+                game_master[prefix + "2B"] = len(team_events[team_events.EVENT_CD == 21])
 
-            game_master[prefix + "3B"] = len(team_events[team_events.EVENT_CD == 22])
+                game_master[prefix + "3B"] = len(team_events[team_events.EVENT_CD == 22])
 
-            game_master[prefix + "HR"] = len(team_events[team_events.EVENT_CD == 23])
+                game_master[prefix + "HR"] = len(team_events[team_events.EVENT_CD == 23])
 
-            game_master[prefix + 'TB'] = team_events.H_FL.sum()
+                game_master[prefix + 'TB'] = team_events.H_FL.sum()
 
-            game_master[prefix + 'BB'] = len(team_events[team_events.EVENT_CD == 14])
+                game_master[prefix + 'BB'] = len(team_events[team_events.EVENT_CD == 14])
 
-            game_master[prefix + 'IBB'] = len(team_events[team_events.EVENT_CD == 15])
+                game_master[prefix + 'IBB'] = len(team_events[team_events.EVENT_CD == 15])
 
-            game_master[prefix + 'HBP'] = len(team_events[team_events.EVENT_CD == 16])
+                game_master[prefix + 'HBP'] = len(team_events[team_events.EVENT_CD == 16])
 
-            game_master[prefix + 'R'] = team_events.EVENT_RUNS_CT.sum()
+                game_master[prefix + 'R'] = team_events.EVENT_RUNS_CT.sum()
 
             #BEGIN PITCHING COLLECTION 
 
@@ -243,6 +342,16 @@ class EventParser():
 
             game_master[alt + "starter"] = starter_events.iloc[0]["RESP_PIT_ID"]
 
+            team_charges = charges.get(1 if prefix == "home_" else 0) if charges else None
+
+            if team_charges is not None and team_charges["starter"] != game_master[alt + "starter"]:
+
+                team_charges = None
+
+            if team_charges is not None and team_charges["malformed"]:
+
+                raise ValueError("Unreadable runner advance charged to {}".format(game_master[alt + "starter"]))
+
             game_master[alt + "starter_H"] = len(starter_events[starter_events.H_FL != 0])
 
             game_master[alt + "starter_HR"] = len(starter_events[starter_events.EVENT_CD == 23])
@@ -263,13 +372,19 @@ class EventParser():
 
                 starter_total_runs = starter_events.EVENT_RUNS_CT.sum()
                 
-                starter_run_events = starter_events[starter_events.EVENT_RUNS_CT != 0]
+                if team_charges is not None:
+
+                    starter_unearned = team_charges["starter_unearned"]
+
+                else:
+
+                    starter_run_events = starter_events[starter_events.EVENT_RUNS_CT != 0]
                 
-                for j in range(len(starter_run_events)):
+                    for j in range(len(starter_run_events)):
                 
-                    unearned_runs = re.findall(unearned_flag, starter_run_events.iloc[j]['EVENT_TX'])
+                        unearned_runs = re.findall(unearned_flag, starter_run_events.iloc[j]['EVENT_TX'])
                 
-                    starter_unearned += len(unearned_runs)
+                        starter_unearned += len(unearned_runs)
 
                 starter_total_runs -= starter_unearned
 
@@ -306,17 +421,27 @@ class EventParser():
 
                 starter_total_runs = starter_events.EVENT_RUNS_CT.sum()
 
-                starter_run_events = starter_events[starter_events.EVENT_RUNS_CT != 0]
+                if team_charges is not None:
+
+                    starter_unearned = team_charges["starter_unearned"]
 
-                for j in range(len(starter_run_events)):
+                    relief_unearned = team_charges["relief_unearned"]
 
-                    unearned_runs = re.findall(unearned_flag, starter_run_events.iloc[j]['EVENT_TX'])
+                    inherited_runners_scored = team_charges["inherited_scored"]
 
-                    starter_unearned += len(unearned_runs)
+                else:
+
+                    starter_run_events = starter_events[starter_events.EVENT_RUNS_CT != 0]
+
+                    for j in range(len(starter_run_events)):
+
+                        unearned_runs = re.findall(unearned_flag, starter_run_events.iloc[j]['EVENT_TX'])
+
+                        starter_unearned += len(unearned_runs)
 
                 starter_total_runs -= starter_unearned
 
-                if removed_mid_inning:
+                if removed_mid_inning and team_charges is None:
 
                     starter_resp_runners = relief_events[(relief_events.RUN1_RESP_PIT_ID == game_master[alt + "starter"]) |
                                             (relief_events.RUN2_RESP_PIT_ID == game_master[alt + "starter"]) |
@@ -402,13 +527,15 @@ class EventParser():
                     
                 relief_total_runs -= inherited_runners_scored
                     
-                relief_run_events = relief_events[relief_events.EVENT_RUNS_CT != 0]
+                if team_charges is None:
+
+                    relief_run_events = relief_events[relief_events.EVENT_RUNS_CT != 0]
 
-                for j in range(len(relief_run_events)):
+                    for j in range(len(relief_run_events)):
                     
-                    unearned_runs = re.findall(unearned_flag, relief_run_events.iloc[j]['EVENT_TX'])
+                        unearned_runs = re.findall(unearned_flag, relief_run_events.iloc[j]['EVENT_TX'])
                     
-                    relief_unearned += len(unearned_runs)
+                        relief_unearned += len(unearned_runs)
                 
                 relief_total_runs -= relief_unearned
 
@@ -1,12 +1,12 @@
 from dataclasses import dataclass, field
 from random import choice
-import requests
 from requests import HTTPError, RequestException
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import sys
 import os
 import pandas as pd 
 import json
+from http_fetch import CachedTransport, Fetcher, SessionTransport, HTTP_CACHE_DIR
 
 USER_AGENT = [
     r"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/80.0.3987.132 Safari/537.36"
@@ -16,6 +16,9 @@ CONSTANTS = r"https://www.fangraphs.com/guts.aspx?type=cn"
 
 CONSTANT_JSON = r"./adv_metrics/wOBA_weights.json"
 
+# The wOBA constants change once a season, a cached guts page is revalidated weekly
+CONSTANT_MAX_AGE = 7 * 24 * 3600
+
 @dataclass
 class FanGraphScraper():
     user_agents: list = None
@@ -23,12 +26,28 @@ class FanGraphScraper():
     constant_url: str = CONSTANTS
     constant_table: list = field(default_factory = list)
     output_file: str = CONSTANT_JSON
+    cache_dir: str = HTTP_CACHE_DIR
+    max_age: float = CONSTANT_MAX_AGE
+    fetcher: Fetcher = None
+
+    def __post_init__(self):
+
+        if self.fetcher is None:
+
+            transport = SessionTransport(proxies = {"http" : self.proxy, "https" : self.proxy} if self.proxy else None)
+
+            if self.cache_dir is not None:
+
+                transport = CachedTransport(transport, self.cache_dir, self.max_age)
+
+            self.fetcher = Fetcher(transport)
 
     def scrape_constants(self):
 
         constants_page = self.request_URL(self.constant_url)
 
-        constants_soup = BeautifulSoup(constants_page, "html.parser")
+        # Only the constants table is parsed, the rest of the page is skipped by the parser
+        constants_soup = BeautifulSoup(constants_page, "html.parser", parse_only = SoupStrainer("table", {"class" : "rgMasterTable"}))
 
         table = constants_soup.find("table", {"class" : "rgMasterTable"})
 
@@ -70,17 +89,10 @@ class FanGraphScraper():
 
         try:
 
-            response = requests.get(url, headers = {
+            response = self.fetcher.get(url, headers = {
 
                 "User-Agent" : agent
 
-            },
-
-            proxies = {
-
-                "http" : self.proxy,
-
-                "https" : self.proxy
             })
 
             response.raise_for_status()
@@ -101,5 +113,7 @@ if __name__ == "__main__":
 
     scraper = FanGraphScraper()
 
-    scraper.scrape_constants()
+    with scraper.fetcher:
+
+        scraper.scrape_constants()
 
@@ -1,33 +1,63 @@
+import concurrent.futures
+import itertools
 import pandas as pd 
 import numpy as np
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+from travel import StadiumDistances
+
+HOME_FEATURES = ['len_homestand', 'current_streak_hm_tm', 'current_streak_hm_at_hm', 'home_record_hm',
+                'run_differential_hm', 'avg_margin_hm', 'distance_traveled']
+
+ROAD_FEATURES = ['len_roadtrip', 'current_streak_rd_tm', 'distance_traveled', 'current_streak_rd_tm_on_rd',
+                'rd_record_rd', 'run_differential_rd', 'avg_margin_rd']
+
+ENGINES = ('array', 'loop')
+
+TRACK_COLS = ['season', 'team1', 'team2', 'score1', 'score2', 'primary_latitude', 'primary_longitude']
+
+#positions of the features in HOME_FEATURES / ROAD_FEATURES and team locations, used by track_games
+HM_LEN, HM_STREAK, HM_STREAK_HM, HM_RECORD, HM_DIFF, HM_AVG, HM_DISTANCE = range(len(HOME_FEATURES))
+RD_LEN, RD_STREAK, RD_DISTANCE, RD_STREAK_RD, RD_RECORD, RD_DIFF, RD_AVG = range(len(ROAD_FEATURES))
+HOME, ROAD = 1, 2
+
+def compiled(func):
+    #numba compiles func when it is installed, otherwise func runs as plain Python
+    return(njit(cache = True)(func) if njit is not None else func)
 
 class TeamFeatureEngineer():
-    def __init__(self):
+    def __init__(self, engine = 'array', n_jobs = 1):
+        #engine: 'array' tracks every team of every season in one loop over typed arrays, compiled with numba when
+        #installed (track_seasons), 'loop' walks each Team through the DataFrame
+        #n_jobs: number of worker processes, seasons are independent and tracked in parallel when n_jobs > 1
+        if engine not in ENGINES:
+            raise ValueError('Unknown engine: {}'.format(engine))
+        self.engine = engine
+        self.n_jobs = n_jobs
         self.season_frames = []
     
     def create_features(self, df):
         #generate list of individual seasons
         year_list = list(df.season.unique())
-        #iterate through seasons
-        for year in year_list:
-            #isolate each season as single dataframe
-            single_season = df[df.season == year]
-            single_season = single_season.reset_index().drop(columns = ['index'])
-            #generate list of teams active during season
-            team_list = list(single_season.team1.unique())
-            #iterate through teams
-            for team in team_list:
-                #create Team object
-                current_team = Team(team)
-                #call class methods to create features
-                current_team.get_indices(single_season)
-                current_team.get_coords(single_season)
-                current_team.track_season(single_season)
-            self.season_frames.append(single_season)
+        season_rows = df.groupby('season', sort = False).indices
+        #only the columns used to track teams are shipped to the workers
+        games = df[TRACK_COLS]
+        if self.n_jobs > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers = self.n_jobs) as executor:
+                #map keeps seasons in year_list order whatever the order they finish in
+                season_features = [features[0] for features in executor.map(track_features,
+                                   [games.iloc[season_rows[year]] for year in year_list], itertools.repeat(self.engine))]
+        else:
+            season_features = track_features(games, self.engine)
+        for year, features in zip(year_list, season_features):
+            #isolate each season as single dataframe, with its features
+            single_season = df.iloc[season_rows[year]].reset_index(drop = True)
+            self.season_frames.append(pd.concat([single_season, features], axis = 1))
     
     def create_frame(self):
-        final_frame = pd.concat(self.season_frames, axis = 0, sort = False)
-        final_frame = final_frame.reset_index().drop(columns = ['index'])
+        final_frame = pd.concat(self.season_frames, axis = 0, sort = False, ignore_index = True)
         final_frame = final_frame.sort_values(by = ['date'], axis = 0)
         return(final_frame)
 
@@ -354,4 +384,279 @@ class Team():
                           np.sin( (np.radians(longitude_2) - np.radians(longitude_1))/2)**2))
         return(2 * R * h)
         
-        
\ No newline at end of file
+        
+def track_features(games, engine = 'array'):
+    '''
+    Feature columns of every season of games, in order of games.season.unique()
+        Args:
+            - games [pandas.DataFrame]: games with TRACK_COLS columns
+            - engine [str]: 'array' (track_seasons) or 'loop' (Team.track_season)
+        Returns:
+            - [list]: one DataFrame of feature columns per season, indexed 0 .. number of games of the season - 1
+    '''
+    if engine == 'array':
+        return(track_seasons(games))
+    season_features = []
+    for year in list(games.season.unique()):
+        single_season = games[games.season == year]
+        single_season = single_season.reset_index().drop(columns = ['index'])
+        #generate list of teams active during season
+        team_list = list(single_season.team1.unique())
+        for team in team_list:
+            current_team = Team(team)
+            current_team.get_indices(single_season)
+            current_team.get_coords(single_season)
+            current_team.track_season(single_season)
+        season_features.append(single_season.drop(columns = list(games.columns)))
+    return(season_features)
+
+def track_seasons(df):
+    '''
+    Streak, record, run differential, homestand, roadtrip and travel features of every team of every season, with
+    the same values (and column order) as walking each Team through each season. The games are walked once in
+    track_games, a loop over typed NumPy arrays compiled with numba when it is installed (plain Python otherwise).
+        Args:
+            - df [pandas.DataFrame]: games with season, team1 (home), team2 (road), score1, score2,
+                primary_latitude and primary_longitude columns
+        Returns:
+            - [list]: one DataFrame of feature columns per season (in order of df.season.unique()), indexed 0 ..
+                number of games of the season - 1
+    '''
+    n = len(df)
+    season = df.season.to_numpy()
+    #one code per (season, team), home and road rows of every game
+    teams = pd.MultiIndex.from_arrays([np.concatenate([season, season]),
+                                       np.concatenate([df.team1.to_numpy(), df.team2.to_numpy()])])
+    codes = pd.factorize(teams)[0]
+    home, road = codes[:n], codes[n:]
+    n_teams = codes.max() + 1 if n > 0 else 0
+    #teams are tracked in order of their first home game of the season, teams without home games are not tracked
+    first_home = np.full(n_teams, -1, dtype = 'int64')
+    unique_home, first_index = np.unique(home, return_index = True)
+    first_home[unique_home] = first_index
+    home_coords = pd.DataFrame({col : most_common(home, df[col].to_numpy())
+                                for col in ['primary_latitude', 'primary_longitude']}).dropna()
+    #distances between every venue of the frame and every home location (most common latitude and longitude of the
+    #team's home games) are computed once, each road game then looks its distance up by venue. The extra last row and
+    #column are NaN, the position (-1) of venues without coordinates.
+    distances = StadiumDistances(np.concatenate([df.primary_latitude.to_numpy(), home_coords.primary_latitude.to_numpy()]),
+                                 np.concatenate([df.primary_longitude.to_numpy(), home_coords.primary_longitude.to_numpy()]))
+    matrix = np.full((len(distances.venues) + 1, len(distances.venues) + 1), np.nan)
+    matrix[:-1, :-1] = distances.matrix
+    venue = distances.index(df.primary_latitude, df.primary_longitude)
+    home_venue = np.full(n_teams, -1, dtype = 'int64')
+    home_venue[home_coords.index.to_numpy()] = distances.index(home_coords.primary_latitude,
+                                                               home_coords.primary_longitude)
+
+    #feature values GOING INTO each game, [feature, game], and the position of each write in the order of the writes
+    home_values = np.full((len(HOME_FEATURES), n), np.nan)
+    home_written = np.zeros((len(HOME_FEATURES), n), dtype = 'int64')
+    road_values = np.full((len(ROAD_FEATURES), n), np.nan)
+    road_written = np.zeros((len(ROAD_FEATURES), n), dtype = 'int64')
+    #the opponent of the road team is the home team, whose code identifies it within the season
+    n_writes = track_games(home.astype('int64'), road.astype('int64'), df.score1.to_numpy(dtype = 'float64'),
+                           df.score2.to_numpy(dtype = 'float64'), venue.astype('int64'), home_venue, first_home >= 0,
+                           matrix, home_values, home_written, road_values, road_written) + 1
+
+    #teams are walked one after another, so a column is created by the earliest (team, game) writing it and the home
+    #and road teams' distance_traveled of the same game is kept from the team tracked last
+    unwritten = np.iinfo('int64').max
+    features, order_keys = {}, {}
+    for role, columns, values, written in ((home, HOME_FEATURES, home_values, home_written),
+                                           (road, ROAD_FEATURES, road_values, road_written)):
+        for k, col in enumerate(columns):
+            mask = written[k] > 0
+            keys = np.where(mask, first_home[role] * n_writes + written[k], unwritten)
+            if col in features:
+                road_last = mask & (~features[col][1] | (first_home[road] > first_home[home]))
+                features[col] = (np.where(road_last, values[k], features[col][0]), features[col][1] | mask)
+                order_keys[col] = np.minimum(order_keys[col], keys)
+            else:
+                features[col] = (values[k], mask)
+                order_keys[col] = keys
+
+    season_features = []
+    for year in list(df.season.unique()):
+        in_season = season == year
+        first_write = {col : order_keys[col][in_season].min() for col in features}
+        columns = sorted([col for col in features if first_write[col] != unwritten], key = first_write.get)
+        season_features.append(pd.DataFrame({col : np.where(features[col][1][in_season], features[col][0][in_season],
+                                                             np.nan) for col in columns}, index = pd.RangeIndex(in_season.sum())))
+    return(season_features)
+
+def most_common(codes, values):
+    '''
+    Most common value of each code, the first one seen on ties (value_counts().idxmax() of every group)
+        Args:
+            - codes [numpy.ndarray]: group code of each value
+            - values [numpy.ndarray]: values, missing values are not counted
+        Returns:
+            - [pandas.Series]: most common value, indexed by code
+    '''
+    counts = pd.DataFrame({'code' : codes, 'value' : values, 'position' : np.arange(len(codes))}).dropna()
+    counts = counts.groupby(['code', 'value'], sort = False).position.agg(['size', 'min']).reset_index()
+    counts = counts.sort_values(['code', 'size', 'min'], ascending = [True, False, True], kind = 'stable')
+    return(counts.drop_duplicates('code').set_index('code').value)
+
+@compiled
+def write_feature(values, written, col, i, value, n_writes):
+    #written holds the position of the write in the order of the writes, 0 if the value was never written
+    values[col, i] = value
+    written[col, i] = n_writes + 1
+    return(n_writes + 1)
+
+@compiled
+def track_games(home, road, score1, score2, venue, home_venue, tracked, matrix, home_values, home_written,
+road_values, road_written):
+    '''
+    Walk every game in order, updating the state of its home and road team and writing the features going into the
+    game, as Team.track_season does for one team
+        Args:
+            - home, road [numpy.ndarray]: (season, team) codes of the home and road team of each game
+            - score1, score2 [numpy.ndarray]: home and road score of each game
+            - venue [numpy.ndarray]: position of each game's venue in matrix
+            - home_venue [numpy.ndarray]: position of each team's home location in matrix
+            - tracked [numpy.ndarray]: whether each team is tracked (has a home game)
+            - matrix [numpy.ndarray]: distances between venues
+            - home_values, home_written, road_values, road_written [numpy.ndarray]: filled in place, see write_feature
+        Returns:
+            - [int]: number of writes
+    '''
+    n_teams = len(tracked)
+    n_hm, n_rd = np.zeros(n_teams, dtype = np.int64), np.zeros(n_teams, dtype = np.int64)
+    streak, streak_hm, streak_rd = np.zeros(n_teams), np.zeros(n_teams), np.zeros(n_teams)
+    record_hm, record_rd = np.zeros(n_teams), np.zeros(n_teams)
+    diff_hm, diff_rd = np.zeros(n_teams), np.zeros(n_teams)
+    avg_hm, avg_rd = np.zeros(n_teams), np.zeros(n_teams)
+    len_hs, len_rt = np.zeros(n_teams), np.zeros(n_teams)
+    distance = np.zeros(n_teams)
+    #location: 0 before the first game, HOME or ROAD
+    loc = np.zeros(n_teams, dtype = np.int64)
+    current_opponent = np.full(n_teams, -1, dtype = np.int64)
+    current_venue = np.full(n_teams, -1, dtype = np.int64)
+    n_writes = 0
+
+    for i in range(len(home)):
+        t = home[i]
+        game_result = score1[i] - score2[i]
+        #first home game of the season
+        if n_hm[t] == 0:
+            loc[t] = HOME
+            len_hs[t] = 1
+            n_writes = write_feature(home_values, home_written, HM_LEN, i, 1, n_writes)
+            if streak[t] != 0:
+                n_writes = write_feature(home_values, home_written, HM_STREAK, i, streak[t], n_writes)
+            n_hm[t] = 1
+            distance[t] = 0
+            diff_hm[t] = game_result
+            avg_hm[t] = game_result
+            if game_result < 0:
+                record_hm[t] = -1
+                streak[t] = streak[t] - 1 if streak[t] < 0 else -1
+                streak_hm[t] = -1
+            elif game_result == 0:
+                record_hm[t] = 0
+                streak[t] = 0
+                streak_hm[t] = 0
+            else:
+                record_hm[t] = 1
+                streak[t] = streak[t] + 1 if streak[t] > 0 else 1
+                streak_hm[t] = 1
+        #all other home games, the location is never switched back to HOME after the first road game
+        else:
+            len_hs[t] = len_hs[t] + 1 if loc[t] == HOME else 1
+            n_writes = write_feature(home_values, home_written, HM_LEN, i, len_hs[t], n_writes)
+            n_writes = write_feature(home_values, home_written, HM_STREAK, i, streak[t], n_writes)
+            n_writes = write_feature(home_values, home_written, HM_STREAK_HM, i, streak_hm[t], n_writes)
+            n_writes = write_feature(home_values, home_written, HM_RECORD, i, record_hm[t], n_writes)
+            n_writes = write_feature(home_values, home_written, HM_DIFF, i, diff_hm[t], n_writes)
+            n_writes = write_feature(home_values, home_written, HM_AVG, i, avg_hm[t], n_writes)
+            n_writes = write_feature(home_values, home_written, HM_DISTANCE, i, 0, n_writes)
+            n_hm[t] += 1
+            distance[t] = 0
+            diff_hm[t] += game_result
+            avg_hm[t] = diff_hm[t] / n_hm[t]
+            if game_result < 0:
+                record_hm[t] += -1
+                streak[t] = streak[t] - 1 if streak[t] < 0 else -1
+                streak_hm[t] = streak_hm[t] - 1 if streak_hm[t] < 0 else -1
+            elif game_result == 0:
+                streak[t] = 0
+                streak_hm[t] = 0
+            else:
+                record_hm[t] += 1
+                streak[t] = streak[t] + 1 if streak[t] > 0 else 1
+                streak_hm[t] = streak_hm[t] + 1 if streak_hm[t] > 0 else 1
+
+        opponent = t
+        t = road[i]
+        if not tracked[t]:
+            continue
+        game_result = score2[i] - score1[i]
+        #first road game of the season
+        if n_rd[t] == 0:
+            loc[t] = ROAD
+            len_rt[t] = 1
+            n_writes = write_feature(road_values, road_written, RD_LEN, i, 1, n_writes)
+            n_rd[t] = 1
+            if streak[t] != 0:
+                n_writes = write_feature(road_values, road_written, RD_STREAK, i, streak[t], n_writes)
+            current_opponent[t] = opponent
+            current_venue[t] = venue[i]
+            distance[t] = matrix[home_venue[t], current_venue[t]]
+            n_writes = write_feature(road_values, road_written, RD_DISTANCE, i, distance[t], n_writes)
+            diff_rd[t] = game_result
+            avg_rd[t] = game_result
+            if game_result < 0:
+                record_rd[t] = -1
+                streak[t] = streak[t] - 1 if streak[t] < 0 else -1
+                streak_rd[t] = -1
+            elif game_result == 0:
+                streak[t] = 0
+                streak_rd[t] = 0
+            else:
+                record_rd[t] = 1
+                streak[t] = streak[t] + 1 if streak[t] > 0 else 1
+                streak_rd[t] = 1
+        #all other road games
+        else:
+            n_rd[t] += 1
+            on_road = loc[t] == ROAD
+            if opponent != current_opponent[t] and on_road:
+                current_opponent[t] = opponent
+                len_rt[t] += 1
+                distance[t] += matrix[current_venue[t], venue[i]]
+                current_venue[t] = venue[i]
+            elif opponent != current_opponent[t]:
+                current_opponent[t] = opponent
+                len_rt[t] = 1
+                current_venue[t] = venue[i]
+                distance[t] = matrix[home_venue[t], current_venue[t]]
+            elif on_road:
+                len_rt[t] += 1
+            else:
+                len_rt[t] = 1
+                current_venue[t] = venue[i]
+                distance[t] = matrix[home_venue[t], current_venue[t]]
+            n_writes = write_feature(road_values, road_written, RD_DISTANCE, i, distance[t], n_writes)
+            n_writes = write_feature(road_values, road_written, RD_LEN, i, len_rt[t], n_writes)
+            n_writes = write_feature(road_values, road_written, RD_STREAK, i, streak[t], n_writes)
+            n_writes = write_feature(road_values, road_written, RD_STREAK_RD, i, streak_rd[t], n_writes)
+            n_writes = write_feature(road_values, road_written, RD_RECORD, i, record_rd[t], n_writes)
+            n_writes = write_feature(road_values, road_written, RD_DIFF, i, diff_rd[t], n_writes)
+            n_writes = write_feature(road_values, road_written, RD_AVG, i, avg_rd[t], n_writes)
+            diff_rd[t] += game_result
+            avg_rd[t] = diff_rd[t] / n_rd[t]
+            if game_result < 0:
+                record_rd[t] += -1
+                streak[t] = streak[t] - 1 if streak[t] < 0 else -1
+                streak_rd[t] = streak_rd[t] - 1 if streak_rd[t] < 0 else -1
+            elif game_result == 0:
+                streak[t] = 0
+                streak_rd[t] = 0
+            else:
+                record_rd[t] += 1
+                #a road win extends a winning streak by 0, as in Team.track_season
+                streak[t] = streak[t] if streak[t] > 0 else 1
+                streak_rd[t] = streak_rd[t] + 1 if streak_rd[t] > 0 else 1
+    return(n_writes)
@@ -0,0 +1,292 @@
+import gzip
+import glob
+import json
+import os
+import pickle
+import pandas as pd
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = None
+'''
+Streaming output sinks for event_parser_ADV.EventParser. Instead of holding every game of every season in memory
+and writing one DataFrame at the end, each season is written to its own partition file as soon as it is parsed
+({output_dir}/seasons/raw_game_data_{season}.{ext}). Partitions are written under a temporary name and renamed, so a
+crash never leaves a partial season behind and every season finished before the crash is kept. finalize() then
+combines the partitions into a single output file one season at a time, so memory stays bounded by the largest
+season no matter how many seasons are parsed. The partitions combined are listed in {output_file}.partitions.json,
+so the output is only rebuilt when that list changes.
+'''
+
+PARTITION_DIR = 'seasons'
+
+class SeasonSink():
+    '''
+    Parent class, one partition file per season plus a combined output file
+    '''
+    extension = None
+
+    def __init__(self, output_dir, name = 'raw_game_data'):
+        '''
+        Initialize sink
+            Args:
+                - output_dir [str]: output directory of the parser
+                - name [str]: base name of partition and combined output files
+        '''
+        self.name = name
+        self.partition_dir = os.path.join(output_dir, PARTITION_DIR)
+        self.output_file = os.path.join(output_dir, name + self.extension)
+
+    def partition_path(self, season):
+        '''
+        Location of a season's partition file
+            Args:
+                - season [str]: 4 digit year
+            Returns:
+                - [str]: '{output_dir}/seasons/{name}_{season}{extension}'
+        '''
+        return(os.path.join(self.partition_dir, '{}_{}{}'.format(self.name, season, self.extension)))
+
+    def partitions(self):
+        '''
+        Locations of every season partition written so far, in season order
+            Args:
+                None
+            Returns:
+                - [list]: partition file locations
+        '''
+        return(sorted(glob.glob(os.path.join(self.partition_dir, '{}_*{}'.format(self.name, self.extension)))))
+
+    def is_current(self, partitions):
+        '''
+        Check whether the output file was combined from exactly these partitions
+            Args:
+                - partitions [list]: partition file locations
+            Returns:
+                - [bool]: True if the output exists and lists the same partitions
+        '''
+        if self.output_file is None:
+            return(True)
+        if not os.path.exists(self.output_file) or not os.path.exists(self.output_file + '.partitions.json'):
+            return(False)
+        with open(self.output_file + '.partitions.json', 'r') as f:
+            return(json.load(f) == [os.path.basename(partition) for partition in sorted(partitions)])
+
+    def record_partitions(self, partitions):
+        '''
+        List the partitions the output file was combined from, next to the output file
+        '''
+        with open(self.output_file + '.partitions.json', 'w') as f:
+            json.dump([os.path.basename(partition) for partition in sorted(partitions)], f)
+
+    def current_partitions(self, outputs):
+        '''
+        Partitions of this sink among the outputs recorded for the current event files
+            Args:
+                - outputs [list]: SeasonManifest.outputs() of the current event files
+            Returns:
+                - [list]: partition file locations, in season order
+        '''
+        outputs = set(outputs)
+        return([partition for partition in self.partitions() if os.path.abspath(partition) in outputs])
+
+    def write_season(self, season, games):
+        '''
+        Write one season of games to its partition, replacing any earlier partition of the same season
+            Args:
+                - season [str]: 4 digit year
+                - games [list]: one dictionary per game
+            Returns:
+                - [str]: location of the partition
+        '''
+        if not os.path.isdir(self.partition_dir):
+            os.makedirs(self.partition_dir)
+        partition = self.partition_path(season)
+        temp_file = partition + '.tmp'
+        self.write_partition(games, temp_file)
+        os.replace(temp_file, partition)
+        return(partition)
+
+    def finalize(self, partitions = None):
+        '''
+        Combine season partitions into the output file, one season in memory at a time. The partitions are
+        read twice: once to collect the union of columns (in order of first appearance, as if every game had been
+        put into a single DataFrame) and the columns that need to be float because they are float or missing in
+        some season, and once to append each season with those columns.
+            Args:
+                - partitions [list]: partition files to combine (in season order), every partition on disk if None
+            Returns:
+                None
+        '''
+        partitions = self.partitions() if partitions is None else sorted(partitions)
+        columns = []
+        partition_columns = []
+        floats = set()
+        for partition in partitions:
+            season_df = self.read_partition(partition)
+            columns += [col for col in season_df.columns if col not in columns]
+            partition_columns.append(set(season_df.columns))
+            floats |= set(season_df.columns[[dtype.kind == 'f' for dtype in season_df.dtypes]])
+        for season_columns in partition_columns:
+            floats |= set(columns) - season_columns
+        temp_file = self.output_file + '.tmp'
+        with self.open_output(temp_file) as output:
+            for k, partition in enumerate(partitions):
+                season_df = self.read_partition(partition).reindex(columns = columns)
+                float_cols = [col for col in columns if col in floats]
+                season_df[float_cols] = season_df[float_cols].astype('float64')
+                self.append(output, season_df, k == 0)
+        os.replace(temp_file, self.output_file)
+        self.record_partitions(partitions)
+
+    def write_partition(self, games, file_name):
+        '''
+        Write one season of games to file_name (implemented by child classes)
+        '''
+        raise NotImplementedError
+
+    def read_partition(self, file_name):
+        '''
+        Read one season partition into a DataFrame (implemented by child classes)
+        '''
+        raise NotImplementedError
+
+    def open_output(self, file_name):
+        '''
+        Open the combined output for appending, returns a context manager (implemented by child classes)
+        '''
+        raise NotImplementedError
+
+    def append(self, output, season_df, first):
+        '''
+        Append one season to the opened combined output (implemented by child classes)
+        '''
+        raise NotImplementedError
+
+class CsvSink(SeasonSink):
+    '''
+    Child class, CSV partitions and output, gzip compressed unless compress = False
+    '''
+    def __init__(self, output_dir, compress = True, name = 'raw_game_data'):
+        '''
+        Initialize sink
+            Args:
+                - output_dir [str]: output directory of the parser
+                - compress [bool]: gzip partitions and output (.csv.gz)
+                - name [str]: base name of partition and combined output files
+        '''
+        self.compress = compress
+        self.extension = '.csv.gz' if compress else '.csv'
+        super().__init__(output_dir, name = name)
+
+    def write_partition(self, games, file_name):
+        pd.DataFrame(games).to_csv(file_name, index = False, compression = 'gzip' if self.compress else None)
+
+    def read_partition(self, file_name):
+        return(pd.read_csv(file_name, compression = 'gzip' if self.compress else None,
+                           float_precision = 'round_trip'))
+
+    def open_output(self, file_name):
+        if self.compress:
+            return(gzip.open(file_name, 'wt', newline = ''))
+        return(open(file_name, 'w', newline = ''))
+
+    def append(self, output, season_df, first):
+        season_df.to_csv(output, index = False, header = first)
+
+class ParquetSink(SeasonSink):
+    '''
+    Child class, Parquet partitions, combined into one Parquet file with one row group per season (requires pyarrow)
+    '''
+    extension = '.parquet'
+
+    def __init__(self, output_dir, name = 'raw_game_data'):
+        if pyarrow is None:
+            raise ImportError('pyarrow is required for Parquet output')
+        super().__init__(output_dir, name = name)
+
+    def write_partition(self, games, file_name):
+        pd.DataFrame(games).to_parquet(file_name, index = False)
+
+    def read_partition(self, file_name):
+        return(pd.read_parquet(file_name))
+
+    def open_output(self, file_name):
+        return(ParquetAppender(file_name))
+
+    def append(self, output, season_df, first):
+        output.write(season_df)
+
+class ParquetAppender():
+    '''
+    Context manager appending DataFrames to a Parquet file as row groups, the schema is taken from the first one
+    '''
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.writer = None
+
+    def __enter__(self):
+        return(self)
+
+    def write(self, season_df):
+        if self.writer is None:
+            table = pyarrow.Table.from_pandas(season_df, preserve_index = False)
+            self.writer = pq.ParquetWriter(self.file_name, table.schema)
+        else:
+            table = pyarrow.Table.from_pandas(season_df, schema = self.writer.schema, preserve_index = False)
+        self.writer.write_table(table)
+
+    def __exit__(self, *exc):
+        if self.writer is not None:
+            self.writer.close()
+        else:
+            pd.DataFrame().to_parquet(self.file_name)
+        return(False)
+
+class JsonLinesSink(SeasonSink):
+    '''
+    Child class, JSON Lines partitions (one game per line), combined by concatenation
+    '''
+    extension = '.jsonl'
+
+    def write_partition(self, games, file_name):
+        pd.DataFrame(games).to_json(file_name, orient = 'records', lines = True)
+
+    def finalize(self, partitions = None):
+        '''
+        Concatenate season partitions into the output file
+            Args:
+                - partitions [list]: partition files to combine (in season order), every partition on disk if None
+            Returns:
+                None
+        '''
+        partitions = self.partitions() if partitions is None else sorted(partitions)
+        temp_file = self.output_file + '.tmp'
+        with open(temp_file, 'wb') as output:
+            for partition in partitions:
+                with open(partition, 'rb') as f:
+                    lines = f.read()
+                if len(lines) != 0 and not lines.endswith(b'\n'):
+                    lines += b'\n'
+                output.write(lines)
+        os.replace(temp_file, self.output_file)
+        self.record_partitions(partitions)
+
+class PickleSink(SeasonSink):
+    '''
+    Child class, one pickled list of game dictionaries per season. A single pickle cannot be written one season at
+    a time, so the season partitions are the output and finalize() does nothing.
+    '''
+    extension = '.pk'
+
+    def __init__(self, output_dir, name = 'raw_game_data'):
+        super().__init__(output_dir, name = name)
+        self.output_file = None
+
+    def write_partition(self, games, file_name):
+        with open(file_name, 'wb') as f:
+            pickle.dump(games, f)
+
+    def finalize(self, partitions = None):
+        return
@@ -0,0 +1,302 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+"""
+Concurrent HTTP fetching for the scrapers. A Fetcher runs requests on a thread pool kept for its lifetime (so the
+pooled connections of its threads are reused by every fetch_all call), allows at most max_per_host requests in flight
+to any one host, retries connection errors and throttling / server errors with exponential backoff, and sends every
+request through a transport. The default transport keeps one pooled requests.Session per thread so connections to a
+host are kept alive between pages. Any object with a get(url, headers, timeout) method returning a
+requests.Response-like object (status_code, headers, content) can be passed as transport. A Fetcher is a context
+manager, leaving the with block shuts the thread pool down and closes the transport's sessions. CachedTransport wraps
+another transport with an on-disk response cache keyed by URL: responses younger than max_age are served from disk,
+older ones are revalidated with conditional requests (If-None-Match / If-Modified-Since) and only downloaded again
+when the server reports a change.
+"""
+
+MAX_PER_HOST = 4
+MAX_WORKERS = 16
+RETRIES = 3
+BACKOFF = 0.5
+TIMEOUT = 30
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+HTTP_CACHE_DIR = 'data/http_cache/'
+MAX_AGE = 24 * 3600
+#response headers kept with a cached body (the body is stored decoded, so encoding / length headers are dropped)
+CACHED_HEADERS = ('Content-Type', 'Date', 'ETag', 'Last-Modified', 'Cache-Control', 'Expires')
+
+class SessionTransport():
+    """
+    requests.Session per thread, each with a connection pool per host
+    """
+    def __init__(self, pool_size = MAX_PER_HOST, headers = None, proxies = None):
+        """
+        Initialize transport
+            Args:
+                - pool_size (int): connections kept alive per host and thread
+                - headers (dict): headers sent with every request
+                - proxies (dict): {scheme : proxy URL} used by every request
+            Returns:
+                - None
+        """
+        self.pool_size = pool_size
+        self.headers = headers or {}
+        self.proxies = proxies
+        self.local = threading.local()
+        self.sessions = []
+        self.lock = threading.Lock()
+
+    def session(self):
+        """
+        Session of the calling thread, opened on first use
+        """
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections = self.pool_size, pool_maxsize = self.pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update(self.headers)
+            if self.proxies:
+                session.proxies.update(self.proxies)
+            self.local.session = session
+            with self.lock:
+                self.sessions.append(session)
+        return(session)
+
+    def get(self, url, headers = None, timeout = TIMEOUT):
+        return(self.session().get(url, headers = headers, timeout = timeout))
+
+    def close(self):
+        """
+        Close every session opened by the transport
+        """
+        with self.lock:
+            sessions, self.sessions = self.sessions, []
+        for session in sessions:
+            session.close()
+        self.local = threading.local()
+
+class CachedTransport():
+    """
+    On-disk cache of successful responses in front of another transport
+    """
+    def __init__(self, transport = None, cache_dir = HTTP_CACHE_DIR, max_age = MAX_AGE):
+        """
+        Initialize cache, each response is kept as {cache_dir}/{hash of URL}.body with a .json file of its headers
+            Args:
+                - transport (object): sends the requests, SessionTransport if None
+                - cache_dir (str): directory of the cached responses
+                - max_age (float): seconds a response is served without contacting the server, 0 to revalidate every
+                    request, None to never revalidate
+            Returns:
+                - None
+        """
+        self.transport = transport if transport is not None else SessionTransport()
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def path(self, url):
+        return(os.path.join(self.cache_dir, hashlib.sha256(url.encode('utf-8')).hexdigest()))
+
+    def load(self, url):
+        """
+        Cached response of a URL
+            Args:
+                - url (str): page URL
+            Returns:
+                - dict: url, headers and stored (time of the last download or revalidation), None if not cached
+                - bytes: response body
+        """
+        path = self.path(url)
+        try:
+            with open(path + '.json', 'r') as f:
+                entry = json.load(f)
+            with open(path + '.body', 'rb') as f:
+                content = f.read()
+        except (OSError, ValueError):
+            return(None, None)
+        if entry.get('url') != url:
+            return(None, None)
+        return(entry, content)
+
+    def store(self, url, headers, content = None):
+        """
+        Save a response, the body is left unchanged if content is None (revalidated response)
+        """
+        path = self.path(url)
+        temp = '.{}.tmp'.format(threading.get_ident())
+        if content is not None:
+            with open(path + '.body' + temp, 'wb') as f:
+                f.write(content)
+            os.replace(path + '.body' + temp, path + '.body')
+        with open(path + '.json' + temp, 'w') as f:
+            json.dump({'url' : url, 'headers' : {header : headers[header] for header in CACHED_HEADERS if header in headers},
+                       'stored' : time.time()}, f)
+        os.replace(path + '.json' + temp, path + '.json')
+
+    @staticmethod
+    def cached_response(url, headers, content):
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.headers = CaseInsensitiveDict(headers)
+        response._content = content
+        response.from_cache = True
+        return(response)
+
+    def get(self, url, headers = None, timeout = TIMEOUT):
+        """
+        Request a page, from the cache if fresh, with a conditional request if stale
+            Args:
+                - url (str): page URL
+                - headers (dict): request headers
+                - timeout (float): seconds before the request times out
+            Returns:
+                - requests.Response: response, from_cache is True when the body comes from the cache
+        """
+        entry, content = self.load(url)
+        if entry is not None:
+            if self.max_age is None or time.time() - entry['stored'] < self.max_age:
+                return(self.cached_response(url, entry['headers'], content))
+            cached_headers = CaseInsensitiveDict(entry['headers'])
+            headers = dict(headers or {})
+            if 'ETag' in cached_headers:
+                headers['If-None-Match'] = cached_headers['ETag']
+            if 'Last-Modified' in cached_headers:
+                headers['If-Modified-Since'] = cached_headers['Last-Modified']
+        response = self.transport.get(url, headers = headers, timeout = timeout)
+        if response.status_code == 304 and entry is not None:
+            #a 304 may update validators, the other cached headers still describe the body
+            updated = CaseInsensitiveDict(entry['headers'])
+            for header in CACHED_HEADERS:
+                if header in response.headers:
+                    updated[header] = response.headers[header]
+            self.store(url, updated)
+            return(self.cached_response(url, updated, content))
+        if response.status_code == 200:
+            self.store(url, response.headers, response.content)
+        response.from_cache = False
+        return(response)
+
+    def close(self):
+        if hasattr(self.transport, 'close'):
+            self.transport.close()
+
+class Fetcher():
+    """
+    Thread pool of HTTP requests with per host concurrency limits and retries
+    """
+    def __init__(self, transport = None, max_per_host = MAX_PER_HOST, max_workers = MAX_WORKERS, retries = RETRIES,
+    backoff = BACKOFF, timeout = TIMEOUT):
+        """
+        Initialize fetcher
+            Args:
+                - transport (object): sends requests, SessionTransport if None
+                - max_per_host (int): maximum requests in flight to a single host
+                - max_workers (int): threads used by fetch_all
+                - retries (int): retries of a request after a connection error or a RETRY_STATUSES response
+                - backoff (float): seconds before the first retry, doubled for every following retry
+                - timeout (float): seconds before a request times out
+            Returns:
+                - None
+        """
+        self.transport = transport if transport is not None else SessionTransport(pool_size = max_per_host)
+        self.max_per_host = max_per_host
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.host_limits = {}
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *exc):
+        self.close()
+        return(False)
+
+    def host_limit(self, url):
+        """
+        Semaphore limiting the requests in flight to the host of url
+        """
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.host_limits:
+                self.host_limits[host] = threading.BoundedSemaphore(self.max_per_host)
+            return(self.host_limits[host])
+
+    def retry_delay(self, attempt, response = None):
+        """
+        Seconds to wait before a retry, a numeric Retry-After header of the response takes precedence
+        """
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after is not None and retry_after.strip().isdigit():
+            return(float(retry_after))
+        return(self.backoff * 2**attempt)
+
+    def get(self, url, headers = None):
+        """
+        Request a page, retrying connection errors and RETRY_STATUSES responses
+            Args:
+                - url (str): page URL
+                - headers (dict): request headers
+            Returns:
+                - requests.Response: response, the last one received if every attempt returned a RETRY_STATUSES status
+        """
+        limit = self.host_limit(url)
+        for attempt in range(self.retries + 1):
+            response = None
+            try:
+                with limit:
+                    response = self.transport.get(url, headers = headers, timeout = self.timeout)
+            except requests.RequestException:
+                if attempt == self.retries:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    return(response)
+            time.sleep(self.retry_delay(attempt, response))
+
+    def fetch_all(self, urls, headers = None):
+        """
+        Request pages concurrently on the Fetcher's thread pool, started by the first call and kept until close()
+            Args:
+                - urls (list): page URLs, duplicates are requested once
+                - headers (dict): request headers
+            Returns:
+                - dict: {url : requests.Response, or the exception raised by the last attempt}
+        """
+        urls = list(dict.fromkeys(urls))
+        def fetch(url):
+            try:
+                return(self.get(url, headers = headers))
+            except Exception as e:
+                return(e)
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers = max(1, self.max_workers))
+            executor = self.executor
+        return(dict(zip(urls, executor.map(fetch, urls))))
+
+    def close(self):
+        """
+        Shut the thread pool down and close the transport's sessions
+        """
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait = True)
+        if hasattr(self.transport, 'close'):
+            self.transport.close()
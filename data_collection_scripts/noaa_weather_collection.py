@@ -1,22 +1,35 @@
+import concurrent.futures
 import json
 import os
-from ftplib import FTP
 from io import StringIO
+import numpy as np
+import pandas as pd
+try:
+    import pyarrow
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pyarrow = None
+from dly_sources import FtpSource, DlyCache, FTP_SERVER, FTP_PATH, CACHE_DIR
 
-FTP_SERVER = 'ftp.ncdc.noaa.gov'
-FTP_PATH = 'pub/data/ghcn/daily/all/'
 OUTPUT_DIR = 'data/noaa_station_csvs/'
 NUM_LINE = 269
 SKIP_LINE = 248
-
-with open('data/new_stations.json', 'r') as f:
-    all_stations = json.load(f)
+NUM_DAYS = 31
+N_CONNECTIONS = 4
+OUTPUT_FORMATS = ('csv', 'parquet')
+MISSING = -9999
+ELEMENTS = ['TMAX', 'TMIN', 'PRCP', 'SNOW', 'SNWD', 'ACSC', 'ACSH', 'AWND', 'PSUN', 'WSFG', 'WSFI', 'WSFM', 'WSF1',
+'WSF2', 'WSF5']
+#one .dly record: station, year, month, element and value / measurement, quality and source flags of 31 days
+DLY_DTYPE = np.dtype([('id', 'S11'), ('year', 'S4'), ('month', 'S2'), ('element', 'S4'),
+                      ('days', [('value', 'S5'), ('mflag', 'S1'), ('qflag', 'S1'), ('sflag', 'S1')], (NUM_DAYS,))])
 
 class WeatherCollector():
     """ 
     Object to collect weather from NOAA global historical climatology network 
     """
-    def __init__(self, station_dict, output_dir, ftp_server = FTP_SERVER, ftp_path = FTP_PATH):
+    def __init__(self, station_dict, output_dir, ftp_server = FTP_SERVER, ftp_path = FTP_PATH, source = None,
+    cache_dir = CACHE_DIR, n_connections = N_CONNECTIONS, output_format = 'csv'):
         """ 
         Initialize weather collector object
             Args: 
@@ -24,6 +37,10 @@ class WeatherCollector():
                 - output_dir (str): Path to directory to write csv files containing station weather.
                 - ftp_server (str): URL for NOAA FTP server
                 - ftp_path (str): Path to directory containing .dly files for all stations in NOAA GHCN. 
+                - source (FtpSource or LocalSource): source of .dly files, FtpSource(ftp_server, ftp_path) if None
+                - cache_dir (str): Path to directory caching downloaded .dly files, None to download every station
+                - n_connections (int): Number of stations downloaded at the same time (FTP connections)
+                - output_format (str): 'csv', or 'parquet' for typed columns
             Returns:
                 - None
         """
@@ -32,56 +49,80 @@ class WeatherCollector():
         self.ftp_path = ftp_path
         self.station_dict = station_dict
         self.output_dir = output_dir
-        self.ftp = None
+        self.source = source if source is not None else FtpSource(ftp_server, ftp_path)
+        self.cache = DlyCache(cache_dir) if cache_dir is not None else None
+        self.n_connections = n_connections
+        self.output_format = output_format
     
     def collect_weather(self):
         """ 
-        Top level method to collect weather for all stations in station_dict
+        Top level method to collect weather for all stations in station_dict, stations are downloaded concurrently
+        and each station is downloaded once however many locations it belongs to
         """
         if not os.path.isdir(self.output_dir):
             os.makedirs(self.output_dir)
-        self.connect_to_ftp()
+        station_paths = {}
         for key in self.station_dict.keys():
             location_path = self.output_dir + key + '/'
             if not os.path.isdir(location_path):
                 os.makedirs(location_path)
-            station_list = self.station_dict[key]
-            for station in station_list:
-                self.scrape_station(station, location_path)
-        print('All available stations collected')
-        self.ftp.quit()
+            for station in self.station_dict[key]:
+                station_paths.setdefault(station, []).append(location_path)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers = self.n_connections) as executor:
+                futures = {executor.submit(self.scrape_station, station, paths) : station
+                           for station, paths in station_paths.items()}
+                downloaded = 0
+                for future in concurrent.futures.as_completed(futures):
+                    try:
+                        station_downloaded, messages = future.result()
+                    except Exception:
+                        station_downloaded = False
+                        messages = ['Unable to collect data for {}, {}'.format(futures[future],
+                                                                               ', '.join(station_paths[futures[future]]))]
+                    downloaded += station_downloaded
+                    #printed from the main thread so messages of different stations do not interleave
+                    for message in messages:
+                        print(message)
+        finally:
+            self.source.close()
+            if self.cache is not None:
+                self.cache.save()
+        print('All available stations collected, {} of {} downloaded'.format(downloaded, len(station_paths)))
 
 
-    def scrape_station(self, station, output_dir):
+    def scrape_station(self, station, output_dirs):
         """ 
-        Retrieve .dly file from FTP and collect data
+        Retrieve .dly file (from the cache if unchanged at the source) and collect data
             Args: 
                 - station (str): station ID of the station to be collected
-                - output_dir (str): path to directory for each location in station_dict
+                - output_dirs (list): paths to directory for each location in station_dict containing the station
             Returns:
-                - None
+                - bool: True if the file was downloaded
+                - list: status messages
         """
-        file_name = station + '.dly'
-        string = StringIO()
+        messages = []
         try:
-            self.ftp.retrlines('RETR ' + file_name, string.write)
-            aStation = Station(station, string, output_dir)
-            aStation.collect_station_data()
-            print('Successful Collection {}'.format(station))
+            if self.cache is not None:
+                content, downloaded = self.cache.load(self.source, station)
+            else:
+                content, downloaded = self.source.fetch(station), True
         except Exception:
-            print('Unable to collect data for {}, {}'.format(station, output_dir))
-        string.close()
-
-
-    def connect_to_ftp(self):
-        """ 
-        Connect to NOAA FTP and navigate to GHCN directory
-        """
-        self.ftp = FTP(self.ftp_server)
-        check_status = self.ftp.login()
-        print(check_status)
-        change_dir = self.ftp.cwd(self.ftp_path)
-        print(change_dir)
+            self.source.reset()
+            return(False, ['Unable to collect data for {}, {}'.format(station, ', '.join(output_dirs))])
+        try:
+            #line breaks removed, as the stream of retrlines
+            content = content.replace(b'\r', b'').replace(b'\n', b'').decode('ascii')
+        except UnicodeDecodeError:
+            return(downloaded, ['Unable to collect data for {}, {}'.format(station, output_dir) for output_dir in output_dirs])
+        for output_dir in output_dirs:
+            try:
+                aStation = Station(station, StringIO(content), output_dir)
+                aStation.collect_station_data(output_format = self.output_format)
+                messages.append('Successful Collection {}'.format(station))
+            except Exception:
+                messages.append('Unable to collect data for {}, {}'.format(station, output_dir))
+        return(downloaded, messages)
 
 
 class Station():
@@ -101,13 +142,36 @@ class Station():
         self.stationId = stationId
         self.string = string
         self.output_dir = output_dir
-        self.elements_to_collect = ['TMAX', 'TMIN', 'PRCP', 'SNOW', 'SNWD', 'ACSC', 'ACSH', 'AWND',
-        'PSUN', 'WSFG', 'WSFI', 'WSFM', 'WSF1', 'WSF2', 'WSF5']
+        self.elements_to_collect = list(ELEMENTS)
 
-    def collect_station_data(self):
+    def collect_station_data(self, engine = 'vectorized', output_format = 'csv'):
         """ 
-        Parse data from StringIO stream and write to .csv file
+        Parse data from StringIO stream and write to .csv (or .parquet) file
+            Args:
+                - engine (str): 'vectorized' parses all records at once (parse_dly), 'loop' reads the stream record
+                by record into one StationMonth at a time
+                - output_format (str): 'csv', or 'parquet' for typed columns (typed_days, vectorized engine only)
+            Returns:
+                - None
         """
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError('Unknown output format: {}'.format(output_format))
+        if engine == 'vectorized':
+            station_days = parse_dly(self.string.getvalue(), self.elements_to_collect)
+            if output_format == 'parquet':
+                if pyarrow is None:
+                    raise ImportError('pyarrow is required for Parquet output')
+                typed_days(station_days).to_parquet(self.output_dir + self.stationId + '.parquet', index = False)
+                return
+            with open(self.output_dir + self.stationId + '.csv', 'w', newline = '') as station_file:
+                station_file.write(','.join(['station_id', 'date'] + self.elements_to_collect))
+                station_file.write('\n')
+                self.write_days(station_days, station_file)
+            return
+        elif engine != 'loop':
+            raise ValueError('Unknown engine: {}'.format(engine))
+        elif output_format != 'csv':
+            raise ValueError('The loop engine only writes .csv files')
         self.string.seek(0)
         current_station_month = None
         current_year = ''
@@ -138,27 +202,40 @@ class Station():
                 current_year = year
                 current_month = month
 
-                current_station_month = StationMonth(id_, current_year, current_month)
+                current_station_month = StationMonth(id_, current_year, current_month, len(self.elements_to_collect))
             else:
                 pass
             
-            if len(current_station_month.days) == 0:
-                while self.string.tell() % NUM_LINE != 0:
-                    aDay = Day()
-                    value = self.string.read(5)
-                    aDay.element_values[element] = value
-                    current_station_month.days.append(aDay)
-                    self.string.read(3)
-
-            else:
-                i = 0
-                while self.string.tell() % NUM_LINE != 0:
-                    value = self.string.read(5)
-                    current_station_month.days[i].element_values[element] = value
-                    self.string.read(3)
-                    i += 1
+            if element in self.elements_to_collect:
+                #rest of the record: 31 values of 5 characters, each followed by 3 flags
+                days = self.string.read(SKIP_LINE)
+                current_station_month.set_element(self.elements_to_collect.index(element),
+                                                  [int(days[8 * i : 8 * i + 5]) for i in range(NUM_DAYS)])
+        if current_station_month != None:
+            self.write_to_file(current_station_month, station_file)
         station_file.close()
     
+    @staticmethod
+    def write_days(station_days, station_file):
+        """ 
+        Write the rows of parse_dly to a .csv file in one call, in the row format of write_to_file
+            Args:
+                - station_days (DataFrame): parse_dly output
+                - station_file (file): open .csv file being written to
+            Returns:
+                - None
+        """
+        #rows end with a separator, as written by write_to_file
+        if pyarrow is not None:
+            table = pyarrow.Table.from_pandas(station_days.assign(end = ''), preserve_index = False)
+            output = pyarrow.BufferOutputStream()
+            pa_csv.write_csv(table, output, pa_csv.WriteOptions(include_header = False, quoting_style = 'none'))
+            station_file.write(output.getvalue().to_pybytes().decode('ascii'))
+            return
+        row_format = '%s,%s,' + ','.join(['%d'] * (station_days.shape[1] - 2)) + ',\n'
+        station_file.write(''.join([row_format % row for row in zip(*[station_days[col].tolist()
+                                                                      for col in station_days.columns])]))
+
     @staticmethod
     def write_to_file(station_month, file_name):
         """ 
@@ -169,72 +246,113 @@ class Station():
             Returns:
                 - None
         """
-        day_counter = 1
-        for day in station_month.days:
-            file_name.write(station_month.stationId)
-            file_name.write(',')
-            date = '{}-{}-{}'.format(station_month.year, station_month.month, str(day_counter))
-            file_name.write(date)
-            file_name.write(',')
-            file_name.write(day.element_values['TMAX']) if 'TMAX' in day.element_values.keys() else file_name.write('-9999')
-            file_name.write(',')
-            file_name.write(day.element_values['TMIN']) if 'TMIN' in day.element_values.keys() else file_name.write('-9999')
-            file_name.write(',')
-            file_name.write(day.element_values['PRCP']) if 'PRCP' in day.element_values.keys() else file_name.write('-9999')
-            file_name.write(',')
-            file_name.write(day.element_values['SNOW']) if 'SNOW' in day.element_values.keys() else file_name.write('-9999')
-            file_name.write(',')
-            file_name.write(day.element_values['SNWD']) if 'SNWD' in day.element_values.keys() else file_name.write('-9999')
-            file_name.write(',')
-            file_name.write(day.element_values['ACSC']) if 'ACSC' in day.element_values.keys() else file_name.write('-9999')
-            file_name.write(',')
-            file_name.write(day.element_values['ACSH']) if 'ACSH' in day.element_values.keys() else file_name.write('-9999')
-            file_name.write(',')
-            file_name.write(day.element_values['AWND']) if 'AWND' in day.element_values.keys() else file_name.write('-9999')
-            file_name.write(',')
-            file_name.write(day.element_values['PSUN']) if 'PSUN' in day.element_values.keys() else file_name.write('-9999')
-            file_name.write(',')
-            file_name.write(day.element_values['WSFG']) if 'WSFG' in day.element_values.keys() else file_name.write('-9999')
-            file_name.write(',')
-            file_name.write(day.element_values['WSFI']) if 'WSFI' in day.element_values.keys() else file_name.write('-9999')
-            file_name.write(',')
-            file_name.write(day.element_values['WSFM']) if 'WSFM' in day.element_values.keys() else file_name.write('-9999')
-            file_name.write(',')
-            file_name.write(day.element_values['WSF1']) if 'WSF1' in day.element_values.keys() else file_name.write('-9999')
-            file_name.write(',')
-            file_name.write(day.element_values['WSF2']) if 'WSF2' in day.element_values.keys() else file_name.write('-9999')
-            file_name.write(',')
-            file_name.write(day.element_values['WSF5']) if 'WSF5' in day.element_values.keys() else file_name.write('-9999')
-            file_name.write(',')
-            file_name.write('\n')
-            day_counter += 1
+        for day in range(station_month.n_days):
+            date = '{}-{}-{}'.format(station_month.year, station_month.month, str(day + 1))
+            file_name.write(','.join([station_month.stationId, date] + [str(value) for value in station_month.values[day]]))
+            file_name.write(',\n')
     
+def parse_dly(content, elements = ELEMENTS):
+    """ 
+    Parse a whole .dly file at once into one row per station month day, with the layout written by
+    Station.write_to_file: consecutive records of the same year and month form a station month of 31 days (days past
+    the end of the month are missing), months without any of the elements are skipped.
+        Args:
+            - content (str or bytes): contents of a .dly file, records of NUM_LINE characters with or without line breaks
+            - elements (list): elements to collect, one column each
+        Returns:
+            - DataFrame: station_id, date ('YYYY-MM-D') and one integer column per element, MISSING when not observed
+    """
+    if isinstance(content, str):
+        content = content.encode('ascii')
+    content = content.replace(b'\r', b'').replace(b'\n', b'')
+    records = np.frombuffer(content, dtype = DLY_DTYPE, count = len(content) // NUM_LINE)
+    #station months: runs of consecutive records with the same year and month
+    year_month = np.char.add(records['year'], records['month'])
+    new_month = np.ones(len(records), dtype = bool)
+    new_month[1:] = year_month[1:] != year_month[:-1]
+    month_number = np.cumsum(new_month) - 1
+    element_index = pd.Index([element.encode('ascii') for element in elements]).get_indexer(records['element'])
+    collected = element_index >= 0
+    #a repeated element within a station month overwrites the earlier record
+    last_record = ~pd.DataFrame({'month' : month_number, 'element' : element_index}).duplicated(keep = 'last').to_numpy()
+    kept_months = np.unique(month_number[collected])
+    row_of_month = np.full(len(new_month), -1, dtype = 'int64')
+    row_of_month[kept_months] = np.arange(len(kept_months))
+
+    values = np.full((len(kept_months), NUM_DAYS, len(elements)), MISSING, dtype = 'int32')
+    written = collected & last_record
+    values[row_of_month[month_number[written]], :, element_index[written]] = \
+        records['days']['value'][written].astype('int32')
+    first_records = records[new_month][kept_months]
+    months = np.char.add(np.char.add(first_records['year'], b'-'), first_records['month']).astype(str).astype(object)
+    days = np.array(['-{}'.format(day) for day in range(1, NUM_DAYS + 1)], dtype = object)
+    dates = np.repeat(months, NUM_DAYS) + np.tile(days, len(kept_months))
+    station_days = pd.DataFrame(values.reshape(-1, len(elements)), columns = elements)
+    station_days.insert(0, 'date', dates)
+    station_days.insert(0, 'station_id', np.repeat(first_records['id'].astype(str), NUM_DAYS))
+    return(station_days)
+
+def typed_days(station_days):
+    """ 
+    Typed columns of parse_dly output for columnar storage: a real date column (days past the end of a month are
+    dropped) and nullable integer elements, missing instead of MISSING, int16 unless a value does not fit
+        Args:
+            - station_days (DataFrame): parse_dly output
+        Returns:
+            - DataFrame: station_id, date (datetime64) and one Int16 / Int32 column per element
+    """
+    dates = pd.to_datetime(station_days.date, format = '%Y-%m-%d', errors = 'coerce')
+    valid = dates.notna().to_numpy()
+    typed = pd.DataFrame({'station_id' : station_days.station_id.to_numpy()[valid], 'date' : dates.to_numpy()[valid]})
+    int16 = np.iinfo('int16')
+    for element in station_days.columns[2:]:
+        values = station_days[element].to_numpy()[valid]
+        missing = values == MISSING
+        observed = values[~missing]
+        fits = len(observed) == 0 or (observed.min() >= int16.min and observed.max() <= int16.max)
+        column = pd.array(values, dtype = 'Int16' if fits else 'Int32')
+        column[missing] = pd.NA
+        typed[element] = column
+    return(typed)
+
 class StationMonth():
     """ 
-    NOAA GHCN .dly files are indexed by station month, object for each line in file
+    NOAA GHCN .dly files are indexed by station month, the month's records are held in one array of days x elements
     """
-    def __init__(self, stationId, year, month):
+    __slots__ = ('stationId', 'year', 'month', 'values', 'n_days')
+
+    def __init__(self, stationId, year, month, n_elements = len(ELEMENTS)):
         """ 
         Initialize StationMonth object
             Args: 
                 - stationId (str): station ID
                 - year (str): year of data collected
                 - month (str): month of data collected
+                - n_elements (int): number of elements collected
             Returns: 
                 - None
         """
         self.stationId = stationId
         self.year = year
         self.month = month
-        self.days = []
+        self.values = np.full((NUM_DAYS, n_elements), MISSING, dtype = 'int32')
+        #days are only written once an element of the month has been collected
+        self.n_days = 0
 
-class Day():
-    """ 
-    A single day of observations
-    """
-    def __init__(self):
-        self.element_values = {}
+    def set_element(self, element_index, values):
+        """ 
+        Store the daily values of one element
+            Args:
+                - element_index (int): column of the element
+                - values (list): NUM_DAYS integer values
+            Returns:
+                - None
+        """
+        self.values[:, element_index] = values
+        self.n_days = NUM_DAYS
 
 if __name__ == '__main__':
+    with open('data/new_stations.json', 'r') as f:
+        all_stations = json.load(f)
     collector = WeatherCollector(all_stations, OUTPUT_DIR)
     collector.collect_weather()
\ No newline at end of file
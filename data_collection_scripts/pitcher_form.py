@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+'''
+Recent form features of starting pitchers, on top of the starter table used by starting_pitchers.py
+(all_starters.csv.gz). For every start, ERA, WHIP, K/9 and BB/9 are computed over the starter's last N starts and
+with exponentially decayed weights (half-life in starts), using only starts on earlier dates so the features are
+point-in-time correct (starts on the same date, e.g. doubleheaders, never see each other). All starters are handled
+in a single vectorized pass: windows are differences of per-starter cumulative sums, decayed sums come from a grouped
+exponentially weighted mean.
+'''
+
+FILE_LOC = './all_starters.csv.gz'
+
+FORM_COLS = ['ER', 'IP', 'BB', 'H', 'K']
+
+WINDOWS = [3, 5, 10]
+
+HALF_LIVES = [3, 10]
+
+def form_features(all_starters, windows = WINDOWS, half_lives = HALF_LIVES):
+    '''
+    Last-N-starts and exponentially decayed ERA, WHIP, K/9 and BB/9 of every start, over prior dates only
+        Args:
+            - all_starters [pandas.DataFrame]: starts with starter_code, date, ER, IP, BB, H and K columns
+            - windows [list]: numbers of prior starts N, one last{N}_ set of columns each
+            - half_lives [list]: half-lives in starts, one ewm{half_life}_ set of columns each
+        Returns:
+            - [pandas.DataFrame]: indexed like all_starters. Rates are 0 without prior innings
+    '''
+    codes = pd.factorize(all_starters.starter_code)[0]
+    days = pd.to_datetime(all_starters.date).to_numpy()
+    order = np.lexsort((days, codes))
+    codes, days = codes[order], days[order]
+    values = all_starters[FORM_COLS].fillna(0).to_numpy(dtype = 'float64')[order]
+
+    position = np.arange(len(order))
+    new_pitcher = np.ones(len(order), dtype = bool)
+    new_pitcher[1:] = codes[1:] != codes[:-1]
+    new_date = new_pitcher.copy()
+    new_date[1:] |= days[1:] != days[:-1]
+    pitcher_first = np.maximum.accumulate(np.where(new_pitcher, position, 0))
+    date_first = np.maximum.accumulate(np.where(new_date, position, 0))
+
+    features = {}
+    #sums over the N starts before the first start of the date: exclusive cumulative sums
+    exclusive = np.vstack([np.zeros((1, len(FORM_COLS))), np.cumsum(values, axis = 0)])
+    for n in windows:
+        window_start = np.maximum(date_first - n, pitcher_first)
+        features.update(rates(exclusive[date_first] - exclusive[window_start], 'last{}_'.format(n)))
+
+    #decayed sums: weighted means share their weights, so ratios of means equal ratios of weighted sums
+    previous = date_first - 1
+    has_prior = previous >= pitcher_first
+    previous[~has_prior] = 0
+    sorted_values = pd.DataFrame(values, columns = FORM_COLS)
+    for half_life in half_lives:
+        decayed = sorted_values.groupby(codes, sort = False).ewm(halflife = half_life).mean()
+        decayed = decayed.reset_index(level = 0, drop = True).sort_index().to_numpy()
+        prior = np.where(has_prior[:, None], decayed[previous], 0.0)
+        features.update(rates(prior, 'ewm{}_'.format(half_life)))
+
+    unsorted = np.empty(len(order), dtype = 'int64')
+    unsorted[order] = position
+    return(pd.DataFrame({col : values_[unsorted] for col, values_ in features.items()}, index = all_starters.index))
+
+def rates(sums, prefix):
+    '''
+    ERA, WHIP, K/9 and BB/9 from (possibly weighted) sums of FORM_COLS
+        Args:
+            - sums [numpy.ndarray]: one row per start, columns FORM_COLS
+            - prefix [str]: column prefix
+        Returns:
+            - [dict]: {column : numpy.ndarray}, 0 where there are no innings
+    '''
+    er, ip, bb, h, k = (sums[:, j] for j in range(len(FORM_COLS)))
+    pitched = ip > 0
+    safe_ip = np.where(pitched, ip, 1.0)
+    return({prefix + 'ERA' : np.where(pitched, (er / safe_ip) * 9, 0.0),
+            prefix + 'WHIP' : np.where(pitched, (bb + h) / safe_ip, 0.0),
+            prefix + 'K9' : np.where(pitched, (k / safe_ip) * 9, 0.0),
+            prefix + 'BB9' : np.where(pitched, (bb / safe_ip) * 9, 0.0)})
+
+if __name__ == "__main__":
+    all_starters_main = pd.read_csv(FILE_LOC, compression = 'gzip')
+    form = pd.concat([all_starters_main[['date', 'starter_code', 'team_code', 'is_home']],
+                      form_features(all_starters_main)], axis = 1)
+    form.to_csv('./pitcher_form.csv.gz', index = False, compression = 'gzip')
+    print('Complete. Look for pitcher_form.csv.gz in working directory. Thanks!')
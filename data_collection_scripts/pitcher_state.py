@@ -0,0 +1,194 @@
+import os
+import pickle
+import pandas as pd
+from double_header import flag_doubleheaders
+from starting_pitchers import HOME_COLS, ROAD_COLS, HOME_KEYS, ROAD_KEYS
+'''
+Incremental daily updates of the starting pitcher splits produced by starting_pitchers.py. Instead of recomputing every
+season since 1918 to add one day of starts, PitcherStateStore keeps running sums (ER, IP, BB, H and number of starts)
+per starter for the career, home only and road only splits and for the starter's current season, persisted between
+runs. apply_day() emits the pre-game rows of a new date (same columns as elo_starters.csv.gz) from the stored sums and
+then adds the day's starts, features() emits the rows only, e.g. for probable starters before first pitch.
+'''
+
+STATE_LOC = './pitcher_state.pk'
+
+SUM_COLS = ['ER', 'IP', 'BB', 'H']
+
+SPLITS = ['career', 'career_home', 'career_road', 'season', 'season_home', 'season_road']
+
+class PitcherStateStore():
+    '''
+    Running per-starter sums of every split, in the state of the last applied date
+    '''
+    def __init__(self, state_loc = STATE_LOC):
+        '''
+        Initialize an empty store
+            Args:
+                - state_loc [str]: location the store is saved to and loaded from
+        '''
+        self.state_loc = state_loc
+        self.last_date = None
+        self.pitchers = {}
+
+    @classmethod
+    def load(cls, state_loc = STATE_LOC):
+        '''
+        Load a saved store, or an empty store if nothing has been saved to state_loc
+            Args:
+                - state_loc [str]: location of the saved store
+            Returns:
+                - [PitcherStateStore]: store
+        '''
+        store = cls(state_loc)
+        if os.path.exists(state_loc):
+            with open(state_loc, 'rb') as f:
+                saved = pickle.load(f)
+            store.last_date = saved['last_date']
+            store.pitchers = saved['pitchers']
+        return(store)
+
+    def save(self):
+        '''
+        Save the store to state_loc, under a temporary name and renamed so an interrupted save keeps the previous state
+            Args:
+                None
+            Returns:
+                None
+        '''
+        temp_file = self.state_loc + '.tmp'
+        with open(temp_file, 'wb') as f:
+            pickle.dump({'last_date' : self.last_date, 'pitchers' : self.pitchers}, f)
+        os.replace(temp_file, self.state_loc)
+
+    @classmethod
+    def from_history(cls, all_starters, state_loc = STATE_LOC):
+        '''
+        Build the store from a table of past starts in one groupby pass per split
+            Args:
+                - all_starters [pandas.DataFrame]: starts (all_starters.csv.gz columns)
+                - state_loc [str]: location the store is saved to
+            Returns:
+                - [PitcherStateStore]: store in the state after the last date of all_starters
+        '''
+        store = cls(state_loc)
+        starts = cls.prepare(all_starters)
+        if len(starts) == 0:
+            return(store)
+        seasons = starts.groupby('starter_code').year.max()
+        current = starts[starts.year.to_numpy() == seasons.reindex(starts.starter_code).to_numpy()]
+        split_starts = {'career' : starts,
+                        'career_home' : starts[starts.is_home == 1],
+                        'career_road' : starts[starts.is_home == 0],
+                        'season' : current,
+                        'season_home' : current[current.is_home == 1],
+                        'season_road' : current[current.is_home == 0]}
+        for pitcher, season in seasons.items():
+            store.pitchers[pitcher] = {'season' : int(season), 'sums' : {split : [0.0] * 5 for split in SPLITS}}
+        for split, split_df in split_starts.items():
+            sums = split_df.groupby('starter_code')[SUM_COLS].sum()
+            sums['n'] = split_df.groupby('starter_code').size()
+            for pitcher, row in zip(sums.index, sums.itertuples(index = False)):
+                store.pitchers[pitcher]['sums'][split] = list(row)
+        store.last_date = starts.date.max()
+        return(store)
+
+    @staticmethod
+    def prepare(starts):
+        '''
+        Factory method, normalize dates to 'YYYY-MM-DD' strings, add year and fill missing stat values with 0
+            Args:
+                - starts [pandas.DataFrame]: starts
+            Returns:
+                - [pandas.DataFrame]: copy of starts
+        '''
+        starts = starts.copy()
+        starts['date'] = pd.to_datetime(starts.date).dt.strftime('%Y-%m-%d')
+        starts['year'] = starts.date.str[0:4].astype('int64')
+        for col in SUM_COLS:
+            if col in starts:
+                starts[col] = starts[col].fillna(0)
+        return(starts)
+
+    def split_stats(self, pitcher, split, year):
+        '''
+        ERA, WHIP and average innings of a starter over one split, 0 without prior innings or starts. Season splits
+        are empty when the starter has not started in year yet.
+            Args:
+                - pitcher [str]: starter_code
+                - split [str]: one of SPLITS
+                - year [int]: season of the start
+            Returns:
+                - [list]: [ERA, WHIP, AVGIP]
+        '''
+        state = self.pitchers.get(pitcher)
+        if state is None or (split.startswith('season') and state['season'] != year):
+            return([0.0, 0.0, 0.0])
+        er, ip, bb, h, n = state['sums'][split]
+        era = (er / ip) * 9 if ip > 0 else 0.0
+        whip = (bb + h) / ip if ip > 0 else 0.0
+        avg_ip = ip / n if n != 0 else 0.0
+        return([era, whip, avg_ip])
+
+    def features(self, starts):
+        '''
+        Pre-game rows of one date's starts from the stored sums, the stored state is not changed
+            Args:
+                - starts [pandas.DataFrame]: starts of a single date with date, starter_code, team_code, opponent and
+                    is_home columns (is_doubleheader / is_tripleheader are flagged if missing)
+            Returns:
+                - [pandas.DataFrame]: one row per game, columns of elo_starters.csv.gz
+        '''
+        starts = self.prepare(starts)
+        if 'is_doubleheader' not in starts or 'is_tripleheader' not in starts:
+            starts = flag_doubleheaders(starts)
+        rows = {1 : [], 0 : []}
+        for start in starts.itertuples(index = False):
+            venue = 'home' if start.is_home == 1 else 'road'
+            row = [start.date, start.starter_code, start.team_code, start.opponent, start.is_doubleheader,
+                   start.is_tripleheader]
+            for split in ('career', 'career_' + venue, 'season', 'season_' + venue):
+                row += self.split_stats(start.starter_code, split, start.year)
+            rows[start.is_home].append(row)
+        home_rows = pd.DataFrame(rows[1], columns = HOME_COLS)
+        road_rows = pd.DataFrame(rows[0], columns = ROAD_COLS)
+        return(home_rows.merge(road_rows, how = 'left', left_on = HOME_KEYS, right_on = ROAD_KEYS))
+
+    def update(self, starts):
+        '''
+        Add one date's starts to the stored sums
+            Args:
+                - starts [pandas.DataFrame]: starts of a single date with results (ER, IP, BB, H)
+            Returns:
+                None
+        '''
+        starts = self.prepare(starts)
+        for start in starts.itertuples(index = False):
+            state = self.pitchers.setdefault(start.starter_code,
+                                             {'season' : int(start.year), 'sums' : {split : [0.0] * 5 for split in SPLITS}})
+            if state['season'] != start.year:
+                state['season'] = int(start.year)
+                for split in ('season', 'season_home', 'season_road'):
+                    state['sums'][split] = [0.0] * 5
+            venue = 'home' if start.is_home == 1 else 'road'
+            values = [start.ER, start.IP, start.BB, start.H, 1]
+            for split in ('career', 'career_' + venue, 'season', 'season_' + venue):
+                state['sums'][split] = [total + value for total, value in zip(state['sums'][split], values)]
+        self.last_date = starts.date.max()
+
+    def apply_day(self, starts):
+        '''
+        Emit the pre-game rows of a new date, then add its starts to the stored sums
+            Args:
+                - starts [pandas.DataFrame]: starts of a single date after the last applied date
+            Returns:
+                - [pandas.DataFrame]: one row per game, columns of elo_starters.csv.gz
+        '''
+        dates = pd.to_datetime(starts.date).dt.strftime('%Y-%m-%d').unique()
+        if len(dates) != 1:
+            raise ValueError('apply_day takes the starts of a single date, got {}'.format(len(dates)))
+        if self.last_date is not None and dates[0] <= self.last_date:
+            raise ValueError('{} is not after the last applied date {}'.format(dates[0], self.last_date))
+        rows = self.features(starts)
+        self.update(starts)
+        return(rows)
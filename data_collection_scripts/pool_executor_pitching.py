@@ -2,6 +2,8 @@ import pandas as pd
 import concurrent.futures
 import sys
 import os
+import tempfile
+from starter_splits import PriorStarts, assign_prior_splits
 
 OUTPUT_DIR = './elo_starter/'
 DROP_COLS = ['is_home', 'IP', 'H', 'BB', 'K', 'ER', 'year']
@@ -15,9 +17,17 @@ ROAD_COLS = ['date', 'road_starter', 'road_team', 'home_team', 'is_doubleheader'
         'road_season_AVGIP', 'road_season_ERA_OR', 'road_season_WHIP_OR', 'road_season_AVGIP_OR']
 HOME_KEYS = ['date', 'home_team', 'road_team', 'is_doubleheader', 'is_tripleheader']
 ROAD_KEYS = ['date', 'home_team', 'road_team', 'is_doubleheader', 'is_tripleheader']
+#'shared': career histories are written once and memory-mapped by every worker, seasons are collected into one output
+#'per_year': the full starter tables are sent to one exec_fn task per year, each writing {year}.csv, career histories
+#are still built once and memory-mapped by every worker
+MODE = 'shared'
+N_JOBS = 6
+
+#career histories of the worker process, memory-mapped by attach_histories
+_histories = {}
 
 def exec_fn(year, all_starters, all_home_starters, all_road_starters, drop_cols = DROP_COLS, home_cols = HOME_COLS, 
-road_cols = ROAD_COLS, home_keys = HOME_KEYS, road_keys = ROAD_KEYS, output_dir = OUTPUT_DIR):   
+road_cols = ROAD_COLS, home_keys = HOME_KEYS, road_keys = ROAD_KEYS, output_dir = OUTPUT_DIR, engine = 'cumulative'):   
     
     home_starters_ = all_home_starters[all_home_starters.year == year].reset_index(drop = True)
     road_starters_ = all_road_starters[all_road_starters.year == year].reset_index(drop = True)
@@ -26,21 +36,107 @@ road_cols = ROAD_COLS, home_keys = HOME_KEYS, road_keys = ROAD_KEYS, output_dir
     home_starters_ = create_cols(home_starters_, home = True)
     road_starters_ = create_cols(road_starters_)
 
-    home_starters_ = assign_splits(home_starters_, all_starters, all_starters_, all_home_starters, all_road_starters, home = True)
-    road_starters_ = assign_splits(road_starters_, all_starters, all_starters_, all_home_starters, all_road_starters)
+    #career histories memory-mapped by attach_histories when the pool was started by run_per_year
+    histories = _histories if engine == 'cumulative' and _histories else None
+    home_starters_ = assign_splits(home_starters_, all_starters, all_starters_, all_home_starters, all_road_starters, home = True,
+    engine = engine, histories = histories)
+    road_starters_ = assign_splits(road_starters_, all_starters, all_starters_, all_home_starters, all_road_starters,
+    engine = engine, histories = histories)
+
+    final_ = merge_season(home_starters_, road_starters_, drop_cols, home_cols, road_cols, home_keys, road_keys)
+    final_.to_csv('{}{}.csv'.format(output_dir, year), index = False)
+    print('{} written'.format(year))
 
+def merge_season(home_starters_, road_starters_, drop_cols = DROP_COLS, home_cols = HOME_COLS, road_cols = ROAD_COLS,
+home_keys = HOME_KEYS, road_keys = ROAD_KEYS):
     home_starters_ = home_starters_.drop(columns = drop_cols)
     road_starters_ = road_starters_.drop(columns = drop_cols)
 
     home_starters_.columns = home_cols
     road_starters_.columns = road_cols
 
-    final_ = home_starters_.merge(road_starters_, how = 'left', left_on = home_keys, right_on = road_keys)
-    final_.to_csv('{}{}.csv'.format(output_dir, year), index = False)
-    print('{} written'.format(year))
+    return(home_starters_.merge(road_starters_, how = 'left', left_on = home_keys, right_on = road_keys))
+
+def write_histories(history_dir, all_starters, all_home_starters, all_road_starters):
+    #career, home and road histories are sorted and summed once, then memory-mapped by attach_histories
+    PriorStarts(all_starters).save(history_dir, 'career')
+    PriorStarts(all_home_starters).save(history_dir, 'home')
+    PriorStarts(all_road_starters).save(history_dir, 'road')
+
+def attach_histories(history_dir):
+    #worker initializer: map the career, home and road histories written by run_shared, no copy per worker or task
+    for name in ('career', 'home', 'road'):
+        _histories[name] = PriorStarts.load(history_dir, name)
+
+def exec_season(year, all_starters_, home_starters_, road_starters_):
+    #splits of a single season against the memory-mapped career histories, only the season's starts are sent
+    home_starters_ = create_cols(home_starters_.reset_index(drop = True), home = True)
+    road_starters_ = create_cols(road_starters_.reset_index(drop = True))
+    season = PriorStarts(all_starters_)
+
+    home_starters_ = assign_prior_splits(home_starters_, _histories['career'], _histories['home'], season,
+    PriorStarts(home_starters_), 'home_', '_AH')
+    road_starters_ = assign_prior_splits(road_starters_, _histories['career'], _histories['road'], season,
+    PriorStarts(road_starters_), 'road_', '_OR')
+
+    return(merge_season(home_starters_, road_starters_))
+
+def run_shared(all_starters, all_home_starters, all_road_starters, n_jobs = N_JOBS, output_dir = OUTPUT_DIR):
+    year_list = list(all_starters.year.unique())
+    seasons = {}
+    with tempfile.TemporaryDirectory() as history_dir:
+        write_histories(history_dir, all_starters, all_home_starters, all_road_starters)
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers = n_jobs, initializer = attach_histories, 
+        initargs = (history_dir,)) as executor:
+            futures = {executor.submit(exec_season, year, all_starters[all_starters.year == year],
+                                       all_home_starters[all_home_starters.year == year],
+                                       all_road_starters[all_road_starters.year == year]) : year for year in year_list}
+            for future in concurrent.futures.as_completed(futures):
+                year = futures[future]
+                try:
+                    seasons[year] = future.result()
+                    print('Season of {} complete'.format(year))
+                except (KeyboardInterrupt, SystemExit):
+                    raise
+                except:
+                    print('Problem with {}: {}'.format(year, sys.exc_info()[0]))
+
+    complete = pd.concat([seasons[year] for year in year_list if year in seasons], axis = 0, sort = False)
+    complete.to_csv('{}elo_starters.csv.gz'.format(output_dir), index = False, compression = 'gzip')
+    print('Complete. Look for elo_starters.csv.gz in {}'.format(output_dir))
+
+def run_per_year(all_starters, all_home_starters, all_road_starters, n_jobs = N_JOBS, output_dir = OUTPUT_DIR):
+    year_list = list(all_starters.year.unique())
+    with tempfile.TemporaryDirectory() as history_dir:
+        write_histories(history_dir, all_starters, all_home_starters, all_road_starters)
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers = n_jobs, initializer = attach_histories,
+        initargs = (history_dir,)) as executor:
+            futures = {executor.submit(exec_fn, year, all_starters, all_home_starters, all_road_starters,
+                                       output_dir = output_dir) : year for year in year_list}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except (KeyboardInterrupt, SystemExit):
+                    raise
+                except:
+                    print('Problem with {}: {}'.format(futures[future], sys.exc_info()[0]))
     
 
-def assign_splits(working, all_starters, all_season, all_home, all_road, home = False):
+def assign_splits(working, all_starters, all_season, all_home, all_road, home = False, engine = 'cumulative',
+histories = None):
+    #engine: 'cumulative' looks splits up in per-pitcher cumulative sums (starter_splits.py), 'loop' filters every start
+    #histories: {'career', 'home', 'road'} PriorStarts built once by the caller, only built here when not given
+    if engine == 'cumulative':
+        career = histories['career'] if histories else PriorStarts(all_starters)
+        if home:
+            return(assign_prior_splits(working, career, histories['home'] if histories else PriorStarts(all_home),
+                                       PriorStarts(all_season), PriorStarts(working), 'home_', '_AH'))
+        return(assign_prior_splits(working, career, histories['road'] if histories else PriorStarts(all_road),
+                                   PriorStarts(all_season), PriorStarts(working), 'road_', '_OR'))
+    elif engine != 'loop':
+        raise ValueError('Unknown engine: {}'.format(engine))
     if home:
         for j in range(len(working)):
             pitcher = working.iloc[j]['starter_code']
@@ -142,9 +238,8 @@ if __name__ == "__main__":
     all_home_starters_main = all_starters_main[all_starters_main.is_home == 1].reset_index(drop = True).sort_values(by = ['date'])
     all_road_starters_main = all_starters_main[all_starters_main.is_home == 0].reset_index(drop = True).sort_values(by = ['date'])
 
-    YEAR_LIST = list(all_starters_main.year.unique())
-
-    with concurrent.futures.ProcessPoolExecutor(max_workers = 6) as executor:
-        for year in YEAR_LIST:
-            executor.submit(exec_fn, year, all_starters_main, all_home_starters_main, all_road_starters_main)
+    if MODE == 'shared':
+        run_shared(all_starters_main, all_home_starters_main, all_road_starters_main)
+    else:
+        run_per_year(all_starters_main, all_home_starters_main, all_road_starters_main)
 
@@ -1,5 +1,59 @@
+import csv
 import glob
-import os 
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+'''
+Readers for the Retrosheet gamelog files (data/retro_gamelogs_txt/GL{year}.TXT, 161 comma separated fields per game,
+strings quoted). read_gamelog parses a file in one pass with the csv module, keeps the requested fields of
+GAMELOG_FIELDS (any of the 161, only the columns in GAMELOG_COLUMNS by default) and types them in bulk: dates as
+datetime64, counts as nullable integers, codes as categoricals. Lines with the wrong number of fields or values that
+cannot be typed are returned as rejects (file, line number, reason) instead of being skipped silently.
+write_gamelogs reads every file, optionally one worker process per file, and writes a single Parquet file.
+'''
+
+TEAM_STATS = ['at_bats', 'hits', 'doubles', 'triples', 'home_runs', 'rbi', 'sacrifice_hits', 'sacrifice_flies',
+              'hit_by_pitch', 'walks', 'intentional_walks', 'strikeouts', 'stolen_bases', 'caught_stealing',
+              'grounded_into_double_plays', 'catcher_interference', 'left_on_base', 'pitchers_used',
+              'individual_earned_runs', 'team_earned_runs', 'wild_pitches', 'balks', 'putouts', 'assists', 'errors',
+              'passed_balls', 'double_plays', 'triple_plays']
+
+PERSONNEL = ['home_plate_umpire', 'first_base_umpire', 'second_base_umpire', 'third_base_umpire', 'left_field_umpire',
+             'right_field_umpire', 'visiting_manager', 'home_manager', 'winning_pitcher', 'losing_pitcher',
+             'saving_pitcher', 'game_winning_rbi_batter', 'visiting_starting_pitcher', 'home_starting_pitcher']
+
+'''
+Every field of a gamelog line, in file order (https://www.retrosheet.org/gamelogs/glfields.txt)
+'''
+GAMELOG_FIELDS = (['date', 'game_number', 'day_of_week', 'visiting_team', 'visiting_league', 'visiting_game_number',
+                   'home_team', 'home_league', 'home_game_number', 'visiting_score', 'home_score', 'length_in_outs',
+                   'day_night', 'completion_info', 'forfeit_info', 'protest_info', 'park_id', 'attendance',
+                   'time_of_game', 'visiting_line_score', 'home_line_score'] +
+                  ['visiting_' + stat for stat in TEAM_STATS] +
+                  ['home_' + stat for stat in TEAM_STATS] +
+                  [person + suffix for person in PERSONNEL for suffix in ('_id', '_name')] +
+                  ['{}_player_{}_{}'.format(team, k, item) for team in ('visiting', 'home') for k in range(1, 10)
+                   for item in ('id', 'name', 'position')] +
+                  ['additional_info', 'acquisition_info'])
+
+INTEGER_FIELDS = set(['visiting_game_number', 'home_game_number', 'visiting_score', 'home_score', 'length_in_outs',
+                      'attendance', 'time_of_game'] +
+                     [team + stat for team in ('visiting_', 'home_') for stat in TEAM_STATS] +
+                     ['{}_player_{}_position'.format(team, k) for team in ('visiting', 'home') for k in range(1, 10)])
+
+CATEGORY_FIELDS = set(['game_number', 'day_of_week', 'visiting_team', 'visiting_league', 'home_team', 'home_league',
+                       'day_night', 'park_id', 'acquisition_info'])
+
+'''
+Fields written by write_gamelogs by default
+'''
+GAMELOG_COLUMNS = ['date', 'game_number', 'visiting_team', 'home_team', 'day_night', 'park_id', 'attendance']
+
+GAMELOG_FILES = 'data/retro_gamelogs_txt/*.TXT'
 
 def parse_retrograde(in_files, out_file):
     for file in in_files:
@@ -16,10 +70,107 @@ def parse_retrograde(in_files, out_file):
                 except Exception:
                     continue
 
+def read_gamelog(file_name, columns = GAMELOG_COLUMNS):
+    '''
+    Read the requested fields of one gamelog file
+        Args:
+            - file_name [str]: location of GL{year}.TXT
+            - columns [list]: fields of GAMELOG_FIELDS to keep, in any order
+        Returns:
+            - [pandas.DataFrame]: one row per valid line, typed columns in the order of columns
+            - [pandas.DataFrame]: rejected lines: file, line (1-based), reason
+    '''
+    unknown = [column for column in columns if column not in GAMELOG_FIELDS]
+    if len(unknown) > 0:
+        raise ValueError('Unknown gamelog fields: {}'.format(unknown))
+    positions = [GAMELOG_FIELDS.index(column) for column in columns]
+    n_fields = len(GAMELOG_FIELDS)
+    values, line_numbers, rejects = [], [], []
+    with open(file_name, 'r', newline = '', encoding = 'latin-1') as f:
+        reader = csv.reader(f)
+        for row in reader:
+            if len(row) != n_fields:
+                if len(row) > 0:
+                    rejects.append((file_name, reader.line_num, '{} fields'.format(len(row))))
+                continue
+            values.append([row[position] for position in positions])
+            line_numbers.append(reader.line_num)
+    df = pd.DataFrame(values, columns = list(columns), dtype = 'object')
+    line_numbers = pd.Series(line_numbers, dtype = 'int64')
+    bad = pd.Series(False, index = df.index)
+    reasons = pd.Series('', index = df.index, dtype = 'object')
+    for column in columns:
+        raw = df[column].str.strip()
+        if column == 'date':
+            typed = pd.to_datetime(raw, format = '%Y%m%d', errors = 'coerce')
+        elif column in INTEGER_FIELDS:
+            typed = pd.to_numeric(raw, errors = 'coerce')
+            typed = typed.where(typed % 1 == 0).astype('Int32')
+        else:
+            df[column] = raw.astype('category') if column in CATEGORY_FIELDS else raw
+            continue
+        #missing counts are allowed, a game without a date is not
+        invalid = typed.isna() & ((raw != '') | (column == 'date'))
+        reasons[invalid & ~bad] = 'bad ' + column
+        bad |= invalid
+        df[column] = typed
+    rejects = pd.DataFrame(rejects + list(zip([file_name] * int(bad.sum()), line_numbers[bad], reasons[bad])),
+                           columns = ['file', 'line', 'reason'])
+    return(df[~bad].reset_index(drop = True), rejects.sort_values('line', kind = 'stable').reset_index(drop = True))
+
+def read_gamelogs(files, columns = GAMELOG_COLUMNS, n_jobs = 1):
+    '''
+    Read every gamelog file, categorical columns are recombined across files
+        Args:
+            - files [list]: locations of GL{year}.TXT files, read in order
+            - columns [list]: fields of GAMELOG_FIELDS to keep
+            - n_jobs [int]: worker processes, one file per task
+        Returns:
+            - [pandas.DataFrame]: games of every file
+            - [pandas.DataFrame]: rejected lines of every file
+    '''
+    files = list(files)
+    if n_jobs > 1:
+        with ProcessPoolExecutor(max_workers = n_jobs) as executor:
+            results = list(executor.map(read_gamelog, files, [columns] * len(files)))
+    else:
+        results = [read_gamelog(file, columns) for file in files]
+    if len(results) == 0:
+        return(pd.DataFrame(columns = list(columns)), pd.DataFrame(columns = ['file', 'line', 'reason']))
+    games = pd.concat([result[0] for result in results], ignore_index = True)
+    for column in columns:
+        if column in CATEGORY_FIELDS:
+            games[column] = games[column].astype('category')
+    rejects = pd.concat([result[1] for result in results], ignore_index = True)
+    return(games, rejects)
+
+def write_gamelogs(files, output_file, columns = GAMELOG_COLUMNS, n_jobs = 1, rejects_file = None):
+    '''
+    Read every gamelog file and write the games to a single Parquet file (requires pyarrow)
+        Args:
+            - files [list]: locations of GL{year}.TXT files
+            - output_file [str]: location of the .parquet file
+            - columns [list]: fields of GAMELOG_FIELDS to keep
+            - n_jobs [int]: worker processes, one file per task
+            - rejects_file [str]: location of a .csv of the rejected lines, None to only print their count
+        Returns:
+            - [pandas.DataFrame]: rejected lines
+    '''
+    if pyarrow is None:
+        raise ImportError('pyarrow is required for Parquet output')
+    games, rejects = read_gamelogs(files, columns, n_jobs)
+    games.to_parquet(output_file, index = False)
+    if rejects_file is not None:
+        rejects.to_csv(rejects_file, index = False)
+    print('{} games written to {}, {} lines rejected'.format(len(games), output_file, len(rejects)))
+    return(rejects)
+
 if __name__ == '__main__':
-    ALL_FILES = glob.glob('data/retro_gamelogs_txt/*.TXT')
+    ALL_FILES = sorted(glob.glob(GAMELOG_FILES))
+    write_gamelogs(ALL_FILES, 'data/retrograde_gamelog.parquet', n_jobs = os.cpu_count(),
+                   rejects_file = 'data/retrograde_gamelog_rejects.csv')
     out_file = open('data/retrograde_gamelog.csv', 'w')
     out_file.write('date,away_team,home_team,game_time,park_id,attendance,\n')
-    
+
     parse_retrograde(ALL_FILES, out_file)
-    out_file.close()
\ No newline at end of file
+    out_file.close()
@@ -0,0 +1,208 @@
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+'''
+Runner advance parsing and earned run attribution for the Retrosheet event parsers. Retrosheet does not provide
+earned runs or who they are charged to, so both parsers recover them from the EVENT_TX play descriptions: runs
+flagged '(UR)' are unearned, and runners who were on base when the starting pitcher was removed mid inning are
+charged back to the starter (RUN{1,2,3}_RESP_PIT_ID). This module tokenizes every EVENT_TX of a season once
+(cached by unique text) into a columnar table of runner advances and charges runs to starters and bullpens for
+every (GAME_ID, BAT_HOME_ID) pair in bulk. Used by event_parser.py and event_parser_ADV.py when
+earned_run_mode = 'season'.
+'''
+
+UNEARNED_FLAG = '(UR)'
+
+ADVANCE_COLS = ['event', 'origin', 'dest', 'unearned', 'out', 'scores', 'malformed']
+
+CHARGE_KEYS = ['GAME_ID', 'BAT_HOME_ID']
+
+@lru_cache(maxsize = None)
+def parse_advances(event_tx):
+    '''
+    Tokenize the runner advances of a single EVENT_TX, following the rules used by the per game parsers: the
+    advances are the ';' separated tokens after the first '.', or the whole text when it has no '.'.
+        Args:
+            - event_tx [str]: Retrosheet play description, e.g. 'S8.3-H;2-H(UR);1-3'
+        Returns:
+            - [tuple]: one (origin, dest, unearned, out, scores, malformed) tuple per token
+                origin [str]: 'B', '1', '2', '3', or '' when the token has no '-' (e.g. the 'H' home run shorthand)
+                dest [str]: destination base as written, '' when the token has no '-'
+                unearned [bool]: token carries the '(UR)' flag
+                out [bool]: runner was put out on the play ('X')
+                scores [bool]: runner (or batter) reached home
+                malformed [bool]: token cannot be read as a scoring advance (the per game parsers raise on these)
+    '''
+    runners = event_tx.split('.')
+    if len(runners) > 1:
+        potential_runs_scored = runners[1].split(';')
+    else:
+        potential_runs_scored = runners
+    tokens = []
+    for run in potential_runs_scored:
+        unearned = UNEARNED_FLAG in run
+        out = 'X' in run
+        origin, dest, scores, malformed = '', '', False, False
+        if '-' not in run:
+            if len(run) == 0:
+                malformed = True
+            else:
+                scores = run[-1] == 'H'
+        else:
+            origin, dest = run.split('-')[0], run.split('-')[1]
+            if len(dest) == 0:
+                malformed = True
+            else:
+                scores = dest[0] == 'H'
+                if scores and origin not in ('B', '1', '2', '3'):
+                    malformed = True
+        #unearned and out tokens are skipped before they are read
+        malformed = malformed and not (unearned or out)
+        tokens.append((origin, dest, unearned, out, scores, malformed))
+    return(tuple(tokens))
+
+@lru_cache(maxsize = None)
+def count_unearned(event_tx):
+    '''
+    Count unearned runs flagged in a single EVENT_TX (cached by text)
+        Args:
+            - event_tx [str]: Retrosheet play description
+        Returns:
+            - [int]: number of '(UR)' flags
+    '''
+    return(event_tx.count(UNEARNED_FLAG))
+
+def unearned_runs(event_tx):
+    '''
+    Count unearned runs flagged in every EVENT_TX of a season, parsing each unique text once
+        Args:
+            - event_tx [pandas.Series]: EVENT_TX column of season events
+        Returns:
+            - [numpy.ndarray]: number of '(UR)' flags per event
+    '''
+    codes, uniques = pd.factorize(event_tx)
+    counts = np.array([count_unearned(text) for text in uniques] + [0], dtype = 'int64')
+    return(counts[codes])
+
+def advance_table(event_tx):
+    '''
+    Tokenize every EVENT_TX of a season into a columnar table of runner advances, parsing each unique text once
+        Args:
+            - event_tx [pandas.Series]: EVENT_TX column of season events
+        Returns:
+            - [pandas.DataFrame]: one row per advance token, columns ADVANCE_COLS. 'event' is the position of the
+                event in event_tx
+    '''
+    codes, uniques = pd.factorize(event_tx)
+    parsed = [parse_advances(text) for text in uniques]
+    n_tokens = np.array([len(tokens) for tokens in parsed] + [0], dtype = 'int64')
+    token_starts = np.concatenate([[0], np.cumsum(n_tokens[:-1])])
+    flat = [token for tokens in parsed for token in tokens]
+    if len(flat) == 0:
+        return(pd.DataFrame({col : [] for col in ADVANCE_COLS}))
+    origin, dest, unearned, out, scores, malformed = (np.array(col) for col in zip(*flat))
+
+    codes = np.where(codes < 0, len(uniques), codes)
+    per_event = n_tokens[codes]
+    event = np.repeat(np.arange(len(codes)), per_event)
+    event_starts = np.concatenate([[0], np.cumsum(per_event)[:-1]])
+    token = np.repeat(token_starts[codes], per_event) + (np.arange(per_event.sum()) - np.repeat(event_starts, per_event))
+    return(pd.DataFrame({'event' : event,
+                         'origin' : origin[token],
+                         'dest' : dest[token],
+                         'unearned' : unearned[token],
+                         'out' : out[token],
+                         'scores' : scores[token],
+                         'malformed' : malformed[token]}))
+
+def charge_runs(season_df):
+    '''
+    Charge runs to the starting pitcher and the bullpen of every team in every game of a season. The starting
+    pitcher is the pitcher flagged by RESP_PIT_START_FL or, if no pitcher is flagged, the first pitcher of the
+    game (a starter removed before the first pitch is not flagged by Retrosheet).
+        Args:
+            - season_df [pandas.DataFrame]: DataFrame of all season events
+        Returns:
+            - [pandas.DataFrame]: one row per (GAME_ID, BAT_HOME_ID) of the batting team, columns:
+                starter [str]: starting pitcher of the fielding team
+                has_relief [bool]: the bullpen recorded at least one event
+                removed_mid_inning [bool]: starter's last event and bullpen's first event share an inning
+                starter_runs, relief_runs [int]: runs scored on starter and bullpen events
+                starter_unearned, relief_unearned [int]: '(UR)' flags on starter and bullpen run events
+                inherited_scored [int]: starter's runners scoring on bullpen events (removed mid inning only)
+                malformed [bool]: an inherited runner advance could not be read
+    '''
+    group = season_df.groupby(CHARGE_KEYS, sort = False, observed = True).ngroup().to_numpy()
+    n_groups = group.max() + 1 if len(group) else 0
+    pitcher = season_df.RESP_PIT_ID.to_numpy()
+    runs = season_df.EVENT_RUNS_CT.to_numpy().astype('int64')
+    inning = season_df.INN_CT.to_numpy()
+    position = np.arange(len(group))
+
+    flagged = (season_df.RESP_PIT_START_FL == 'T').to_numpy()
+    any_flagged = np.zeros(n_groups, dtype = bool)
+    any_flagged[group[flagged]] = True
+    first_event = np.full(n_groups, len(group))
+    np.minimum.at(first_event, group, position)
+    first_pitcher = pitcher[first_event[group]]
+    is_starter = np.where(any_flagged[group], flagged, pitcher == first_pitcher)
+    is_relief = ~is_starter
+
+    starter_first = np.full(n_groups, len(group))
+    np.minimum.at(starter_first, group[is_starter], position[is_starter])
+    starter_last = np.full(n_groups, -1)
+    np.maximum.at(starter_last, group[is_starter], position[is_starter])
+    relief_first = np.full(n_groups, len(group))
+    np.minimum.at(relief_first, group[is_relief], position[is_relief])
+    has_relief = relief_first < len(group)
+    removed_mid_inning = np.zeros(n_groups, dtype = bool)
+    removed_mid_inning[has_relief] = inning[starter_last[has_relief]] == inning[relief_first[has_relief]]
+    starter = pitcher[starter_first]
+
+    unearned = np.where(runs != 0, unearned_runs(season_df.EVENT_TX), 0)
+    starter_runs = np.bincount(group, weights = runs * is_starter, minlength = n_groups).astype('int64')
+    relief_runs = np.bincount(group, weights = runs * is_relief, minlength = n_groups).astype('int64')
+    starter_unearned = np.bincount(group, weights = unearned * is_starter, minlength = n_groups).astype('int64')
+    relief_unearned = np.bincount(group, weights = unearned * is_relief, minlength = n_groups).astype('int64')
+
+    #inherited runners: bullpen run events with a base runner charged to the starter, starter removed mid inning
+    event_starter = starter[group]
+    runner_pitchers = [season_df['RUN{}_RESP_PIT_ID'.format(base)].to_numpy() for base in (1, 2, 3)]
+    starter_runner = (runner_pitchers[0] == event_starter) | (runner_pitchers[1] == event_starter) |\
+                     (runner_pitchers[2] == event_starter)
+    candidates = np.flatnonzero(is_relief & (runs != 0) & starter_runner & removed_mid_inning[group])
+    inherited_scored = np.zeros(n_groups, dtype = 'int64')
+    malformed = np.zeros(n_groups, dtype = bool)
+    if len(candidates):
+        advances = advance_table(season_df.EVENT_TX.iloc[candidates])
+        events = candidates[advances.event.to_numpy()]
+        origin = advances.origin.to_numpy()
+        live = (~advances.unearned.to_numpy()) & (~advances.out.to_numpy()) & advances.scores.to_numpy()
+        charged = live & (origin == '')
+        for base in (1, 2, 3):
+            on_base = live & (origin == str(base))
+            charged[on_base] = runner_pitchers[base - 1][events[on_base]] == event_starter[events[on_base]]
+        inherited_scored = np.bincount(group[events], weights = charged, minlength = n_groups).astype('int64')
+        malformed[group[events[advances.malformed.to_numpy()]]] = True
+
+    keys = season_df[CHARGE_KEYS].iloc[first_event]
+    return(pd.DataFrame({'starter' : starter,
+                         'has_relief' : has_relief,
+                         'removed_mid_inning' : removed_mid_inning,
+                         'starter_runs' : starter_runs,
+                         'starter_unearned' : starter_unearned,
+                         'relief_runs' : relief_runs,
+                         'relief_unearned' : relief_unearned,
+                         'inherited_scored' : inherited_scored,
+                         'malformed' : malformed},
+                         index = pd.MultiIndex.from_frame(keys.reset_index(drop = True))))
+
+def charge_lookup(season_df):
+    '''
+    Charge season runs and index the result for per game lookups
+        Args:
+            - season_df [pandas.DataFrame]: DataFrame of all season events
+        Returns:
+            - [dict]: {(GAME_ID, BAT_HOME_ID) : {column : value}} for every game and batting team in the season
+    '''
+    return(charge_runs(season_df).to_dict('index'))
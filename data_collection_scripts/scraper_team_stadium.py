@@ -1,8 +1,13 @@
+import csv
+import glob
 import json
 import os
+import threading
+import time
 import requests
 from bs4 import BeautifulSoup
 import re
+from http_fetch import Fetcher
 
 TEAM_CODES = ['BOS', 'NYY', 'TBD', 'TOR', 'BAL', 'MIN', 'CHW', 'CLE', 'KCR', 'DET', 'OAK', 'SEA', 'ANA', 'TEX', 'HOU',
 'ATL', 'NYM', 'FLA', 'PHI', 'WSN', 'CHC', 'STL', 'CIN', 'PIT', 'MIL', 'SFG', 'SDP', 'LAD', 'ARI', 'COL']
@@ -10,22 +15,38 @@ TEAM_CODES = ['BOS', 'NYY', 'TBD', 'TOR', 'BAL', 'MIN', 'CHW', 'CLE', 'KCR', 'DE
 WIKI_URL = 'https://en.wikipedia.org/wiki/'
 BASE_URL = 'https://www.baseball-reference.com/teams/{}/attend.shtml'
 OUTPUT_DIR = 'data/stadiums_coordinates'
+#kept outside OUTPUT_DIR, whose .json files are read as team files by travel.load_stadiums
+CACHE_FILE = 'data/stadium_coordinate_cache.json'
+OVERRIDES_FILE = 'data/stadium_overrides.csv'
+CACHE_TTL = 365 * 24 * 3600
 
 class Scraper:
     """ 
-    Scraper object to collect team stadium data by year from baseball-reference.com
+    Scraper object to collect team stadium data by year from baseball-reference.com. Team pages, then the wikipedia
+    page of every distinct stadium, are requested concurrently through a Fetcher.
     """
-    def __init__(self, output_dir = OUTPUT_DIR, team_codes = TEAM_CODES):
+    def __init__(self, output_dir = OUTPUT_DIR, team_codes = TEAM_CODES, fetcher = None, base_url = BASE_URL,
+    wiki_url = WIKI_URL, cache_file = CACHE_FILE, overrides_file = OVERRIDES_FILE, cache_ttl = CACHE_TTL):
         """ 
         Initialize scraper object
             Args:
                 - output_dir (str): path to directory to write .json files
                 - team_codes (list): list of team codes for MLB teams, used in structuring page requests
+                - fetcher (http_fetch.Fetcher): requests every page, a pooled Fetcher if None
+                - base_url (str): base URL for baseball-reference.com team pages
+                - wiki_url (str): base URL for stadium wikipedia pages
+                - cache_file (str): coordinate cache shared by every team and run, None to request every stadium
+                - overrides_file (str): manual coordinates, see StadiumCache
+                - cache_ttl (float): seconds before cached coordinates are requested again, None to keep them
             Returns:
                 - None
         """
         self.output_dir = output_dir
         self.team_codes = team_codes
+        self.fetcher = fetcher if fetcher is not None else Fetcher()
+        self.base_url = base_url
+        self.wiki_url = wiki_url
+        self.cache = StadiumCache(cache_file, overrides_file, cache_ttl) if cache_file is not None else None
 
     
     def scrape_stadiums(self):
@@ -34,15 +55,56 @@ class Scraper:
         """
         if not os.path.isdir(self.output_dir):
             os.makedirs(self.output_dir)
-        for team_code in self.team_codes:
-            team = Team(team_code)
+        teams = [Team(team_code, self.base_url) for team_code in self.team_codes]
+        team_pages = self.fetcher.fetch_all([team.team_url for team in teams])
+        stadium_dict = {}
+        for team in teams:
             try:
-                team.get_team_data()
+                team_page = team_pages[team.team_url]
+                if isinstance(team_page, Exception):
+                    raise team_page
+                team.parse_team_page(team_page.content)
             except Exception:
-                print('Unable to collect data for {}'.format(team_code))
-            self.write_to_file(team.team_seasons_list, team.problem_stadiums, team_code)
-            print('Stadium data collected for {}'.format(team_code))
+                print('Unable to collect data for {}'.format(team.team_code))
+            for stadium_name in team.stadium_names():
+                if Team.stadium_key(stadium_name) not in stadium_dict:
+                    stadium_dict[Team.stadium_key(stadium_name)] = Stadium(stadium_name, self.wiki_url)
+        self.get_coordinates(list(stadium_dict.values()))
+        for team in teams:
+            team.stadium_dict = stadium_dict
+            team.add_stadiums()
+            self.write_to_file(team.team_seasons_list, team.problem_stadiums, team.team_code)
+            print('Stadium data collected for {}'.format(team.team_code))
         print('Scraping Finished')            
+
+    def get_coordinates(self, stadiums):
+        """ 
+        Request the wikipedia page of every stadium missing from the cache concurrently and parse its coordinates
+            Args:
+                - stadiums (list): Stadium objects
+            Returns:
+                - None
+        """
+        if self.cache is not None:
+            stadiums = [stadium for stadium in stadiums if not stadium.from_cache(self.cache)]
+        wiki_pages = self.fetcher.fetch_all([stadium.query_url for stadium in stadiums])
+        for stadium in stadiums:
+            wiki_page = wiki_pages[stadium.query_url]
+            if isinstance(wiki_page, Exception):
+                print('Unable to request the page of {}: {}'.format(stadium.stadium_name, wiki_page))
+                stadium.latitude = 'ERROR'
+                stadium.longitude = 'ERROR'
+                continue
+            try:
+                stadium.parse_coordinates(wiki_page.content)
+            except Exception:
+                print('Unable to parse the coordinates of {}'.format(stadium.stadium_name))
+                stadium.latitude = 'ERROR'
+                stadium.longitude = 'ERROR'
+            if self.cache is not None:
+                self.cache.put(stadium)
+        if self.cache is not None:
+            self.cache.save()
     
     def write_to_file(self, team_list, problem_stadiums, team_code):
         file_name = self.output_dir + '/{}.json'.format(team_code)
@@ -70,17 +132,40 @@ class Team:
         """
         self.team_code = team_code
         self.base_url = base_url
+        self.team_url = self.make_url(base_url, team_code)
         self.team_seasons_list = []
+        self.season_stadiums = []
         self.stadium_dict = {}
         self.problem_stadiums = []
 
-    def get_team_data(self):
+    def get_team_data(self, fetcher = None, cache = None):
         """ 
         Retrieve team page, parse HTML, collect team stadium data, latitude, and longitude
+            Args:
+                - fetcher (http_fetch.Fetcher): requests the pages, requests.get if None
+                - cache (StadiumCache): coordinates of known stadiums
+            Returns:
+                - None
+        """
+        team_page = fetcher.get(self.team_url) if fetcher is not None else requests.get(self.team_url)
+        try:
+            self.parse_team_page(team_page.content)
+        finally:
+            for stadium_name in self.stadium_names():
+                if self.stadium_key(stadium_name) not in self.stadium_dict:
+                    self.stadium_dict[self.stadium_key(stadium_name)] = Stadium(stadium_name)
+                    self.stadium_dict[self.stadium_key(stadium_name)].get_coordinates(fetcher, cache)
+            self.add_stadiums()
+
+    def parse_team_page(self, content):
+        """ 
+        Parse the season rows of a team page, stadium coordinates are added by add_stadiums
+            Args:
+                - content (bytes): HTML of the team page
+            Returns:
+                - None
         """
-        team_url = self.make_url(self.base_url, self.team_code)
-        team_page = requests.get(team_url)
-        team_soup = BeautifulSoup(team_page.content, 'html.parser')
+        team_soup = BeautifulSoup(content, 'html.parser')
         season_list = team_soup.find('table', {'class' : 'sortable stats_table'}).find('tbody').findAll('tr')
         for season in season_list:
             single_season = self.stadium_year_to_collect(self.team_code)
@@ -90,31 +175,35 @@ class Team:
             single_season['pitching_park_factor'] = season.find('td', {'data-stat' : 'ppf'}).get_text()
             single_season['batting_park_factor'] = season.find('td', {'data-stat' : 'bpf'}).get_text()
             stadiums = season.find('td', {'data-stat' : 'stadium'}).get_text()
-            season_stadium_list = stadiums.split(', ')
-            counter = 1
+            self.season_stadiums.append((single_season, stadiums.split(', ')))
+
+    def stadium_names(self):
+        """ 
+        Distinct stadiums of the parsed seasons, in order of first use
+        """
+        return(list(dict.fromkeys(name for _, season_stadium_list in self.season_stadiums for name in season_stadium_list)))
+
+    def add_stadiums(self):
+        """ 
+        Add the stadiums of every parsed season and their coordinates from stadium_dict to team_seasons_list
+        """
+        for single_season, season_stadium_list in self.season_stadiums:
             for j in range(len(season_stadium_list)):
-                stadium_name = ''
-                stad_elements = season_stadium_list[j].split()
-                for k in range(len(stad_elements)):
-                    stadium_name += stad_elements[k].lower() + '_'
-                counter = 1
-                if stadium_name in self.stadium_dict.keys():
-                    single_season['stadium_name_{}'.format(str(counter + j))] = season_stadium_list[j]
-                    single_season['latitude_{}'.format(str(counter + j))] = self.stadium_dict[stadium_name].latitude
-                    single_season['longitude_{}'.format(str(counter + j))] = self.stadium_dict[stadium_name].longitude
-                    if self.stadium_dict[stadium_name].latitude == 'ERROR' and season_stadium_list[j] not in self.problem_stadiums:
-                        self.problem_stadiums.append(season_stadium_list[j])
-                    counter += 1
-                else:
-                    self.stadium_dict[stadium_name] = Stadium(season_stadium_list[j])
-                    self.stadium_dict[stadium_name].get_coordinates()
-                    single_season['stadium_name_{}'.format(str(counter + j))] = season_stadium_list[j]
-                    single_season['latitude_{}'.format(str(counter + j))] = self.stadium_dict[stadium_name].latitude
-                    single_season['longitude_{}'.format(str(counter + j))] = self.stadium_dict[stadium_name].longitude
-                    if self.stadium_dict[stadium_name].latitude == 'ERROR' and season_stadium_list[j] not in self.problem_stadiums:
-                        self.problem_stadiums.append(season_stadium_list[j])
-                    counter += 1
+                stadium = self.stadium_dict[self.stadium_key(season_stadium_list[j])]
+                single_season['stadium_name_{}'.format(str(j + 1))] = season_stadium_list[j]
+                single_season['latitude_{}'.format(str(j + 1))] = stadium.latitude
+                single_season['longitude_{}'.format(str(j + 1))] = stadium.longitude
+                if stadium.latitude == 'ERROR' and season_stadium_list[j] not in self.problem_stadiums:
+                    self.problem_stadiums.append(season_stadium_list[j])
             self.team_seasons_list.append(single_season)
+        self.season_stadiums = []
+
+    @staticmethod
+    def stadium_key(stadium_name):
+        """ 
+        Key of a stadium in stadium_dict: lower case words of the name, each followed by an underscore
+        """
+        return(''.join(element.lower() + '_' for element in stadium_name.split()))
     
     @staticmethod
     def make_url(base_url, team_code):
@@ -164,18 +253,52 @@ class Stadium:
         self.latitude = None
         self.longitude = None
     
-    def get_coordinates(self):
-        """
-        Retrieve coordinates from stadium wikipedia page
-        """
-        query_components = self.stadium_name.split()
-        query_url = self.wiki_url
-        for k in range(len(query_components) - 1):
-            query_url += query_components[k]
-            query_url += '_'
-        query_url += query_components[-1]
-        wiki_page = requests.get(query_url)
-        wiki_soup = BeautifulSoup(wiki_page.content, 'html.parser')
+    @property
+    def query_url(self):
+        """
+        Wikipedia page of the stadium: words of the name joined by underscores
+        """
+        return(self.wiki_url + '_'.join(self.stadium_name.split()))
+
+    def get_coordinates(self, fetcher = None, cache = None):
+        """
+        Retrieve coordinates from the cache, or from stadium wikipedia page
+            Args:
+                - fetcher (http_fetch.Fetcher): requests the page, requests.get if None
+                - cache (StadiumCache): coordinates of known stadiums, updated with the page's coordinates
+            Returns:
+                - None
+        """
+        if cache is not None and self.from_cache(cache):
+            return
+        wiki_page = fetcher.get(self.query_url) if fetcher is not None else requests.get(self.query_url)
+        self.parse_coordinates(wiki_page.content)
+        if cache is not None:
+            cache.put(self)
+
+    def from_cache(self, cache):
+        """
+        Set coordinates from the cache
+            Args:
+                - cache (StadiumCache): coordinates of known stadiums
+            Returns:
+                - bool: True if the stadium was found
+        """
+        coordinates = cache.get(self.stadium_name)
+        if coordinates is None:
+            return(False)
+        self.latitude, self.longitude = coordinates
+        return(True)
+
+    def parse_coordinates(self, content):
+        """
+        Parse coordinates from the HTML of the stadium wikipedia page
+            Args:
+                - content (bytes): HTML of the page
+            Returns:
+                - None
+        """
+        wiki_soup = BeautifulSoup(content, 'html.parser')
         try:
             self.latitude = self.convert_to_decimal_format(wiki_soup.find('span', {'class' : 'latitude'}).get_text())
             self.longitude = self.convert_to_decimal_format(wiki_soup.find('span', {'class' : 'longitude'}).get_text())
@@ -226,6 +349,138 @@ class Stadium:
                 return(coordinate)
        
 
+class StadiumCache:
+    """ 
+    Coordinates of every stadium collected, shared by all teams and saved between runs. Stadiums are keyed by their
+    normalized name (lower case words without punctuation). Manual coordinates in overrides_file (stadium_name,
+    latitude, longitude in decimal degrees, longitude positive west as scraped) take precedence and never expire,
+    add_problem_stadiums lists the stadiums of the *_problems.csv files there for them to be filled in.
+    """
+    def __init__(self, cache_file = CACHE_FILE, overrides_file = OVERRIDES_FILE, ttl = CACHE_TTL):
+        """ 
+        Initialize cache, loading the saved coordinates and overrides
+            Args:
+                - cache_file (str): JSON file of the cached coordinates
+                - overrides_file (str): CSV file of manual coordinates, may not exist
+                - ttl (float): seconds before cached coordinates expire, None to keep them
+            Returns:
+                - None
+        """
+        self.cache_file = cache_file
+        self.overrides_file = overrides_file
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(cache_file):
+            with open(cache_file, 'r') as f:
+                self.entries = json.load(f)
+        self.overrides = self.read_overrides(overrides_file)
+
+    @staticmethod
+    def normalize(stadium_name):
+        return(' '.join(re.sub('[^a-z0-9]+', ' ', stadium_name.lower()).split()))
+
+    @classmethod
+    def read_overrides(cls, overrides_file):
+        """ 
+        Manual coordinates, rows without both coordinates are skipped
+            Args:
+                - overrides_file (str): CSV file of stadium_name, latitude, longitude rows
+            Returns:
+                - dict: {normalized name : (latitude, longitude)}
+        """
+        overrides = {}
+        if overrides_file is None or not os.path.exists(overrides_file):
+            return(overrides)
+        with open(overrides_file, 'r', newline = '') as f:
+            for row in csv.reader(f):
+                if len(row) < 3 or not row[1].strip() or not row[2].strip():
+                    continue
+                try:
+                    overrides[cls.normalize(row[0])] = (float(row[1]), float(row[2]))
+                except ValueError:
+                    print('Skipping override {}'.format(','.join(row)))
+        return(overrides)
+
+    def get(self, stadium_name):
+        """ 
+        Coordinates of a stadium
+            Args:
+                - stadium_name (str): name of the stadium
+            Returns:
+                - tuple: (latitude, longitude), None if the stadium is unknown or its coordinates expired
+        """
+        key = self.normalize(stadium_name)
+        if key in self.overrides:
+            return(self.overrides[key])
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None or (self.ttl is not None and time.time() - entry['collected'] > self.ttl):
+            return(None)
+        return((entry['latitude'], entry['longitude']))
+
+    def put(self, stadium):
+        """ 
+        Record the coordinates of a stadium, stadiums without coordinates are left to the overrides
+            Args:
+                - stadium (Stadium): stadium with parsed coordinates
+            Returns:
+                - None
+        """
+        if stadium.latitude == 'ERROR' or not isinstance(stadium.latitude, float) or not isinstance(stadium.longitude, float):
+            return
+        with self.lock:
+            self.entries[self.normalize(stadium.stadium_name)] = {'stadium_name' : stadium.stadium_name,
+                                                                  'latitude' : stadium.latitude,
+                                                                  'longitude' : stadium.longitude,
+                                                                  'collected' : time.time()}
+
+    def save(self):
+        """ 
+        Write the cached coordinates
+        """
+        with self.lock:
+            entries = dict(self.entries)
+        directory = os.path.dirname(self.cache_file)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        temp_file = self.cache_file + '.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump(entries, f)
+        os.replace(temp_file, self.cache_file)
+
+    def add_problem_stadiums(self, output_dir = OUTPUT_DIR):
+        """ 
+        Append the stadiums of every *_problems.csv file without an override to overrides_file, with empty coordinates
+            Args:
+                - output_dir (str): scraper output directory
+            Returns:
+                - list: stadiums added
+        """
+        listed = set()
+        if os.path.exists(self.overrides_file):
+            with open(self.overrides_file, 'r', newline = '') as f:
+                listed = set(self.normalize(row[0]) for row in csv.reader(f) if row)
+        added = []
+        for problem_file in sorted(glob.glob(os.path.join(output_dir, '*_problems.csv'))):
+            with open(problem_file, 'r', newline = '') as f:
+                for row in csv.reader(f):
+                    if row and row[0] and self.normalize(row[0]) not in listed:
+                        listed.add(self.normalize(row[0]))
+                        added.append(row[0])
+        if len(added) > 0:
+            with open(self.overrides_file, 'a', newline = '') as f:
+                writer = csv.writer(f)
+                for stadium_name in added:
+                    writer.writerow([stadium_name, '', ''])
+        return(added)
+
+
 if __name__ == '__main__':
     scraper = Scraper()
-    scraper.scrape_stadiums()
\ No newline at end of file
+    with scraper.fetcher:
+        scraper.scrape_stadiums()
+    if scraper.cache is not None:
+        problem_stadiums = scraper.cache.add_problem_stadiums(scraper.output_dir)
+        if len(problem_stadiums) > 0:
+            print('Add coordinates for {} stadiums to {}'.format(len(problem_stadiums), scraper.cache.overrides_file))
\ No newline at end of file
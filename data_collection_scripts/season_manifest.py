@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import datetime
+from event_loader import file_digest
+'''
+Manifest of the season event files processed by the event parsers. For every all*.csv parsed, the manifest stores the
+file's path, size, modification time and SHA-1, the version of the parser code that parsed it and the output files it
+was written to, one partition per output format. On the next run a season is only re-parsed when its event file or the
+parser code changed, or one of its outputs is missing (including the partition of an output format turned on since), so nightly refreshes during the season only re-parse the current season instead of 100
+years of event files. The manifest is a JSON file stored in the parser's export directory.
+'''
+
+MANIFEST_NAME = 'manifest.json'
+
+def parser_version(source_files):
+    '''
+    Version of the parser code, a hash of the source files that determine the parsed output
+        Args:
+            - source_files [list]: locations of the parser's .py files
+        Returns:
+            - [str]: hex digest
+    '''
+    version = hashlib.sha1()
+    for source in sorted(source_files):
+        version.update(file_digest(source).encode())
+    return(version.hexdigest())
+
+class SeasonManifest():
+    '''
+    Record of processed season event files, loaded from and saved to {export_dir}/manifest.json
+    '''
+    def __init__(self, export_dir, version, name = MANIFEST_NAME):
+        '''
+        Initialize manifest, loading previously processed seasons if the manifest exists
+            Args:
+                - export_dir [str]: output directory of the parser, where the manifest is stored
+                - version [str]: version of the parser code (parser_version())
+                - name [str]: file name of the manifest
+        '''
+        self.path = os.path.join(export_dir, name)
+        self.version = version
+        self.seasons = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.seasons = json.load(f)
+
+    @staticmethod
+    def key(file_name):
+        '''
+        Factory method, manifest key of an event file
+            Args:
+                - file_name [str]: location of season .csv
+            Returns:
+                - [str]: absolute path of the file
+        '''
+        return(os.path.abspath(file_name))
+
+    def is_current(self, file_name, outputs = ()):
+        '''
+        Check whether a season was parsed from the current version of its event file by the current parser code
+        and written to every requested output. The file is only hashed when its size matches but its modification
+        time changed.
+            Args:
+                - file_name [str]: location of season .csv
+                - outputs [list]: output files the season must have been written to (the partition of every enabled
+                    sink), a season missing any of them is not current
+            Returns:
+                - [bool]: True if the season does not need to be re-parsed
+        '''
+        entry = self.seasons.get(self.key(file_name))
+        if entry is None or entry['parser_version'] != self.version:
+            return(False)
+        recorded = set(os.path.abspath(output) for output in entry['outputs'])
+        if not all(os.path.abspath(output) in recorded for output in outputs):
+            return(False)
+        if not all(os.path.exists(output) for output in entry['outputs']):
+            return(False)
+        stat = os.stat(file_name)
+        if stat.st_size != entry['size']:
+            return(False)
+        if stat.st_mtime_ns == entry['mtime_ns']:
+            return(True)
+        if file_digest(file_name) != entry['sha1']:
+            return(False)
+        #contents unchanged, only touched: store new mtime so the file is not hashed again
+        entry['mtime_ns'] = stat.st_mtime_ns
+        return(True)
+
+    def fingerprint(self, file_name):
+        '''
+        Size, modification time and SHA-1 of an event file, taken before the file is parsed
+            Args:
+                - file_name [str]: location of season .csv
+            Returns:
+                - [dict]: {'size', 'mtime_ns', 'sha1'}
+        '''
+        stat = os.stat(file_name)
+        return({'size' : stat.st_size,
+                'mtime_ns' : stat.st_mtime_ns,
+                'sha1' : file_digest(file_name)})
+
+    def record(self, file_name, fingerprint, outputs):
+        '''
+        Record a successfully parsed season
+            Args:
+                - file_name [str]: location of season .csv
+                - fingerprint [dict]: fingerprint() of the file taken before parsing
+                - outputs [list]: output files the season was written to
+            Returns:
+                None
+        '''
+        entry = dict(fingerprint)
+        entry['path'] = self.key(file_name)
+        entry['parser_version'] = self.version
+        entry['outputs'] = list(outputs)
+        entry['parsed'] = datetime.datetime.now().isoformat(timespec = 'seconds')
+        self.seasons[self.key(file_name)] = entry
+
+    def outputs(self, file_names):
+        '''
+        Output files recorded for a set of event files, seasons never parsed are skipped
+            Args:
+                - file_names [list]: locations of season .csv
+            Returns:
+                - [list]: absolute paths of the outputs
+        '''
+        outputs = []
+        for file_name in file_names:
+            entry = self.seasons.get(self.key(file_name))
+            if entry is not None:
+                outputs += [os.path.abspath(output) for output in entry['outputs']]
+        return(outputs)
+
+    def prune(self):
+        '''
+        Forget the seasons whose event file no longer exists and delete their outputs
+            Args:
+                None
+            Returns:
+                - [list]: event files removed from the manifest
+        '''
+        removed = [key for key in self.seasons if not os.path.exists(key)]
+        for key in removed:
+            for output in self.seasons.pop(key)['outputs']:
+                if os.path.exists(output):
+                    os.remove(output)
+        return(removed)
+
+    def save(self):
+        '''
+        Write the manifest, under a temporary name and renamed so an interrupted run never leaves a partial manifest
+            Args:
+                None
+            Returns:
+                None
+        '''
+        temp_file = self.path + '.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump(self.seasons, f, indent = 2, sort_keys = True)
+        os.replace(temp_file, self.path)
@@ -0,0 +1,127 @@
+import os
+import numpy as np
+import pandas as pd
+'''
+Point-in-time starting pitcher statistics for starting_pitchers.py and pool_executor_pitching.py. The ERA, WHIP and
+average innings of a starter going into a start are computed over every earlier start in a history table (career,
+season, home only or road only). Instead of filtering the history for every start, the history is aggregated per
+(starter_code, date) and sorted once, cumulative sums are taken per starter and each start looks up the sums of all
+dates strictly before its own with a binary search. Starts on the same date (doubleheaders) never see each other.
+'''
+
+SUM_COLS = ['ER', 'IP', 'BB', 'H']
+
+STATS = ['ERA', 'WHIP', 'AVGIP']
+
+class PriorStarts():
+    '''
+    Cumulative starter statistics of a history table, indexed for point-in-time lookups
+    '''
+    def __init__(self, history):
+        '''
+        Aggregate history per starter and date and take cumulative sums per starter
+            Args:
+                - history [pandas.DataFrame]: starts with starter_code, date, ER, IP, BB and H columns
+        '''
+        self.starters = pd.Index(history.starter_code.unique())
+        codes = self.starters.get_indexer(history.starter_code)
+        per_date = pd.DataFrame({'key' : self.make_keys(codes, history.date)})
+        for col in SUM_COLS:
+            per_date[col] = history[col].fillna(0).to_numpy()
+        per_date['n'] = 1
+        per_date = per_date.groupby('key', sort = True).sum()
+        self.keys = per_date.index.to_numpy()
+        self.codes = self.keys >> 32
+        totals = per_date.groupby(self.codes, sort = False).cumsum()
+        self.totals = {col : totals[col].to_numpy() for col in SUM_COLS + ['n']}
+
+    def save(self, directory, name):
+        '''
+        Write the cumulative arrays to .npy files, so other processes can memory-map them with load()
+            Args:
+                - directory [str]: directory to write to
+                - name [str]: prefix of the history's files
+            Returns:
+                None
+        '''
+        arrays = {'starters' : np.array(self.starters, dtype = str), 'keys' : self.keys, 'codes' : self.codes}
+        for col, total in self.totals.items():
+            arrays['total_' + col] = total
+        for key, array in arrays.items():
+            np.save(os.path.join(directory, '{}_{}.npy'.format(name, key)), array)
+
+    @classmethod
+    def load(cls, directory, name):
+        '''
+        Memory-map a history written by save(), the cumulative arrays are shared with every process mapping them
+            Args:
+                - directory [str]: directory written by save()
+                - name [str]: prefix of the history's files
+            Returns:
+                - [PriorStarts]: history
+        '''
+        def load_array(key):
+            return(np.load(os.path.join(directory, '{}_{}.npy'.format(name, key)), mmap_mode = 'r'))
+        history = cls.__new__(cls)
+        history.starters = pd.Index(load_array('starters').astype(object))
+        history.keys = load_array('keys')
+        history.codes = load_array('codes')
+        history.totals = {col : load_array('total_' + col) for col in SUM_COLS + ['n']}
+        return(history)
+
+    @staticmethod
+    def make_keys(codes, dates):
+        '''
+        Factory method, one sortable integer per (starter, date): starter code in the high 32 bits, days since epoch
+        (offset to be positive) in the low 32 bits
+            Args:
+                - codes [numpy.ndarray]: starter positions in self.starters
+                - dates [pandas.Series]: dates, 'YYYY-MM-DD' strings or datetimes
+            Returns:
+                - [numpy.ndarray]: int64 keys
+        '''
+        days = pd.to_datetime(dates).to_numpy().astype('datetime64[D]').astype('int64')
+        return(codes.astype('int64') * (1 << 32) + (days + (1 << 31)))
+
+    def lookup(self, starts):
+        '''
+        ERA, WHIP and average innings pitched of each start over all of the starter's history before its date
+            Args:
+                - starts [pandas.DataFrame]: starts with starter_code and date columns
+            Returns:
+                - [pandas.DataFrame]: columns STATS, indexed like starts. 0 without prior innings (ERA, WHIP) or
+                    prior starts (AVGIP)
+        '''
+        codes = self.starters.get_indexer(starts.starter_code)
+        keys = self.make_keys(codes, starts.date)
+        prior = np.searchsorted(self.keys, keys, side = 'left') - 1
+        found = (codes >= 0) & (prior >= 0)
+        found[found] = self.codes[prior[found]] == codes[found]
+        prior[~found] = 0
+        if len(self.keys) == 0:
+            sums = {col : np.zeros(len(starts)) for col in SUM_COLS + ['n']}
+        else:
+            sums = {col : np.where(found, self.totals[col][prior], 0) for col in SUM_COLS + ['n']}
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            era = np.where(sums['IP'] > 0, (sums['ER'] / sums['IP']) * 9, 0.0)
+            whip = np.where(sums['IP'] > 0, (sums['BB'] + sums['H']) / sums['IP'], 0.0)
+            avg_ip = np.where(sums['n'] != 0, sums['IP'] / sums['n'], 0.0)
+        return(pd.DataFrame({'ERA' : era, 'WHIP' : whip, 'AVGIP' : avg_ip}, index = starts.index))
+
+def assign_prior_splits(working, career, venue_career, season, venue_season, prefix, venue_suffix):
+    '''
+    Write the career, season, home/road only career and home/road only season splits of every start
+        Args:
+            - working [pandas.DataFrame]: home or road starts of one season
+            - career, venue_career, season, venue_season [PriorStarts]: histories of each split
+            - prefix [str]: 'home_' or 'road_'
+            - venue_suffix [str]: '_AH' (at home) or '_OR' (on road)
+        Returns:
+            - [pandas.DataFrame]: working with the {prefix}{career|season}_{stat}[{venue_suffix}] columns filled
+    '''
+    for split, suffix, history in (('career', '', career), ('career', venue_suffix, venue_career),
+                                   ('season', '', season), ('season', venue_suffix, venue_season)):
+        stats = history.lookup(working)
+        for stat in STATS:
+            working['{}{}_{}{}'.format(prefix, split, stat, suffix)] = stats[stat].to_numpy()
+    return(working)
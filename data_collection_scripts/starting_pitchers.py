@@ -1,5 +1,6 @@
 import pandas as pd 
 import sys
+from starter_splits import PriorStarts, assign_prior_splits
 
 
 FILE_LOC = './all_starters.csv.gz'
@@ -16,7 +17,12 @@ HOME_KEYS = ['date', 'home_team', 'road_team', 'is_doubleheader', 'is_triplehead
 ROAD_KEYS = ['date', 'home_team', 'road_team', 'is_doubleheader', 'is_tripleheader']
 
 class StartingPitcherParser():
-    def __init__(self, file = FILE_LOC, drop_cols = DROP_COLS, home_cols = HOME_COLS, road_cols = ROAD_COLS, home_keys = HOME_KEYS, road_keys = ROAD_KEYS):
+    def __init__(self, file = FILE_LOC, drop_cols = DROP_COLS, home_cols = HOME_COLS, road_cols = ROAD_COLS, home_keys = HOME_KEYS, road_keys = ROAD_KEYS,
+    engine = 'cumulative'):
+        #engine: 'cumulative' looks splits up in per-pitcher cumulative sums (starter_splits.py), 'loop' filters every start
+        if engine not in ('cumulative', 'loop'):
+            raise ValueError('Unknown engine: {}'.format(engine))
+        self.engine = engine
         self.file = file
         self.drop_cols = drop_cols
         self.home_cols = home_cols
@@ -26,6 +32,9 @@ class StartingPitcherParser():
         self.all_starters = None
         self.all_home_starters = None
         self.all_road_starters = None
+        self.career_history = None
+        self.home_history = None
+        self.road_history = None
         self.final_frames = []
     
     def master(self):
@@ -68,6 +77,10 @@ class StartingPitcherParser():
         self.all_starters = pd.read_csv(self.file, compression = 'gzip')
         self.all_home_starters = self.all_starters[self.all_starters.is_home == 1].reset_index(drop = True).sort_values(by = ['date'])
         self.all_road_starters = self.all_starters[self.all_starters.is_home == 0].reset_index(drop = True).sort_values(by = ['date'])
+        if self.engine == 'cumulative':
+            self.career_history = PriorStarts(self.all_starters)
+            self.home_history = PriorStarts(self.all_home_starters)
+            self.road_history = PriorStarts(self.all_road_starters)
     
     @staticmethod
     def create_cols(df, home = False):
@@ -100,6 +113,12 @@ class StartingPitcherParser():
         return(df)
 
     def assign_splits(self, working, all_season, home = False):
+        if self.engine == 'cumulative':
+            if home:
+                return(assign_prior_splits(working, self.career_history, self.home_history, PriorStarts(all_season),
+                                           PriorStarts(working), 'home_', '_AH'))
+            return(assign_prior_splits(working, self.career_history, self.road_history, PriorStarts(all_season),
+                                       PriorStarts(working), 'road_', '_OR'))
         if home:
             for j in range(len(working)):
                 pitcher = working.iloc[j]['starter_code']
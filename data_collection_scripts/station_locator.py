@@ -0,0 +1,207 @@
+import json
+import numpy as np
+import pandas as pd
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+from travel import EARTH_RADIUS, haversine
+"""
+Matching stadiums to nearby NOAA GHCN weather stations, producing the station lists read by
+noaa_weather_collection.py (data/new_stations.json, data/federal_stations.json). Instead of computing the distance
+between every stadium and every station, the station inventory is indexed once in a KD-tree over points on the unit
+sphere (straight-line distances between those points increase with great circle distance), and each stadium asks for
+its k nearest stations or the stations within a radius. Stations can be filtered by elevation difference, state and
+the years their observations cover (ghcnd-inventory.txt). Without scipy, the same queries fall back to a vectorized
+scan of all stations.
+"""
+
+STATIONS_FILE = 'data/ghcnd-stations.txt'
+INVENTORY_FILE = 'data/ghcnd-inventory.txt'
+LOCATIONS_FILE = 'data/coordinates_elevation_final.csv'
+
+#fixed width columns of ghcnd-stations.txt and ghcnd-inventory.txt
+STATION_COLSPECS = [(0, 11), (12, 20), (21, 30), (31, 37), (38, 40), (41, 71)]
+STATION_NAMES = ['id', 'latitude', 'longitude', 'elevation', 'state', 'name']
+INVENTORY_COLSPECS = [(0, 11), (31, 35), (36, 40), (41, 45)]
+INVENTORY_NAMES = ['id', 'element', 'first_year', 'last_year']
+
+COVERAGE_ELEMENTS = ['TMAX', 'TMIN', 'PRCP']
+
+#station lists collected by noaa_weather_collection.py: station id prefixes, search radius (km), elevation threshold (m)
+#and whether stations must be in the state of the stadium
+STATION_LISTS = {'data/new_stations.json' : {'prefixes' : ('US', 'CA'), 'radius' : 25, 'elevation_thresh' : 100,
+                                             'same_state' : True},
+                 'data/federal_stations.json' : {'prefixes' : ('USW0', 'USC0', 'CA'), 'radius' : 25,
+                                                 'elevation_thresh' : 250, 'same_state' : True}}
+MAX_STATIONS = 50
+
+#GHCN lists no stations in DC, stadiums there use Maryland stations
+STATE_ALIASES = {'DC' : 'MD'}
+
+def read_stations(stations_file = STATIONS_FILE, prefixes = None):
+    """
+    Read the GHCN station list
+        Args:
+            - stations_file (str): location of ghcnd-stations.txt
+            - prefixes (tuple): keep stations whose id starts with one of the prefixes, None for every station
+        Returns:
+            - DataFrame: id, latitude, longitude (negative west), elevation (m), state and name of each station
+    """
+    stations = pd.read_fwf(stations_file, colspecs = STATION_COLSPECS, names = STATION_NAMES, header = None,
+                           dtype = {'id' : str, 'state' : str, 'name' : str})
+    if prefixes is not None:
+        stations = stations[stations.id.str.startswith(tuple(prefixes))]
+    return(stations.reset_index(drop = True))
+
+def read_coverage(inventory_file = INVENTORY_FILE, elements = COVERAGE_ELEMENTS):
+    """
+    Years covered by each station, from the GHCN inventory
+        Args:
+            - inventory_file (str): location of ghcnd-inventory.txt
+            - elements (list): elements counted as coverage
+        Returns:
+            - DataFrame: first_year and last_year of any of the elements, indexed by station id
+    """
+    inventory = pd.read_fwf(inventory_file, colspecs = INVENTORY_COLSPECS, names = INVENTORY_NAMES, header = None,
+                            dtype = {'id' : str, 'element' : str})
+    inventory = inventory[inventory.element.isin(elements)]
+    return(inventory.groupby('id').agg(first_year = ('first_year', 'min'), last_year = ('last_year', 'max')))
+
+def unit_vectors(latitude, longitude):
+    """
+    Points on the unit sphere of coordinates in decimal degrees
+    """
+    lat, lon = np.radians(np.asarray(latitude, dtype = 'float64')), np.radians(np.asarray(longitude, dtype = 'float64'))
+    return(np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)]))
+
+class StationLocator():
+    """
+    Spatial index of weather stations
+    """
+    def __init__(self, stations, coverage = None):
+        """
+        Index stations, optionally with the years they cover
+            Args:
+                - stations (DataFrame): read_stations() output
+                - coverage (DataFrame): read_coverage() output, stations missing from it never match a years filter
+        """
+        self.stations = stations.dropna(subset = ['latitude', 'longitude']).reset_index(drop = True)
+        if coverage is not None:
+            self.stations = self.stations.join(coverage, on = 'id')
+        self.points = unit_vectors(self.stations.latitude, self.stations.longitude)
+        self.tree = cKDTree(self.points) if cKDTree is not None and len(self.points) > 0 else None
+
+    def candidates(self, point, k = None, radius = None):
+        """
+        Positions of the stations nearest to a point, closest first
+            Args:
+                - point (numpy.ndarray): unit sphere point
+                - k (int): number of stations, None for all within radius
+                - radius (float): km, None for no limit
+            Returns:
+                - numpy.ndarray: positions in self.stations
+        """
+        n = len(self.points)
+        k = n if k is None else min(k, n)
+        #straight line distance between unit sphere points of a great circle distance of radius
+        chord = np.inf if radius is None else 2 * np.sin(min(radius / EARTH_RADIUS, np.pi) / 2)
+        if self.tree is not None:
+            if radius is not None and k == n:
+                found = np.array(self.tree.query_ball_point(point, chord * (1 + 1e-9)), dtype = 'int64')
+                return(found[np.argsort(np.linalg.norm(self.points[found] - point, axis = 1), kind = 'stable')])
+            distance, found = self.tree.query(point, k = k, distance_upper_bound = chord * (1 + 1e-9))
+            distance, found = np.atleast_1d(distance), np.atleast_1d(found)
+            return(found[np.isfinite(distance)])
+        distance = np.linalg.norm(self.points - point, axis = 1)
+        order = np.argsort(distance, kind = 'stable')
+        return(order[distance[order] <= chord * (1 + 1e-9)][:k])
+
+    def query(self, latitude, longitude, k = MAX_STATIONS, radius = None, elevation = None, elevation_thresh = None,
+    state = None, years = None):
+        """
+        Stations near a location matching every filter, closest first
+            Args:
+                - latitude, longitude (float): location in decimal degrees, longitude negative west
+                - k (int): maximum number of stations, None for every station within radius
+                - radius (float): maximum distance in km, None for no limit
+                - elevation (float): elevation of the location in m, used with elevation_thresh
+                - elevation_thresh (float): maximum elevation difference in m, None for no limit
+                - state (str): only stations in this state / province, None for every state
+                - years (tuple): (first year, last year), only stations covering part of the range
+            Returns:
+                - DataFrame: matching stations with a distance column (km)
+        """
+        if k is None and radius is None:
+            raise ValueError('Either k or radius is required')
+        point = unit_vectors([latitude], [longitude])[0]
+        n_candidates = k
+        while True:
+            found = self.candidates(point, None if n_candidates is None else n_candidates * 4, radius)
+            matches = self.stations.iloc[found]
+            keep = np.ones(len(matches), dtype = bool)
+            if elevation_thresh is not None and elevation is not None:
+                keep &= (matches.elevation - elevation).abs().to_numpy() <= elevation_thresh
+            if state is not None:
+                keep &= (matches.state == state).to_numpy()
+            if years is not None:
+                if 'first_year' not in matches:
+                    raise ValueError('Filtering on years requires station coverage')
+                keep &= ((matches.first_year <= years[1]) & (matches.last_year >= years[0])).to_numpy()
+            matches = matches[keep]
+            #enough matches, or every station within reach has been checked
+            if k is None or len(matches) >= k or len(found) < n_candidates * 4:
+                break
+            n_candidates *= 4
+        matches = matches.assign(distance = haversine(latitude, longitude, matches.latitude.to_numpy(),
+                                                      matches.longitude.to_numpy()))
+        return(matches.head(k) if k is not None else matches)
+
+def locate_stations(locations, locator, k = MAX_STATIONS, radius = None, elevation_thresh = None, same_state = False,
+years = None):
+    """
+    Station lists of every location, in the format read by noaa_weather_collection.WeatherCollector
+        Args:
+            - locations (DataFrame): latitude, longitude (negative west), elevation_m and state of each location
+            - locator (StationLocator): indexed stations
+            - k, radius, elevation_thresh, years: see StationLocator.query
+            - same_state (bool): only stations in the state of the location (see STATE_ALIASES)
+        Returns:
+            - dict: {'location_{n}' : [station ids, closest first]}, locations numbered from 1 in order
+    """
+    stations_by_location = {}
+    for j, location in enumerate(locations.itertuples(index = False)):
+        matches = locator.query(location.latitude, location.longitude, k = k, radius = radius,
+                                elevation = getattr(location, 'elevation_m', None), elevation_thresh = elevation_thresh,
+                                state = STATE_ALIASES.get(location.state, location.state) if same_state else None,
+                                years = years)
+        stations_by_location['location_' + str(j + 1)] = matches.id.tolist()
+    return(stations_by_location)
+
+def write_station_lists(locations, stations, coverage = None, station_lists = STATION_LISTS, years = None):
+    """
+    Write every station list of station_lists
+        Args:
+            - locations (DataFrame): see locate_stations
+            - stations (DataFrame): read_stations() output (every prefix)
+            - coverage (DataFrame): read_coverage() output, required with years
+            - station_lists (dict): {output file : {'prefixes', 'radius', 'elevation_thresh', 'same_state'}}
+            - years (tuple): (first year, last year) the stations must cover part of
+        Returns:
+            - None
+    """
+    for output_file, settings in station_lists.items():
+        subset = stations[stations.id.str.startswith(tuple(settings['prefixes']))]
+        locator = StationLocator(subset, coverage)
+        stations_by_location = locate_stations(locations, locator, radius = settings['radius'],
+                                               elevation_thresh = settings['elevation_thresh'],
+                                               same_state = settings['same_state'], years = years)
+        with open(output_file, 'w') as f:
+            json.dump(stations_by_location, f)
+        print('{} written, {} locations'.format(output_file, len(stations_by_location)))
+
+if __name__ == '__main__':
+    #locations saved by data_prep/data_collection_preparation.ipynb store longitudes as positive degrees west
+    locations_main = pd.read_csv(LOCATIONS_FILE, index_col = 0)
+    locations_main['longitude'] = -locations_main.longitude.abs()
+    write_station_lists(locations_main, read_stations(), read_coverage())
@@ -4,6 +4,7 @@ import json
 import re
 import os
 import sys
+from double_header import flag_doubleheaders
 
 TEAM_LOC = './aggregated_event_files/team_stats_{}.csv'
 
@@ -21,10 +22,21 @@ DROP_COLS = ['PA', 'AB', 'H', 'TB', 'BB', 'HBP', 'R', 'IP', 'H_', 'BB_', 'K_', '
 
 MERGE_KEYS = ['date', 'team_code', 'is_home', 'opponent', 'is_doubleheader', 'is_tripleheader']
 
+SUM_COLS = ['PA', 'AB', 'H', 'TB', 'BB', 'HBP', 'R', 'IP', 'H_', 'BB_', 'ER_']
+
+ENGINES = ('cumulative', 'loop')
+
 class FrameUpdater():
     def __init__(self, year, team_loc = TEAM_LOC, home_cols = HOME_COLS, road_cols = ROAD_COLS, drop_cols = DROP_COLS, 
-    merge_keys = MERGE_KEYS):
+    merge_keys = MERGE_KEYS, engine = 'cumulative'):
+        #year can be a single season or a list of seasons aggregated together (cumulative engine only)
         self.year = year
+        self.years = list(year) if isinstance(year, (list, tuple, range)) else [year]
+        if engine not in ENGINES:
+            raise ValueError('Unknown engine: {}'.format(engine))
+        if engine == 'loop' and len(self.years) > 1:
+            raise ValueError('The loop engine aggregates one season at a time')
+        self.engine = engine
         self.team_loc = team_loc
         self.home_cols = home_cols
         self.road_cols = road_cols
@@ -72,6 +84,12 @@ class FrameUpdater():
 
     def update_frames(self):
         self.generate_full_frames()
+        if self.engine == 'cumulative':
+            self.all_home = pd.concat([self.all_home, self.cumulative_stats(self.all_home, 'home_')], axis = 1)
+            self.all_road = pd.concat([self.all_road, self.cumulative_stats(self.all_road, 'road_')], axis = 1)
+            self.team_frame = pd.concat([self.team_frame, self.cumulative_stats(self.team_frame, 'total_')], axis = 1)
+            self.generate_team_frames()
+            return
         self.generate_team_frames()
         for team in self.team_names:
             full_df = self.by_team[team]['team_indiv']
@@ -100,6 +118,22 @@ class FrameUpdater():
             self.by_team[team]['team_indiv_road'] = road_df
 
     
+    @staticmethod
+    def cumulative_stats(df, prefix):
+        #stats of every game over the team's prior games of the season (same split as df), all teams at once:
+        #sums over prior games are the team's cumulative sums shifted by one game, the first game has no prior games
+        keys = [df.date.dt.year, df.team_code]
+        prior = df[SUM_COLS].fillna(0).groupby(keys, sort = False).cumsum().groupby(keys, sort = False).shift()
+        n_games = df.groupby(keys, sort = False).cumcount()
+        stats = pd.DataFrame(index = df.index)
+        stats[prefix + 'OBPS'] = (prior.TB / prior.AB) + ((prior.H + prior.BB + prior.HBP) / prior.PA)
+        stats[prefix + 'AVG_RUNS'] = prior.R / n_games
+        stats[prefix + 'AVG_H'] = prior.H / n_games
+        stats[prefix + 'BULLPEN_ERA'] = (prior.ER_ / prior.IP) * 9
+        stats[prefix + 'BULLPEN_WHIP'] = (prior.BB_ + prior.H_) / prior.IP
+        stats[prefix + 'BULLPEN_AVG_INNINGS'] = prior.IP / n_games
+        return(stats)
+
     @staticmethod    
     def update_team_stats(prior_games, df, n_games):
         #calculate OBPs
@@ -199,42 +233,39 @@ class FrameUpdater():
             df['road_BULLPEN_WHIP'] = df['road_BULLPEN_WHIP'].astype('float32')
             df['road_BULLPEN_AVG_INNINGS'] = df['road_BULLPEN_AVG_INNINGS'].astype('float32')
     
+    def read_season(self, year):
+        #team stats of one season, with the columns used by the aggregation and parsed dates
+        season_frame = pd.read_csv(self.team_loc.format(str(year)))
+        missing = [col for col in ['date', 'team_code', 'is_home', 'opponent'] + self.drop_cols
+                   if col not in season_frame.columns]
+        if len(missing) > 0:
+            raise KeyError('Missing columns: {}'.format(missing))
+        season_frame['date'] = pd.to_datetime(season_frame['date'], format = '%Y-%m-%d')
+        return(season_frame)
+
     def generate_full_frames(self):
-        team_loc = self.team_loc.format(str(self.year))
+        season_frames = []
+        for year in self.years:
+            if len(self.years) == 1:
+                season_frames.append(self.read_season(year))
+                continue
+            #with several seasons, a missing or malformed season file is reported and skipped
+            if not os.path.exists(self.team_loc.format(str(year))):
+                print('No team stats found for {}'.format(year))
+                continue
+            try:
+                season_frames.append(self.read_season(year))
+                print('Season of {} collected'.format(year))
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                print('There was an {} with {}'.format(sys.exc_info()[0], year))
+                continue
         
-        self.team_frame = pd.read_csv(team_loc)
-        self.team_frame['date'] = pd.to_datetime(self.team_frame['date'], format = '%Y-%m-%d')
+        self.team_frame = pd.concat(season_frames, axis = 0, ignore_index = True)
         self.team_frame = self.team_frame.sort_values(by = ['team_code', 'date'])
         
-        self.team_frame = self.team_frame.assign(is_doubleheader = 0,
-                                       is_tripleheader = 0)
-
-        game_counts = self.team_frame.groupby('team_code').date.value_counts()
-        double_headers = game_counts[game_counts == 2]
-        triple_headers = game_counts[game_counts > 2]
-        
-        all_double_headers = []
-        for j in double_headers.index:
-            all_double_headers.append(j)
-
-        all_triple_headers = []
-        for k in triple_headers.index:
-            all_triple_headers.append(k)
-
-        for index in all_double_headers:
-            game_indices = self.team_frame[(self.team_frame.team_code == index[0]) & (self.team_frame.date == index[1])].index
-            if len(game_indices) > 1:
-                self.team_frame.at[game_indices[1], 'is_doubleheader'] = 1
-            else:
-                print(index)
-
-        for index_ in all_triple_headers:
-            game_indices_ = self.team_frame[(self.team_frame.team_code == index_[0]) & (self.team_frame.date == index_[1])].index
-            if len(game_indices_) == 3:
-                self.team_frame.at[game_indices_[1], 'is_doubleheader'] = 1
-                self.team_frame.at[game_indices_[2], 'is_tripleheader'] = 1
-            else:
-                print(index_)
+        self.team_frame = flag_doubleheaders(self.team_frame)
         self.all_home = self.team_frame[self.team_frame.is_home == 1].reset_index(drop = True)
         self.all_road = self.team_frame[self.team_frame.is_home == 0].reset_index(drop = True)
 
@@ -249,19 +280,9 @@ class FrameUpdater():
 
 
 if __name__ == "__main__":
-    since_1918 = []
-    for year in range(1918, 2020, 1):
-        updater = FrameUpdater(year)
-        try:
-            season_frame = updater.aggregate_frames()
-            since_1918.append(season_frame)
-            print('Season of {} collected'.format(year))
-        except (KeyboardInterrupt, SystemExit):
-            raise
-        except: 
-            print('There was an {} with {}'.format(sys.exc_info()[0], year))
-            continue
-    since_1918_df = pd.concat(since_1918, axis = 0, sort = False)
+    #all seasons in one pass with the cumulative engine
+    updater = FrameUpdater(range(1918, 2020, 1))
+    since_1918_df = updater.aggregate_frames()
     since_1918_df = since_1918_df.sort_values(by = ['date'])
     since_1918_df.to_csv('pre_elo.csv', index = False)
 
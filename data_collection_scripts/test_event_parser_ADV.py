@@ -0,0 +1,61 @@
+import json
+import os
+import pandas as pd
+import pytest
+from event_parser_ADV import EventParser
+'''
+Regression tests of the incremental event parser runs (season_manifest.py, game_sink.py)
+'''
+
+EVENT_HEADER = ['GAME_ID', 'AWAY_TEAM_ID', 'INN_CT', 'BAT_HOME_ID', 'OUTS_CT', 'FILLER1', 'RESP_PIT_ID', 'FILLER2',
+                'EVENT_TX', 'EVENT_CD', 'AB_FL', 'H_FL', 'EVENT_OUTS_CT', 'EVENT_RUNS_CT', 'RUN1_RESP_PIT_ID',
+                'RUN2_RESP_PIT_ID', 'RUN3_RESP_PIT_ID', 'GAME_PA_CT', 'RESP_PIT_START_FL', 'FILLER3']
+
+def write_season(event_dir, season, games):
+    '''
+    Write an event file of games where every batter strikes out except one solo home run by the home team
+    '''
+    rows = []
+    for k, (home, away) in enumerate(games):
+        game_id = '{}{}04{:02d}0'.format(home, season, k + 1)
+        pa = 0
+        for inning in range(1, 10):
+            for bat_home, pitcher in ((0, home + 'p0'), (1, away + 'p0')):
+                if inning == 9 and bat_home == 1:
+                    break
+                if inning == 1 and bat_home == 1:
+                    rows.append([game_id, away, inning, bat_home, 0, 'x', pitcher, 'y', 'HR/F78', 23, 'T', 4, 0, 1,
+                                 '', '', '', pa, 'T', 'z'])
+                    pa += 1
+                for outs in range(3):
+                    rows.append([game_id, away, inning, bat_home, outs, 'x', pitcher, 'y', 'K', 3, 'T', 0, 1, 0,
+                                 '', '', '', pa, 'T', 'z'])
+                    pa += 1
+    pd.DataFrame(rows).to_csv(os.path.join(event_dir, 'all{}.csv'.format(season)), header = False, index = False)
+
+@pytest.fixture
+def event_dir(tmp_path):
+    event_dir = tmp_path / 'parsed'
+    event_dir.mkdir()
+    write_season(str(event_dir), 2018, [('DET', 'CHA'), ('BOS', 'NYA')])
+    write_season(str(event_dir), 2019, [('CHA', 'DET'), ('NYA', 'BOS'), ('TOR', 'BAL')])
+    with open(str(event_dir / 'all_event_header.json'), 'w') as f:
+        json.dump(EVENT_HEADER, f)
+    return(event_dir)
+
+def parser(event_dir, output_dir, **kwargs):
+    return(EventParser(input_dir = str(event_dir / 'all*.csv'), output_dir = str(output_dir) + os.sep,
+                       event_header = str(event_dir / 'all_event_header.json'), n_jobs = 1, cache_dir = None,
+                       **kwargs))
+
+def test_new_output_format_is_filled(event_dir, tmp_path):
+    output_dir = tmp_path / 'adv_metrics'
+    parser(event_dir, output_dir).parse_events()
+    csv_games = pd.read_csv(str(output_dir / 'raw_game_data.csv.gz'))
+    assert len(csv_games) == 5
+    #turning on Parquet in a later run writes every season to the new format as well
+    parser(event_dir, output_dir, to_parquet = True).parse_events()
+    parquet_games = pd.read_parquet(str(output_dir / 'raw_game_data.parquet'))
+    assert len(parquet_games) == len(csv_games)
+    assert len(pd.read_csv(str(output_dir / 'raw_game_data.csv.gz'))) == len(csv_games)
+    assert sorted(parquet_games.date) == sorted(csv_games.date)
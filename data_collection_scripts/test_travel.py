@@ -0,0 +1,18 @@
+import pandas as pd
+from travel import team_travel, utc_offset
+'''
+Tests of the travel features (travel.py), longitudes are positive degrees west as in the game frames
+'''
+
+def test_utc_offset():
+    assert utc_offset([90.22, 73.95, 118.2]).tolist() == [-6, -5, -8]
+
+def test_tz_shift():
+    #St. Louis plays at home, then at New York (one time zone east), then at Los Angeles (three zones west of New York)
+    games = pd.DataFrame({'season' : [2019] * 3, 'team1' : ['SLN', 'NYA', 'LAN'], 'team2' : ['CHN', 'SLN', 'SLN'],
+                          'primary_latitude' : [38.6226, 40.8296, 34.0739],
+                          'primary_longitude' : [90.1928, 73.9262, 118.24]})
+    travel = team_travel(games)
+    assert travel[travel.team == 'SLN'].tz_shift.tolist() == [0.0, 1.0, -3.0]
+    #New York hosts St. Louis at home, no shift
+    assert travel[travel.team == 'NYA'].tz_shift.tolist() == [0.0]
@@ -0,0 +1,225 @@
+import glob
+import json
+import os
+import numpy as np
+import pandas as pd
+'''
+Travel features of every team-game, for the game frames used by feature_creator.py (team1 home, team2 road,
+primary_latitude / primary_longitude of the venue). Instead of calling a scalar haversine per game, a
+stadium-to-stadium distance matrix is built once (from the venues found in the games, optionally merged with the
+coordinates scraped by scraper_team_stadium.py) and every team's schedule is walked with array indexing: the distance
+traveled to a game is the matrix entry between the team's previous venue (its home stadium before the first game of a
+season) and the game's venue. Cumulative road trip distance and time zone shifts come from the same arrays.
+Longitudes follow the convention of the game frames and of the scraper: positive degrees west of Greenwich.
+'''
+
+STADIUM_DIR = './data/stadiums_coordinates'
+
+EARTH_RADIUS = 6378.137
+
+#game venues within this distance (km) of a scraped stadium are matched to the stadium
+MATCH_DISTANCE = 1.0
+
+#western edges (degrees longitude) of the North American standard time zones and their UTC offsets,
+#venues east of the last edge (outside North America) fall back to the nearest solar offset
+ZONE_EDGES = [-114.5, -101.0, -86.5, -67.5]
+
+ZONE_OFFSETS = [-8, -7, -6, -5]
+
+def haversine(latitude_1, longitude_1, latitude_2, longitude_2):
+    '''
+    Great circle distance in km, same formula as feature_creator.Team.haversine_distance, broadcast over arrays
+        Args:
+            - latitude_1, longitude_1, latitude_2, longitude_2 [numpy.ndarray]: coordinates in decimal degrees
+        Returns:
+            - [numpy.ndarray]: distances
+    '''
+    lat_1, lon_1, lat_2, lon_2 = (np.radians(x) for x in (latitude_1, longitude_1, latitude_2, longitude_2))
+    h = np.arcsin(np.sqrt(np.sin((lat_2 - lat_1) / 2)**2 + np.cos(lat_1) * np.cos(lat_2) * np.sin((lon_2 - lon_1) / 2)**2))
+    return(2 * EARTH_RADIUS * h)
+
+def utc_offset(longitude):
+    '''
+    Standard time UTC offset of venues from their longitude
+        Args:
+            - longitude [numpy.ndarray]: decimal degrees, positive west of Greenwich as in the game frames
+        Returns:
+            - [numpy.ndarray]: offsets in hours, e.g. -6 for St. Louis (90.2) and -5 for New York (74.0)
+    '''
+    #the zone table uses signed longitudes (negative west)
+    longitude = -np.asarray(longitude, dtype = 'float64')
+    zone = np.digitize(longitude, ZONE_EDGES)
+    offsets = np.array(ZONE_OFFSETS + [0], dtype = 'float64')[zone]
+    return(np.where(zone == len(ZONE_EDGES), np.round(longitude / 15) + 0.0, offsets))
+
+def load_stadiums(stadium_dir = STADIUM_DIR):
+    '''
+    Coordinates of every stadium scraped by scraper_team_stadium.py. The scraper stores longitudes as positive degrees
+    west, like the game frames, and they are returned unchanged. Stadiums without coordinates are dropped.
+        Args:
+            - stadium_dir [str]: output directory of the scraper ({team_code}.json files)
+        Returns:
+            - [pandas.DataFrame]: stadium_name, latitude and longitude, one row per stadium
+    '''
+    stadiums = []
+    for file in sorted(glob.glob(os.path.join(stadium_dir, '*.json'))):
+        with open(file) as f:
+            seasons = json.load(f)
+        for season in seasons:
+            k = 1
+            while 'stadium_name_{}'.format(k) in season:
+                stadiums.append({'stadium_name' : season['stadium_name_{}'.format(k)],
+                                 'latitude' : season['latitude_{}'.format(k)],
+                                 'longitude' : season['longitude_{}'.format(k)]})
+                k += 1
+    stadiums = pd.DataFrame(stadiums, columns = ['stadium_name', 'latitude', 'longitude'])
+    stadiums['latitude'] = pd.to_numeric(stadiums.latitude, errors = 'coerce')
+    stadiums['longitude'] = pd.to_numeric(stadiums.longitude, errors = 'coerce')
+    stadiums = stadiums.dropna().drop_duplicates('stadium_name')
+    return(stadiums.reset_index(drop = True))
+
+class StadiumDistances():
+    '''
+    Distance matrix between every pair of venues, venues are identified by their coordinates
+    '''
+    def __init__(self, latitudes, longitudes, tolerance = 0.0):
+        '''
+        Build the distance matrix of the distinct (latitude, longitude) pairs
+            Args:
+                - latitudes, longitudes [array-like]: venue coordinates in decimal degrees (longitude positive west),
+                    duplicates allowed
+                - tolerance [float]: km, coordinates not in the matrix are indexed as the nearest venue this close
+        '''
+        venues = pd.DataFrame({'latitude' : np.asarray(latitudes, dtype = 'float64'),
+                               'longitude' : np.asarray(longitudes, dtype = 'float64')}).dropna().drop_duplicates()
+        self.venues = pd.MultiIndex.from_frame(venues)
+        self.tolerance = tolerance
+        lat, lon = venues.latitude.to_numpy(), venues.longitude.to_numpy()
+        self.matrix = haversine(lat[:, None], lon[:, None], lat[None, :], lon[None, :])
+        self.offsets = utc_offset(lon)
+
+    @classmethod
+    def from_games(cls, games, stadiums = None, tolerance = MATCH_DISTANCE):
+        '''
+        Distance matrix of the scraped stadiums and every venue of games. Game venues within tolerance of a scraped
+        stadium are matched to the stadium instead of being added as venues of their own.
+            Args:
+                - games [pandas.DataFrame]: games with primary_latitude and primary_longitude columns
+                - stadiums [pandas.DataFrame]: load_stadiums() output, None for the venues of games only
+                - tolerance [float]: km between a game venue and the stadium it is matched to
+            Returns:
+                - [StadiumDistances]: distances
+        '''
+        latitudes, longitudes = games.primary_latitude.to_numpy(), games.primary_longitude.to_numpy()
+        if stadiums is None:
+            return(cls(latitudes, longitudes))
+        known = cls(stadiums.latitude.to_numpy(), stadiums.longitude.to_numpy(), tolerance)
+        unmatched = known.index(latitudes, longitudes) < 0
+        return(cls(np.concatenate([stadiums.latitude.to_numpy(), latitudes[unmatched]]),
+                   np.concatenate([stadiums.longitude.to_numpy(), longitudes[unmatched]]), tolerance))
+
+    def index(self, latitudes, longitudes):
+        '''
+        Matrix positions of venues, coordinates not in the matrix get the nearest venue within tolerance
+            Args:
+                - latitudes, longitudes [array-like]: venue coordinates
+            Returns:
+                - [numpy.ndarray]: positions, -1 for unknown or missing coordinates
+        '''
+        latitudes, longitudes = np.asarray(latitudes, dtype = 'float64'), np.asarray(longitudes, dtype = 'float64')
+        positions = self.venues.get_indexer(pd.MultiIndex.from_arrays([latitudes, longitudes]))
+        missing = (positions < 0) & ~np.isnan(latitudes) & ~np.isnan(longitudes)
+        if self.tolerance > 0 and missing.any() and len(self.venues) > 0:
+            #distances from each distinct unknown pair to every venue
+            pairs, inverse = np.unique(np.column_stack([latitudes[missing], longitudes[missing]]), axis = 0,
+                                       return_inverse = True)
+            distance = haversine(pairs[:, :1], pairs[:, 1:], self.venues.get_level_values(0).to_numpy()[None, :],
+                                 self.venues.get_level_values(1).to_numpy()[None, :])
+            nearest = distance.argmin(axis = 1)
+            nearest[distance[np.arange(len(pairs)), nearest] > self.tolerance] = -1
+            positions[missing] = nearest[inverse.ravel()]
+        return(positions)
+
+def team_travel(games, distances = None):
+    '''
+    Travel of every team to every game of its season, walking each team's schedule in the order of games
+        Args:
+            - games [pandas.DataFrame]: games with season, team1 (home), team2 (road), primary_latitude and
+                primary_longitude columns, in schedule order
+            - distances [StadiumDistances]: distance matrix, built from the venues of games if None
+        Returns:
+            - [pandas.DataFrame]: one row per team and game: game (row position in games), season, team, is_home,
+                distance_traveled (km from the previous venue, or from the home stadium for the first game),
+                trip_distance (km traveled since the last home game, 0 at home) and tz_shift (hours, positive
+                when moving east). Distances are NaN for venues without coordinates.
+    '''
+    if distances is None:
+        distances = StadiumDistances.from_games(games)
+    n = len(games)
+    venue = distances.index(games.primary_latitude, games.primary_longitude)
+    team_games = pd.DataFrame({'game' : np.tile(np.arange(n), 2),
+                               'season' : np.tile(games.season.to_numpy(), 2),
+                               'team' : np.concatenate([games.team1.to_numpy(), games.team2.to_numpy()]),
+                               'is_home' : np.repeat(np.array([1, 0]), n),
+                               'venue' : np.tile(venue, 2)})
+    codes = pd.factorize(pd.MultiIndex.from_frame(team_games[['season', 'team']]))[0]
+    order = np.lexsort((team_games.game.to_numpy(), codes))
+    team_games, codes = team_games.iloc[order].reset_index(drop = True), codes[order]
+    venue = team_games.venue.to_numpy()
+    is_home = team_games.is_home.to_numpy() == 1
+
+    #home stadium: the venue used most often for home games of the season (first used on ties)
+    known_home = is_home & (venue >= 0)
+    home_games = pd.DataFrame({'code' : codes[known_home], 'venue' : venue[known_home]})
+    home_counts = home_games.groupby(['code', 'venue'], sort = False).size().reset_index(name = 'n')
+    home_counts = home_counts.sort_values(['code', 'n'], ascending = [True, False], kind = 'stable')
+    home_counts = home_counts.drop_duplicates('code')
+    home_venue = np.full(codes.max() + 1 if n > 0 else 0, -1, dtype = 'int64')
+    home_venue[home_counts.code.to_numpy()] = home_counts.venue.to_numpy()
+
+    first_game = np.ones(len(team_games), dtype = bool)
+    first_game[1:] = codes[1:] != codes[:-1]
+    previous = np.empty(len(team_games), dtype = 'int64')
+    previous[1:] = venue[:-1]
+    previous[first_game] = home_venue[codes[first_game]]
+    #teams without a known home stadium start the season where they play their first game
+    previous[first_game & (previous < 0)] = venue[first_game & (previous < 0)]
+
+    known = (venue >= 0) & (previous >= 0)
+    distance = np.full(len(team_games), np.nan)
+    distance[known] = distances.matrix[previous[known], venue[known]]
+    tz_shift = np.full(len(team_games), np.nan)
+    tz_shift[known] = distances.offsets[venue[known]] - distances.offsets[previous[known]]
+
+    #road trips restart after every home game (and every new season)
+    position = np.arange(len(team_games))
+    cumulative = np.cumsum(np.nan_to_num(distance))
+    trip_start = np.maximum.accumulate(np.where(is_home | first_game, position, 0))
+    #distance before a trip: through the home game, or before the first game of the season
+    before_trip = np.where(is_home, cumulative, cumulative - np.nan_to_num(distance))
+    trip_distance = np.where(is_home, 0.0, cumulative - before_trip[trip_start])
+    trip_distance[~is_home & np.isnan(distance)] = np.nan
+
+    team_games['distance_traveled'] = distance
+    team_games['trip_distance'] = trip_distance
+    team_games['tz_shift'] = tz_shift
+    team_games = team_games.drop(columns = ['venue']).sort_values(['game', 'is_home'], ascending = [True, False])
+    return(team_games.reset_index(drop = True))
+
+def add_travel(games, distances = None):
+    '''
+    Add the travel of both teams to each game
+        Args:
+            - games [pandas.DataFrame]: see team_travel()
+            - distances [StadiumDistances]: distance matrix, built from the venues of games if None
+        Returns:
+            - [pandas.DataFrame]: games with travel_distance_hm/_rd, trip_distance_hm/_rd and tz_shift_hm/_rd columns
+    '''
+    travel = team_travel(games, distances)
+    games = games.copy()
+    for is_home, suffix in ((1, '_hm'), (0, '_rd')):
+        team = travel[travel.is_home == is_home]
+        games['travel_distance' + suffix] = team.distance_traveled.to_numpy()
+        games['trip_distance' + suffix] = team.trip_distance.to_numpy()
+        games['tz_shift' + suffix] = team.tz_shift.to_numpy()
+    return(games)
@@ -3,6 +3,45 @@ import pandas as pd
 import numpy as np 
 import matplotlib.pyplot as plt 
 
+ENGINES = ("vectorized", "loop")
+
+def get_plays(predict_proba):
+
+    # 1 = bet home, 0 = bet road, 2 = no play (three class models, no class strictly most likely)
+    predict_proba = np.asarray(predict_proba)
+
+    if predict_proba.ndim == 1:
+
+        return((predict_proba > 0.5).astype(np.int64))
+
+    if predict_proba.shape[1] <= 2:
+
+        return((predict_proba[:, 0] > 0.5).astype(np.int64))
+
+    home, road, other = predict_proba[:, 0], predict_proba[:, 1], predict_proba[:, 2]
+
+    return(np.where((home > road) & (home > other), 1, np.where((road > home) & (road > other), 0, 2)))
+
+def betting_outcomes(plays, labels, home_odds, road_odds, unit = 100, with_juice = False):
+
+    # Profit of every play from American odds, same rules as BankrollCalculator.play_all with engine = "loop"
+    plays, labels = np.asarray(plays), np.asarray(labels)
+
+    home_odds, road_odds = np.asarray(home_odds), np.asarray(road_odds)
+
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+
+        home_win = np.where(home_odds > 0, (home_odds / 100.) * unit, unit if with_juice else (100. / (-1 * home_odds)) * unit)
+
+        road_win = np.where(road_odds > 0, (road_odds / 100.) * unit, unit if with_juice else (100. / (-1 * road_odds)) * unit)
+
+    home_loss = np.where(with_juice & (home_odds < 0), (home_odds / 100.) * unit, -unit)
+
+    road_loss = np.where(with_juice & (road_odds < 0), (road_odds / 100.) * unit, -unit)
+
+    return(np.select([(plays == 1) & (labels == 1), plays == 1, (plays == 0) & (labels == 0), plays == 0],
+                     [home_win, home_loss, road_win, road_loss], 0.))
+
 @dataclass
 class BankrollCalculator():
     predict_proba: np.ndarray
@@ -20,6 +59,7 @@ class BankrollCalculator():
     fig_title: str = None
     save_fig: bool = False
     img_dest: str = None
+    engine: str = "vectorized"
 
     def plot_profit(self):
 
@@ -82,6 +122,25 @@ class BankrollCalculator():
     
     def play_all(self):
 
+        if self.engine not in ENGINES:
+
+            raise ValueError("Unknown engine: {}".format(self.engine))
+
+        if self.engine == "loop":
+
+            self.play_all_loop()
+
+            return
+
+        plays = get_plays(self.predict_proba)
+
+        self.plays = plays.tolist()
+
+        self.betting_outcomes.extend(betting_outcomes(plays, self.labels, self.home_odds, self.road_odds, self.unit,
+        self.with_juice).tolist())
+
+    def play_all_loop(self):
+
         self.get_plays()
 
         for k in range(len(self.plays)):